@@ -1,61 +1,170 @@
-from flask import Flask
+from flask import Flask, Response
 from flask_cors import CORS
 from flask_migrate import Migrate
 from models import db
 from routes.auth import auth_bp
 from routes.sms import sms_bp
+from routes.admin import admin_bp
+from routes.webhooks import webhooks_bp
+from services.devices import DeviceRouter
+from services.outbox import SMSOutbox
+from services.scheduler import SendScheduler
+from services.inbound import InboundPoller
+from services.delivery import DeliveryReconciler
+from services.api_logger import APIRequestLogger
+from services.archive import LogArchive, RetentionWorker
+from services.events import EventBroker
+from services.webhooks import WebhookDispatcher
+from services import events, rollups, webhooks
+from services import metrics
+from config import load_config
 from dotenv import load_dotenv
-import os
-import logging
+from logging_config import configure_logging
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Console output
-        logging.FileHandler('backend.log')  # File output
-    ]
-)
-
-app = Flask(__name__)
-app.logger.setLevel(logging.DEBUG)
-
-# Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///unifi_sms.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['JWT_SECRET_KEY'] = os.getenv('SMS_API_KEY', 'dev-jwt-secret-key-change-in-production')
-
-# Initialize extensions
-db.init_app(app)
-migrate = Migrate(app, db)
-CORS(app)
-
-# Register blueprints
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-app.register_blueprint(sms_bp, url_prefix='/api/sms')
-
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    return {'status': 'healthy', 'service': 'UniFi SMS Gateway API'}, 200
-
-@app.route('/', methods=['GET'])
-def root():
-    return {
-        'service': 'UniFi SMS Gateway API',
-        'version': '1.0.0',
-        'endpoints': {
-            'health': '/api/health',
-            'auth': '/api/auth',
-            'sms': '/api/sms'
-        }
-    }, 200
+# Configure logging (queue-based, levels and output from LOG_* env vars)
+configure_logging()
+
+migrate = Migrate()
+
+BACKGROUND_SERVICES = ('api_logger', 'sms_outbox', 'sms_scheduler', 'sms_inbound', 'sms_delivery', 'sms_archiver',
+                       'sms_events', 'webhook_dispatcher')
+
+
+def create_app(config=None):
+    """Build the Flask app. ``config`` (a dict) overrides values loaded from the environment."""
+    app = Flask(__name__)
+
+    # Configuration
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+
+    # Initialize extensions
+    db.init_app(app)
+    # Per-day message counts updated in the same transaction as each SMSLog write
+    rollups.install()
+    # Committed SMSLog inserts and status changes go out on the /api/sms/events stream
+    events.install()
+    # ...and are queued for webhook subscribers in the same transaction
+    webhooks.install()
+    migrate.init_app(app, db)
+    CORS(app)
+
+    # Register blueprints
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(sms_bp, url_prefix='/api/sms')
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(webhooks_bp, url_prefix='/api/webhooks')
+
+    # Request timing recorded to APILog in batches off the request path
+    APIRequestLogger().init_app(app)
+
+    # UniFi gateways (each with its own SSH session pool) per app, shared by routes and workers
+    devices = DeviceRouter.from_env()
+    app.extensions['unifi_devices'] = devices
+    app.extensions['unifi_service'] = devices.primary
+    # Send tokens live in the database so every gunicorn worker draws from the same bucket
+    with app.app_context():
+        for service in devices.services:
+            service.commands.share(db.engine)
+    sms_outbox = SMSOutbox(devices)
+    sms_outbox.init_app(app)
+    # Messages with a send_at wait in a timer heap and enter the outbox when due
+    SendScheduler(sms_outbox).init_app(app)
+    # Modem delivery reports move sent messages to delivered/failed
+    sms_delivery = DeliveryReconciler(devices)
+    sms_delivery.init_app(app)
+    InboundPoller(devices, reconciler=sms_delivery).init_app(app)
+
+    # SMS logs past SMS_RETENTION_DAYS move to compressed day files, still readable with ?archived=1
+    sms_archive = LogArchive()
+    app.extensions['sms_archive'] = sms_archive
+    RetentionWorker(sms_archive).init_app(app)
+
+    # One publisher per process for all open event streams
+    sms_events = EventBroker()
+    sms_events.init_app(app)
+
+    # Queued webhook deliveries POSTed by a bounded pool of worker threads
+    webhook_dispatcher = WebhookDispatcher()
+    webhook_dispatcher.init_app(app)
+
+    # Latency histograms and counters served at /api/metrics
+    metrics.init_app(app)
+    metrics.registry.gauge('sms_outbox_depth', 'Messages waiting in the outbox', callback=sms_outbox.depth)
+    metrics.registry.gauge('unifi_ssh_sessions_open', 'Open pooled SSH sessions per UniFi device', ['device'],
+                           callback=lambda: {(service.name,): service.pool_stats()['open'] for service in devices.services})
+    metrics.registry.gauge('unifi_device_circuit_open', 'Whether a UniFi device\'s circuit breaker is refusing calls', ['device'],
+                           callback=lambda: {(service.name,): int(service.breaker.state != 'closed') for service in devices.services})
+    metrics.registry.gauge('unifi_modem_queue_depth', 'cm commands waiting for a modem slot per UniFi device and lane',
+                           ['device', 'lane'],
+                           callback=lambda: {(service.name, lane): depth for service in devices.services
+                                             for lane, depth in service.commands.queued().items()})
+    metrics.registry.gauge('sms_event_streams', 'Open /api/sms/events streams in this process',
+                           callback=lambda: sms_events.stats()['streams'])
+    metrics.registry.gauge('webhook_queue_depth', 'Webhook events waiting for delivery', callback=webhook_dispatcher.depth)
+
+    register_routes(app)
+
+    if app.config['BACKGROUND_WORKERS']:
+        start_background_workers(app)
+    return app
+
+
+def start_background_workers(app):
+    """Start the outbox, scheduler, inbound poller, delivery reconciler, archiver, event, webhook and API-log writer threads of this process"""
+    for name in BACKGROUND_SERVICES:
+        app.extensions[name].start()
+
+
+def stop_background_workers(app):
+    for name in BACKGROUND_SERVICES:
+        app.extensions[name].shutdown()
+    for service in app.extensions['unifi_devices'].services:
+        service.pool.close_all()
+
+
+def register_routes(app):
+    @app.route('/api/health', methods=['GET'])
+    def health_check():
+        # Always 200 while the API is up; a device whose circuit is not closed makes it 'degraded'
+        devices = []
+        for service in app.extensions['unifi_devices'].services:
+            circuit = service.breaker.stats()
+            devices.append({
+                'name': service.name,
+                'circuit': circuit['state'],
+                'consecutive_failures': circuit['consecutive_failures'],
+                'retry_in': circuit['retry_in'],
+                'last_contact': circuit['last_contact']
+            })
+        status = 'healthy' if all(device['circuit'] == 'closed' for device in devices) else 'degraded'
+        return {'status': status, 'service': 'UniFi SMS Gateway API', 'devices': devices}, 200
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/', methods=['GET'])
+    def root():
+        return {
+            'service': 'UniFi SMS Gateway API',
+            'version': '1.0.0',
+            'endpoints': {
+                'health': '/api/health',
+                'metrics': '/api/metrics',
+                'auth': '/api/auth',
+                'sms': '/api/sms'
+            }
+        }, 200
+
 
 if __name__ == '__main__':
+    # Development server; production runs wsgi:app under gunicorn (see gunicorn.conf.py)
+    app = create_app()
     with app.app_context():
         db.create_all()
-    
+
     app.run(host='0.0.0.0', port=8585, debug=True)
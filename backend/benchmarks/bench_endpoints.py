@@ -0,0 +1,235 @@
+"""Benchmark the SMS log queries, stats and login against a large seeded database.
+
+Run from the backend directory, after seeding the database in DATABASE_URL
+with ``benchmarks/seed_db.py``:
+
+    python benchmarks/bench_endpoints.py [--requests 50] [--pages 20] [--scenarios history_first,logs_deep]
+        [--compare baseline.json]
+
+Requests go through the Flask test client, so the numbers are the app and
+database cost without network or server overhead. For each scenario the
+script reports requests/sec, p50/p90/p99 latency, rows/sec and the peak
+Python heap of one extra request traced with tracemalloc. Results are
+written as JSON to ``benchmarks/results`` (or ``--output``); with
+``--compare`` they are checked against an earlier run and the script exits
+non-zero on a regression.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('SMS_API_KEY', 'benchmark-api-key-0123456789abcdef')
+os.environ.setdefault('APILOG_ENABLED', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from reporting import latency_summary, write_results, compare
+from seed_db import SEED_EMAIL_DOMAIN
+
+
+def _rows(response):
+    body = response.get_json(silent=True) or {}
+    return len(body.get('items', ()))
+
+
+class Scenario:
+    """A named request pattern; ``requests()`` yields ``(method, url, kwargs)`` for each measured call"""
+
+    def __init__(self, name, requests, rows=_rows):
+        self.name = name
+        self.requests = requests
+        self.rows = rows
+
+
+def _cursor_walk(client, url, headers, pages):
+    """URLs of ``pages`` consecutive keyset pages, collected before timing starts"""
+    urls, cursor = [], None
+    for _ in range(pages):
+        page_url = f"{url}&cursor={quote(cursor)}" if cursor else url
+        urls.append(page_url)
+        cursor = client.get(page_url, headers=headers).get_json().get('next_cursor')
+        if not cursor:
+            break
+    return urls
+
+
+def build_scenarios(client, args, fixtures):
+    user_headers = {'Authorization': f"Bearer {fixtures['token']}"}
+    api_headers = {'auth': os.environ['SMS_API_KEY']}
+    limit = args.limit
+    month_ago = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%dT%H:%M:%S')
+    week_ago = (datetime.utcnow() - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%S')
+    year_ago = (datetime.utcnow() - timedelta(days=365)).strftime('%Y-%m-%dT%H:%M:%S')
+    rng = random.Random(args.seed)
+    logins = fixtures['logins']
+
+    def repeat(url, headers):
+        return lambda: (('GET', url, {'headers': headers}) for _ in range(args.requests))
+
+    def walk(url, headers):
+        urls = _cursor_walk(client, url, headers, args.pages)
+        return lambda: (('GET', page_url, {'headers': headers}) for page_url in urls)
+
+    def login_requests():
+        for _ in range(args.requests):
+            email, phone = rng.choice(logins)
+            yield 'POST', '/api/auth/login', {'json': {'email': email, 'phone_number': phone, 'shared_key': args.shared_key}}
+
+    history = f'/api/sms/history?limit={limit}'
+    logs = f'/api/sms/logs?limit={limit}'
+    export_rows = lambda response: response.get_data().count(b'\n')
+    stats_rows = lambda response: response.get_json()['total']
+    return [
+        Scenario('login', lambda: login_requests(), rows=lambda response: 1),
+        Scenario('history_first', repeat(history, user_headers)),
+        Scenario('history_deep', walk(history, user_headers)),
+        Scenario('history_status', repeat(f'{history}&status=failed', user_headers)),
+        Scenario('history_number', repeat(f"{history}&number={quote(fixtures['contact'])}", user_headers)),
+        Scenario('history_range', repeat(f'{history}&direction=sent&start={month_ago}', user_headers)),
+        Scenario('logs_first', repeat(logs, api_headers)),
+        Scenario('logs_deep', walk(logs, api_headers)),
+        Scenario('logs_received', repeat(f'{logs}&direction=received', api_headers)),
+        Scenario('logs_device_status', repeat(f'{logs}&device=gw-east&status=failed', api_headers)),
+        Scenario('logs_user', repeat(f"{logs}&user_id={fixtures['user_id']}", api_headers)),
+        Scenario('stats_user', repeat('/api/sms/stats?start=' + month_ago[:10], user_headers), rows=stats_rows),
+        Scenario('stats_all_year', repeat('/api/sms/logs/stats?interval=month&start=' + year_ago[:10], api_headers), rows=stats_rows),
+        Scenario('logs_export_week', lambda: (('GET', f'/api/sms/logs/export?start={week_ago}', {'headers': api_headers}) for _ in range(3)),
+                 rows=export_rows),
+    ]
+
+
+def load_fixtures(client, args):
+    """Pick the heaviest seeded user, a frequent contact and login identities from the database"""
+    from models import SMSLog, User, db
+
+    user_id, total = (
+        db.session.query(SMSLog.user_id, db.func.count(SMSLog.id))
+        .filter(SMSLog.user_id.isnot(None)).group_by(SMSLog.user_id)
+        .order_by(db.func.count(SMSLog.id).desc()).first()
+    ) or (None, 0)
+    if user_id is None:
+        sys.exit('No seeded SMS logs found; run benchmarks/seed_db.py first')
+    user = db.session.get(User, user_id)
+    contact = (
+        db.session.query(SMSLog.to_number).filter(SMSLog.user_id == user_id)
+        .group_by(SMSLog.to_number).order_by(db.func.count(SMSLog.id).desc()).limit(1).scalar()
+    )
+    logins = (
+        db.session.query(User.email, User.phone_number)
+        .filter(User.email.like(f'%@{SEED_EMAIL_DOMAIN}')).order_by(User.id).limit(1000).all()
+    )
+    response = client.post('/api/auth/login', json={
+        'email': user.email, 'phone_number': user.phone_number, 'shared_key': args.shared_key
+    })
+    if response.status_code != 200:
+        sys.exit(f"Login as {user.email} failed ({response.status_code}); check --shared-key")
+    return {
+        'user_id': user_id,
+        'user_rows': total,
+        'total_rows': db.session.query(db.func.count(SMSLog.id)).scalar(),
+        'contact': contact,
+        'logins': [tuple(login) for login in logins],
+        'token': response.get_json()['token'],
+    }
+
+
+def _call(client, method, url, kwargs, scenario):
+    response = client.open(url, method=method, **kwargs)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return scenario.rows(response)
+
+
+def run(client, scenario):
+    timings, rows = [], 0
+    started = time.perf_counter()
+    for method, url, kwargs in scenario.requests():
+        request_started = time.perf_counter()
+        rows += _call(client, method, url, kwargs, scenario)
+        timings.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    # One more request under tracemalloc, kept out of the timings it would distort
+    method, url, kwargs = next(iter(scenario.requests()))
+    tracemalloc.start()
+    try:
+        _call(client, method, url, kwargs, scenario)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, timings, rows, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per scenario')
+    parser.add_argument('--pages', type=int, default=20, help='cursor pages walked by the *_deep scenarios')
+    parser.add_argument('--limit', type=int, default=50, help='page size')
+    parser.add_argument('--scenarios', help='comma-separated subset of scenarios to run')
+    parser.add_argument('--shared-key', default=os.getenv('DEFAULT_SHARED_KEY', 'your-default-shared-key-for-user-registration'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='results file (default benchmarks/results/endpoints-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed fractional regression')
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+
+    app = create_app({'BACKGROUND_WORKERS': False})
+    client = app.test_client()
+    with app.app_context():
+        fixtures = load_fixtures(client, args)
+        scenarios = build_scenarios(client, args, fixtures)
+        if args.scenarios:
+            wanted = {name.strip() for name in args.scenarios.split(',') if name.strip()}
+            unknown = wanted - {scenario.name for scenario in scenarios}
+            if unknown:
+                parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+            scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+        database = app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]
+        db.session.remove()
+
+    print(f"{database}: {fixtures['total_rows']:,} logs, heaviest user {fixtures['user_id']} with {fixtures['user_rows']:,}\n")
+    print(f"{'scenario':<20} {'reqs':>5} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'rows/s':>10} {'peak KiB':>9}")
+    results = []
+    for scenario in scenarios:
+        elapsed, timings, rows, peak = run(client, scenario)
+        entry = {
+            'scenario': scenario.name,
+            'requests': len(timings),
+            'seconds': round(elapsed, 3),
+            'requests_per_sec': round(len(timings) / elapsed, 2) if elapsed else None,
+            **latency_summary(timings),
+            'rows': rows,
+            'rows_per_sec': round(rows / elapsed, 1) if elapsed else None,
+            'peak_memory_kib': round(peak / 1024, 1),
+        }
+        results.append(entry)
+        print(f"{scenario.name:<20} {entry['requests']:>5} {entry['requests_per_sec']:>8.1f} {entry['p50_ms']:>9.2f} "
+              f"{entry['p99_ms']:>9.2f} {entry['rows_per_sec']:>10.0f} {entry['peak_memory_kib']:>9.0f}")
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'shared_key')}
+    settings.update(database=database, total_rows=fixtures['total_rows'], user_rows=fixtures['user_rows'])
+    path = write_results('endpoints', settings, results, args.output)
+    print(f"\nResults written to {path}")
+
+    if args.compare:
+        regressions = compare(
+            results, args.compare, ('scenario',),
+            higher_is_better=('requests_per_sec', 'rows_per_sec'), lower_is_better=('p50_ms', 'p99_ms', 'peak_memory_kib'),
+            tolerance=args.tolerance
+        )
+        if regressions:
+            print(f"{regressions} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
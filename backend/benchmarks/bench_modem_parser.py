@@ -0,0 +1,70 @@
+"""Time the modem output parsers on a full mailbox.
+
+Run from the backend directory:
+
+    python benchmarks/bench_modem_parser.py [--messages 255] [--repeat 20]
+
+The parsers are checked against ``fixtures/modem`` by
+tests/backend/test_modem_parser.py.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.modem_parser import SMSListParser, parse_sms_list
+
+
+def build_mailbox(count):
+    """Synthetic ``sms list`` output for a mailbox with ``count`` messages"""
+    records = []
+    for slot in range(count):
+        text = f"Alert {slot}: link down on site {slot % 17}\nReply ACK to confirm"
+        records.append(
+            "-------\n"
+            f"ID: {slot}\n"
+            "Type: RX\n"
+            f"Sender: +1555{slot:07d}\n"
+            f"Timestamp: 24/03/18,{slot % 24:02d}:{slot % 60:02d}:00+04\n"
+            f"Text ({len(text)}): {text}\n"
+        )
+    return "".join(records)
+
+
+def bench(label, func, repeat, count):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parsed = func()
+        timings.append(time.perf_counter() - started)
+        assert len(parsed) == count, f"{label}: parsed {len(parsed)} of {count} messages"
+    best = min(timings)
+    print(f"{label:<12} best {best * 1000:8.3f} ms  mean {sum(timings) / len(timings) * 1000:8.3f} ms  {count / best:12.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=255, help='messages in the synthetic mailbox')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    mailbox = build_mailbox(args.messages)
+    lines = mailbox.splitlines(keepends=True)
+
+    def streaming():
+        stream = SMSListParser()
+        messages = [record for record in map(stream.feed_line, lines) if record]
+        last = stream.close()
+        if last:
+            messages.append(last)
+        return messages
+
+    print(f"\nParsing a {args.messages}-message mailbox ({len(mailbox)} bytes), {args.repeat} runs")
+    bench('full text', lambda: parse_sms_list(mailbox), args.repeat, args.messages)
+    bench('streaming', streaming, args.repeat, args.messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Benchmark the UniFi service layer against the local fake device.
+
+Run from the backend directory:
+
+    python benchmarks/bench_unifi_service.py [--messages 200] [--concurrency 1,4,16,64]
+        [--modes sync,bulk,async] [--latency 0.05] [--jitter 0.01] [--compare baseline.json]
+
+For each mode and concurrency level the script sends ``--messages`` SMS
+through a fresh service and reports sends/sec, p50/p90/p99 latency, errors
+and the SSH connections the device saw. Results are written as JSON to
+``benchmarks/results`` (or ``--output``); with ``--compare`` they are checked
+against an earlier run and the script exits non-zero on a regression.
+
+Modes: ``sync`` is UniFiSMSService.send_sms from a thread pool, ``bulk`` is
+send_bulk with ``--batch-size`` messages per call, ``async`` is
+AsyncUniFiSMSService.send_sms with that many concurrent tasks. Every mode
+goes through the device's command scheduler, so UNIFI_MODEM_CONCURRENCY and
+UNIFI_SEND_RATE_PER_MINUTE cap the throughput as they would in production.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.unifi_service import UniFiSMSService
+from services.async_unifi import AsyncUniFiSMSService
+from fake_unifi import FakeUniFiDevice
+from reporting import latency_summary, write_results, compare
+
+MODES = ('sync', 'bulk', 'async')
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    try:
+        func(*args)
+        return time.perf_counter() - started, None
+    except Exception as e:
+        return time.perf_counter() - started, e
+
+
+def run_sync(args, port, concurrency):
+    service = UniFiSMSService(host='127.0.0.1', port=port, username='bench', password='bench', pool_size=args.pool_size)
+    messages = [(f'+1555{index:07d}', f'Benchmark message {index}') for index in range(args.messages)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda message: _timed(service.send_sms, *message), messages))
+    elapsed = time.perf_counter() - started
+    pool = service.pool_stats()
+    service.pool.close_all()
+    return elapsed, [timing for timing, _ in outcomes], sum(1 for _, error in outcomes if error), pool['created']
+
+
+def run_bulk(args, port, concurrency):
+    service = UniFiSMSService(host='127.0.0.1', port=port, username='bench', password='bench', pool_size=args.pool_size)
+    messages = [(f'+1555{index:07d}', f'Benchmark message {index}') for index in range(args.messages)]
+    batches = [messages[start:start + args.batch_size] for start in range(0, len(messages), args.batch_size)]
+    failed = 0
+
+    def send(batch):
+        nonlocal failed
+        timing, error = _timed(lambda: results.extend(service.send_bulk(batch)))
+        if error:
+            failed += len(batch)
+        # Every message in a batch completes when the batch does
+        return [timing] * len(batch)
+
+    results = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = [timing for batch_timings in executor.map(send, batches) for timing in batch_timings]
+    elapsed = time.perf_counter() - started
+    failed += sum(1 for result in results if not result['success'])
+    pool = service.pool_stats()
+    service.pool.close_all()
+    return elapsed, timings, failed, pool['created']
+
+
+def run_async(args, port, concurrency):
+    async def bench():
+        service = AsyncUniFiSMSService(
+            host='127.0.0.1', port=port, username='bench', password='bench',
+            connections=args.async_connections, channels=args.async_channels
+        )
+        limit = asyncio.Semaphore(concurrency)
+        timings, errors = [], 0
+
+        async def send(index):
+            nonlocal errors
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    await service.send_sms(f'+1555{index:07d}', f'Benchmark message {index}')
+                except Exception:
+                    errors += 1
+                timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(index) for index in range(args.messages)))
+        elapsed = time.perf_counter() - started
+        opened = service.stats()['open']
+        await service.close()
+        return elapsed, timings, errors, opened
+
+    return asyncio.run(bench())
+
+
+RUNNERS = {'sync': run_sync, 'bulk': run_bulk, 'async': run_async}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--concurrency', default='1,4,16,64', help='comma-separated concurrency levels')
+    parser.add_argument('--modes', default=','.join(MODES), help=f"comma-separated, from {', '.join(MODES)}")
+    parser.add_argument('--pool-size', type=int, default=4, help='SSH sessions in the blocking service pool')
+    parser.add_argument('--batch-size', type=int, default=50, help='messages per send_bulk call')
+    parser.add_argument('--async-connections', type=int, default=2)
+    parser.add_argument('--async-channels', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake device seconds per cm command')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--connect-latency', type=float, default=0.1)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--modem-concurrency', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='results file (default benchmarks/results/unifi_service-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed fractional regression')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    results = []
+    print(f"{args.messages} messages per run, device latency {args.latency}s +/- {args.jitter}s\n")
+    print(f"{'mode':<6} {'conc':>5} {'sends/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'ssh conns':>10} {'peak chans':>11}")
+    for mode in modes:
+        for concurrency in levels:
+            device = FakeUniFiDevice(
+                username='bench', password='bench', latency=args.latency, jitter=args.jitter,
+                connect_latency=args.connect_latency, fail_rate=args.fail_rate,
+                modem_concurrency=args.modem_concurrency, seed=args.seed
+            )
+            port = device.start_in_thread()
+            try:
+                elapsed, timings, errors, client_connections = RUNNERS[mode](args, port, concurrency)
+            finally:
+                device.stop()
+            stats = device.stats()
+            entry = {
+                'mode': mode,
+                'concurrency': concurrency,
+                'messages': args.messages,
+                'seconds': round(elapsed, 3),
+                'sends_per_sec': round(args.messages / elapsed, 2),
+                **latency_summary(timings),
+                'errors': errors,
+                'ssh_connections': stats['connections'],
+                'client_connections': client_connections,
+                'peak_channels': stats['peak_channels'],
+                'cm_commands': stats['cm_commands'],
+            }
+            results.append(entry)
+            print(f"{mode:<6} {concurrency:>5} {entry['sends_per_sec']:>9.1f} {entry['p50_ms']:>9.1f} {entry['p99_ms']:>9.1f} "
+                  f"{errors:>7} {entry['ssh_connections']:>10} {entry['peak_channels']:>11}")
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    path = write_results('unifi_service', settings, results, args.output)
+    print(f"\nResults written to {path}")
+
+    if args.compare:
+        regressions = compare(
+            results, args.compare, ('mode', 'concurrency'),
+            higher_is_better=('sends_per_sec',), lower_is_better=('p50_ms', 'p99_ms', 'ssh_connections'),
+            tolerance=args.tolerance
+        )
+        if regressions:
+            print(f"{regressions} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
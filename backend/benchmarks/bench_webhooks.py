@@ -0,0 +1,160 @@
+"""Benchmark webhook delivery against the local fake receiver.
+
+Run from the backend directory:
+
+    python benchmarks/bench_webhooks.py [--events 2000] [--workers 1,4,16] [--batch-sizes 1,20]
+        [--latency 0.02] [--fail-rate 0.05] [--compare baseline.json]
+
+For each worker count and batch size the script queues ``--events`` inbound
+messages through the ORM (so the webhook hook queues them as in
+production), runs a WebhookDispatcher until the receiver has every event
+and reports events/sec, p50/p99 queue-to-receipt lag, POSTs, retries and
+the TCP connections the receiver saw. The database is a temporary SQLite
+file unless DATABASE_URL is set. Results are written as JSON to
+``benchmarks/results`` (or ``--output``); with ``--compare`` they are checked
+against an earlier run and the script exits non-zero on a regression.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Retries log a warning each; keep them out of the results table
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('LOG_FILE', '')
+os.environ.setdefault('APILOG_ENABLED', 'false')
+
+from fake_webhook import FakeWebhookReceiver
+from reporting import latency_summary, write_results, compare
+
+
+def _ints(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def queue_events(count, chunk=500):
+    from models import SMSLog, db
+
+    for offset in range(0, count, chunk):
+        db.session.add_all([
+            SMSLog(to_number='+15550000000', from_number=f'+1444{index:07d}', message=f'Benchmark inbound {index}',
+                   direction='received', status='received', device='bench')
+            for index in range(offset, min(offset + chunk, count))
+        ])
+        db.session.commit()
+
+
+def run(app, args, workers, batch_size):
+    from models import SMSLog, WebhookDeadLetter, WebhookDelivery, WebhookSubscription, db
+    from services.webhooks import WebhookDispatcher, invalidate_subscriptions
+
+    receiver = FakeWebhookReceiver(latency=args.latency, fail_rate=args.fail_rate, secret='bench-secret').start_in_thread()
+    dispatcher = WebhookDispatcher(workers=workers, poll_interval=0.05, backoff_base=0.05, backoff_max=0.5,
+                                   max_attempts=args.max_attempts)
+    dispatcher.init_app(app)
+    with app.app_context():
+        for model in (WebhookDelivery, WebhookDeadLetter, WebhookSubscription, SMSLog):
+            db.session.execute(model.__table__.delete())
+        db.session.add(WebhookSubscription(url=receiver.url, events='inbound', batch_size=batch_size, secret='bench-secret'))
+        db.session.commit()
+        invalidate_subscriptions()
+        queue_events(args.events)
+        dead = lambda: db.session.query(db.func.count(WebhookDeadLetter.id)).scalar()
+
+        receiver.expect(args.events)
+        started = time.perf_counter()
+        dispatcher.start()
+        receiver.all_received.wait(args.timeout)
+        elapsed = time.perf_counter() - started
+        dispatcher.shutdown()
+        dead_letters = dead()
+        db.session.remove()
+    receiver.stop()
+
+    stats = receiver.stats()
+    # created_at is naive UTC
+    lags = [received - datetime.fromisoformat(created).replace(tzinfo=timezone.utc).timestamp()
+            for _id, created, received in receiver.received]
+    return elapsed, lags, stats, dead_letters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--workers', type=_ints, default=[1, 4, 16], help='comma-separated dispatcher worker counts')
+    parser.add_argument('--batch-sizes', type=_ints, default=[1, 20], help='comma-separated subscription batch sizes')
+    parser.add_argument('--latency', type=float, default=0.02, help='receiver response delay in seconds')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of POSTs the receiver answers with 503')
+    parser.add_argument('--max-attempts', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for every event in one run')
+    parser.add_argument('--output', help='results file (default benchmarks/results/webhooks-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed fractional regression')
+    args = parser.parse_args()
+
+    tmpdir = None
+    if not os.getenv('DATABASE_URL'):
+        tmpdir = tempfile.TemporaryDirectory()
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir.name, 'bench_webhooks.db')}"
+
+    from app import create_app
+    from models import db
+
+    app = create_app({'BACKGROUND_WORKERS': False})
+    with app.app_context():
+        db.create_all()
+        database = app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]
+
+    print(f"{database}: {args.events:,} events per run, receiver latency {args.latency}s, fail rate {args.fail_rate}\n")
+    print(f"{'workers':>7} {'batch':>5} {'events/s':>9} {'p50 lag ms':>11} {'p99 lag ms':>11} {'posts':>6} "
+          f"{'retried':>7} {'dead':>5} {'conns':>5}")
+    results = []
+    for workers in args.workers:
+        for batch_size in args.batch_sizes:
+            elapsed, lags, stats, dead_letters = run(app, args, workers, batch_size)
+            summary = latency_summary(lags)
+            entry = {
+                'workers': workers,
+                'batch_size': batch_size,
+                'seconds': round(elapsed, 3),
+                'events': stats['distinct'],
+                'events_per_sec': round(stats['distinct'] / elapsed, 1) if elapsed else None,
+                'lag_p50_ms': summary['p50_ms'],
+                'lag_p99_ms': summary['p99_ms'],
+                'posts': stats['posts'],
+                'retried_posts': stats['failed'],
+                'duplicates': stats['duplicates'],
+                'dead_letters': dead_letters,
+                'connections': stats['connections'],
+            }
+            results.append(entry)
+            print(f"{workers:>7} {batch_size:>5} {entry['events_per_sec']:>9.1f} {entry['lag_p50_ms'] or 0:>11.1f} "
+                  f"{entry['lag_p99_ms'] or 0:>11.1f} {entry['posts']:>6} {entry['retried_posts']:>7} "
+                  f"{dead_letters:>5} {entry['connections']:>5}")
+            if stats['distinct'] + dead_letters < args.events:
+                print(f"  only {stats['distinct']:,} of {args.events:,} events arrived within {args.timeout}s")
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    settings.update(database=database)
+    path = write_results('webhooks', settings, results, args.output)
+    print(f"\nResults written to {path}")
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+    if args.compare:
+        regressions = compare(
+            results, args.compare, ('workers', 'batch_size'),
+            higher_is_better=('events_per_sec',), lower_is_better=('lag_p50_ms', 'lag_p99_ms'),
+            tolerance=args.tolerance
+        )
+        if regressions:
+            print(f"{regressions} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""Local stand-in for a UniFi LTE gateway, for benchmarks and manual testing without hardware.
+
+Run from the backend directory:
+
+    python benchmarks/fake_unifi.py [--port 2222] [--latency 0.2] [--jitter 0.05] [--fail-rate 0.01]
+
+then point the API at it with UNIFI_HOST=127.0.0.1, UNIFI_SSH_PORT=2222 and
+any UNIFI_USERNAME/UNIFI_PASSWORD (or those given with --username/--password).
+
+The SSH server accepts ``ifconfig usb0 up`` and the ``ssh -y root@$(cat
+/var/run/topipv6)`` hop to the modem, either with one quoted ``cm`` command
+or with ``sh`` and a batch script on stdin. The emulated ``cm`` understands
+``sms send|count|list|clear``, ``info all``, ``sim info`` and ``temp all``;
+status output comes from ``fixtures/modem``. ``sms send`` prints a message
+reference and, with ``--report-rate``, stores a delivery status report for
+it alongside received messages. ``--modem-down`` makes the hop to the modem
+fail as it does when ``usb0`` is down.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import shlex
+import threading
+import time
+from datetime import datetime
+
+import asyncssh
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'modem')
+
+HOP = "ssh -y root@$(cat /var/run/topipv6) "
+CM_BINARY = "/legato/systems/current/bin/cm"
+
+# One line of a batch script as written by services.unifi_service.BatchOutput
+BATCH_LINE = re.compile(r"^(?P<command>.*?); rc=\$\?; printf '(?P<out>[^']*)' \$rc; printf '(?P<err>[^']*)' >&2$")
+
+STATUS_FIXTURES = {
+    ('info', 'all'): 'info_all.txt',
+    ('sim', 'info'): 'sim_info.txt',
+    ('temp', 'all'): 'temp_all.txt',
+}
+
+
+def _printf(fmt, value=None):
+    text = fmt.replace('\\n', '\n')
+    return text.replace('%d', str(value)) if value is not None else text
+
+
+class FakeModem:
+    """State and output of the emulated ``cm`` tool"""
+
+    def __init__(self, fail_rate=0.0, rng=None, report_rate=0.0, undelivered_rate=0.0):
+        self.fail_rate = fail_rate
+        self.report_rate = report_rate
+        self.undelivered_rate = undelivered_rate
+        self.rng = rng or random.Random()
+        self.inbox = []
+        self.sent = 0
+        self.failed = 0
+        self._next_id = 0
+        self._next_reference = 0
+        self._status = {}
+        for key, name in STATUS_FIXTURES.items():
+            with open(os.path.join(FIXTURES, name)) as f:
+                self._status[key] = f.read()
+
+    def receive(self, sender, text, timestamp=None):
+        """Put a message in the modem's storage, as if it had arrived over the air"""
+        timestamp = timestamp or datetime.utcnow().strftime('%y/%m/%d,%H:%M:%S+00')
+        self.inbox.append({'id': self._next_id, 'sender': sender, 'timestamp': timestamp, 'text': text})
+        self._next_id += 1
+
+    def report(self, recipient, reference, status):
+        """Store a delivery status report, as the network sends for a message with a status report request"""
+        timestamp = datetime.utcnow().strftime('%y/%m/%d,%H:%M:%S+00')
+        self.inbox.append({'id': self._next_id, 'recipient': recipient, 'reference': reference,
+                           'status': status, 'timestamp': timestamp})
+        self._next_id += 1
+
+    def _listing(self, message):
+        if 'reference' in message:
+            return (
+                "-------\n"
+                f"ID: {message['id']}\n"
+                "Type: SR\n"
+                f"Recipient: {message['recipient']}\n"
+                f"Reference: {message['reference']}\n"
+                f"Status: {message['status']}\n"
+                f"Timestamp: {message['timestamp']}\n"
+            )
+        return (
+            "-------\n"
+            f"ID: {message['id']}\n"
+            "Type: RX\n"
+            f"Sender: {message['sender']}\n"
+            f"Timestamp: {message['timestamp']}\n"
+            f"Text ({len(message['text'])}): {message['text']}\n"
+        )
+
+    def run(self, args):
+        """Run ``cm <args>``; returns ``(stdout, stderr, exit_code)``"""
+        key = tuple(args[:2])
+        if key in self._status:
+            return self._status[key], '', 0
+        if key == ('sms', 'send'):
+            if len(args) < 4:
+                return '', 'Usage: cm sms send <number> <message>\n', 1
+            if self.rng.random() < self.fail_rate:
+                self.failed += 1
+                return '', 'Failed to send SMS\n', 1
+            self.sent += 1
+            # TP-MR is one byte and wraps
+            reference = self._next_reference
+            self._next_reference = (self._next_reference + 1) % 256
+            if self.report_rate and self.rng.random() < self.report_rate:
+                self.report(args[2], reference, 'FAILED' if self.rng.random() < self.undelivered_rate else 'DELIVERED')
+            return f'Message sent to {args[2]}, reference {reference}\n', '', 0
+        if key == ('sms', 'count'):
+            return f'{len(self.inbox)}\n', '', 0
+        if key == ('sms', 'list'):
+            return ''.join(self._listing(message) for message in self.inbox), '', 0
+        if key == ('sms', 'clear'):
+            self.inbox = []
+            return '', '', 0
+        return '', f"cm: unknown command {' '.join(args)}\n", 1
+
+
+class FakeUniFiDevice:
+    """asyncssh server emulating the gateway, with latency, jitter and failure injection.
+
+    ``latency``/``jitter`` apply to every ``cm`` command (uniformly drawn from
+    latency +/- jitter) and ``connect_latency`` to every login. ``fail_rate``
+    makes ``sms send`` fail, ``drop_rate`` closes the channel without an exit
+    status and ``disconnect_rate`` drops the whole SSH connection.
+    ``report_rate`` of successful sends get a status report, of which
+    ``undelivered_rate`` say FAILED. While ``modem_down`` is set (it can be
+    toggled at runtime) the gateway still answers but the hop to the modem
+    exits 255.
+    ``modem_concurrency`` limits how many ``cm`` commands run at once (0 for
+    no limit; a real modem handles one AT command at a time).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, username=None, password=None, latency=0.0, jitter=0.0,
+                 connect_latency=0.0, fail_rate=0.0, drop_rate=0.0, disconnect_rate=0.0,
+                 modem_concurrency=0, inbox=0, seed=None, report_rate=0.0, undelivered_rate=0.0, modem_down=False):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.connect_latency = connect_latency
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.modem_concurrency = modem_concurrency
+        self.modem_down = modem_down
+        self.rng = random.Random(seed)
+        self.modem = FakeModem(fail_rate=fail_rate, rng=self.rng, report_rate=report_rate, undelivered_rate=undelivered_rate)
+        for index in range(inbox):
+            self.modem.receive(f'+1555{index:07d}', f'Inbound message {index}')
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._modem_slots = None
+        self._counters = {
+            'connections': 0,
+            'active_connections': 0,
+            'peak_connections': 0,
+            'channels': 0,
+            'active_channels': 0,
+            'peak_channels': 0,
+            'cm_commands': 0,
+            'dropped_channels': 0,
+            'disconnects': 0,
+        }
+
+    def _count(self, name, delta=1):
+        self._counters[name] += delta
+        if name in ('active_connections', 'active_channels'):
+            peak = name.replace('active', 'peak')
+            self._counters[peak] = max(self._counters[peak], self._counters[name])
+
+    def stats(self):
+        return {**self._counters, 'sms_sent': self.modem.sent, 'sms_failed': self.modem.failed, 'inbox': len(self.modem.inbox)}
+
+    def _server_factory(self):
+        device = self
+
+        class Server(asyncssh.SSHServer):
+            def connection_made(self, conn):
+                device._count('connections')
+                device._count('active_connections')
+
+            def connection_lost(self, exc):
+                device._count('active_connections', -1)
+
+            def begin_auth(self, username):
+                return True
+
+            def password_auth_supported(self):
+                return True
+
+            async def validate_password(self, username, password):
+                if device.connect_latency:
+                    await asyncio.sleep(device.connect_latency)
+                return ((device.username is None or username == device.username) and
+                        (device.password is None or password == device.password))
+
+        return Server
+
+    async def _delay(self):
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _cm(self, args):
+        self._counters['cm_commands'] += 1
+        if self._modem_slots is None:
+            await self._delay()
+            return self.modem.run(args)
+        async with self._modem_slots:
+            await self._delay()
+            return self.modem.run(args)
+
+    async def _modem_command(self, command):
+        """A command run on the modem behind the hop: one cm invocation or a batch script"""
+        args = shlex.split(command)
+        if args and args[0] == CM_BINARY:
+            return await self._cm(args[1:])
+        return '', f"sh: {args[0] if args else ''}: not found\n", 127
+
+    async def _batch(self, script):
+        out, err = [], []
+        for line in script.splitlines():
+            match = BATCH_LINE.match(line)
+            if match:
+                stdout, stderr, rc = await self._modem_command(match['command'])
+                out.append(stdout + _printf(match['out'], rc))
+                err.append(stderr + _printf(match['err']))
+            elif line.strip():
+                stdout, stderr, _rc = await self._modem_command(line)
+                out.append(stdout)
+                err.append(stderr)
+        return ''.join(out), ''.join(err), 0
+
+    async def _handle(self, process):
+        self._count('channels')
+        self._count('active_channels')
+        try:
+            command = process.command or ''
+            if self.rng.random() < self.disconnect_rate:
+                self._counters['disconnects'] += 1
+                process.get_extra_info('connection').close()
+                return
+            if command.startswith('ifconfig '):
+                out, err, rc = '', '', 0
+            elif command.startswith(HOP) and self.modem_down:
+                out, err, rc = '', "ssh: connect to host fe80::1%usb0 port 22: Network is unreachable\n", 255
+            elif command.startswith(HOP):
+                inner = shlex.split(command[len(HOP):])
+                if inner == ['sh']:
+                    out, err, rc = await self._batch(await process.stdin.read())
+                else:
+                    out, err, rc = await self._modem_command(inner[0] if inner else '')
+            else:
+                out, err, rc = '', f"sh: {command.split()[0] if command else ''}: not found\n", 127
+            if self.rng.random() < self.drop_rate:
+                self._counters['dropped_channels'] += 1
+                process.close()
+                return
+            process.stdout.write(out)
+            process.stderr.write(err)
+            process.exit(rc)
+        finally:
+            self._count('active_channels', -1)
+
+    async def start(self):
+        """Start listening on the running loop; returns the bound port"""
+        if self.modem_concurrency:
+            self._modem_slots = asyncio.Semaphore(self.modem_concurrency)
+        self._server = await asyncssh.create_server(
+            self._server_factory(), self.host, self.port,
+            server_host_keys=[asyncssh.generate_private_key('ssh-ed25519')],
+            process_factory=self._handle, encoding='utf-8'
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def start_in_thread(self):
+        """Run the device on its own event loop thread; returns the bound port"""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='fake-unifi', daemon=True)
+        self._thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start(), self._loop).result()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
+        self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per cm command')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--connect-latency', type=float, default=0.2, help='seconds per SSH login')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of sms send that fail')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of channels closed without exit status')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help='fraction of commands that drop the connection')
+    parser.add_argument('--modem-concurrency', type=int, default=0, help='cm commands run at once (0 = unlimited)')
+    parser.add_argument('--inbox', type=int, default=3, help='messages stored on the modem at start')
+    parser.add_argument('--report-rate', type=float, default=0.0, help='fraction of sent messages that get a status report')
+    parser.add_argument('--undelivered-rate', type=float, default=0.0, help='fraction of status reports that say FAILED')
+    parser.add_argument('--modem-down', action='store_true', help='fail every command as if the usb0 link were down')
+    args = parser.parse_args()
+
+    device = FakeUniFiDevice(
+        host=args.host, port=args.port, username=args.username, password=args.password,
+        latency=args.latency, jitter=args.jitter, connect_latency=args.connect_latency,
+        fail_rate=args.fail_rate, drop_rate=args.drop_rate, disconnect_rate=args.disconnect_rate,
+        modem_concurrency=args.modem_concurrency, inbox=args.inbox,
+        report_rate=args.report_rate, undelivered_rate=args.undelivered_rate, modem_down=args.modem_down
+    )
+
+    async def serve():
+        port = await device.start()
+        print(f"Fake UniFi device listening on {args.host}:{port}")
+        try:
+            while True:
+                await asyncio.sleep(30)
+                print(device.stats())
+        finally:
+            await device.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(device.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Local stand-in for a webhook receiver, for benchmarks and manual testing of webhook delivery.
+
+Run from the backend directory:
+
+    python benchmarks/fake_webhook.py [--port 8686] [--latency 0.05] [--fail-rate 0.1] [--secret s3cret]
+
+then register it with ``POST /api/webhooks {"url": "http://127.0.0.1:8686/hook"}``.
+The server speaks HTTP/1.1 keep-alive, answers 503 to ``--fail-rate`` of
+POSTs, checks X-Webhook-Signature when ``--secret`` is given (401 on a
+mismatch) and prints a line per batch with its events and the running
+totals of events, duplicates and connections.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def verify(secret, header, body):
+    """Check an X-Webhook-Signature (``t=<timestamp>,v1=<hex>``) against the body"""
+    try:
+        parts = dict(part.split('=', 1) for part in (header or '').split(','))
+        expected = hmac.new(secret.encode('utf-8'), f"{parts['t']}.".encode('utf-8') + body, hashlib.sha256).hexdigest()
+    except (KeyError, ValueError):
+        return False
+    return hmac.compare_digest(expected, parts.get('v1', ''))
+
+
+class FakeWebhookReceiver:
+    """Threaded HTTP server recording the events POSTed to it"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, secret=None, verbose=False, rng=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.secret = secret
+        self.verbose = verbose
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.seen = set()
+        self.received = []  # (event id, created_at, received at)
+        self.counters = {'posts': 0, 'events': 0, 'duplicates': 0, 'failed': 0, 'rejected': 0, 'connections': 0}
+        self.all_received = threading.Event()
+        self.expected = None
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/hook'
+
+    def expect(self, count):
+        """Set all_received once ``count`` distinct events have arrived"""
+        with self._lock:
+            self.expected = count
+            if len(self.seen) >= count:
+                self.all_received.set()
+            else:
+                self.all_received.clear()
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self.counters[name] += delta
+
+    def _record(self, events):
+        now = time.time()
+        with self._lock:
+            for item in events:
+                if item['id'] in self.seen:
+                    self.counters['duplicates'] += 1
+                    continue
+                self.seen.add(item['id'])
+                self.received.append((item['id'], item.get('created_at'), now))
+            self.counters['events'] += len(events)
+            if self.expected is not None and len(self.seen) >= self.expected:
+                self.all_received.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, distinct=len(self.seen))
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                receiver._count('connections')
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+                receiver._count('posts')
+                if receiver.latency:
+                    time.sleep(receiver.latency)
+                if receiver.secret and not verify(receiver.secret, self.headers.get('X-Webhook-Signature'), body):
+                    receiver._count('rejected')
+                    return self._reply(401, b'bad signature')
+                if receiver.fail_rate and receiver.rng.random() < receiver.fail_rate:
+                    receiver._count('failed')
+                    return self._reply(503)
+                events = json.loads(body)['events']
+                receiver._record(events)
+                if receiver.verbose:
+                    names = ', '.join(f"{item['event']}#{item['id']}" for item in events)
+                    print(f"{len(events)} event(s): {names}  {receiver.stats()}")
+                self._reply(204)
+
+        return Handler
+
+    def start_in_thread(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-webhook', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8686)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of POSTs answered with 503')
+    parser.add_argument('--secret', help='verify X-Webhook-Signature with this secret')
+    args = parser.parse_args()
+
+    receiver = FakeWebhookReceiver(args.host, args.port, args.latency, args.fail_rate, args.secret, verbose=True)
+    print(f"Fake webhook receiver at {receiver.url}")
+    try:
+        receiver._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Shared helpers for the benchmark scripts: latency summaries and JSON results with baseline comparison"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+# The same interpolation /api/admin/api-logs/percentiles reports; callers put the backend on sys.path
+from services.metrics import percentile
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def latency_summary(timings):
+    """p50/p90/p99/max in milliseconds from durations in seconds"""
+    ordered = sorted(timings)
+    summary = {}
+    for key, fraction in (('p50_ms', 0.5), ('p90_ms', 0.9), ('p99_ms', 0.99), ('max_ms', 1.0)):
+        value = percentile(ordered, fraction)
+        summary[key] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name, settings, results, path=None):
+    """Store results with the run's environment; returns the file path"""
+    started = datetime.now(timezone.utc)
+    payload = {
+        'benchmark': name,
+        'timestamp': started.isoformat(),
+        'git_commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results,
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{started.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2)
+    return path
+
+
+def compare(results, baseline_path, key_fields, higher_is_better=(), lower_is_better=(), tolerance=0.1):
+    """Print each metric against a baseline results file; returns the number of regressions.
+
+    A metric regresses when it is more than ``tolerance`` (a fraction) worse
+    than the baseline run with the same ``key_fields``.
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {tuple(entry.get(field) for field in key_fields): entry for entry in baseline['results']}
+    regressions = 0
+    print(f"\nCompared with {baseline_path} ({baseline.get('git_commit') or 'unknown commit'}, tolerance {tolerance:.0%})")
+    for entry in results:
+        key = tuple(entry.get(field) for field in key_fields)
+        old = previous.get(key)
+        label = ' '.join(f'{field}={value}' for field, value in zip(key_fields, key))
+        if old is None:
+            print(f"  {label}: no baseline")
+            continue
+        for metric in (*higher_is_better, *lower_is_better):
+            before, after = old.get(metric), entry.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if metric in higher_is_better else change
+            flag = 'REGRESSION' if worse > tolerance else ''
+            regressions += bool(flag)
+            print(f"  {label} {metric}: {before} -> {after} ({change:+.1%}) {flag}")
+    return regressions
@@ -0,0 +1,169 @@
+"""Bulk-generate users and SMS logs for benchmarking the log queries at production sizes.
+
+Run from the backend directory against the database in DATABASE_URL (SQLite
+or Postgres):
+
+    python benchmarks/seed_db.py [--users 5000] [--logs 2000000] [--days 365] [--truncate]
+
+Rows are written with chunked executemany INSERTs through SQLAlchemy Core.
+Seeded users share one bcrypt hash of ``--shared-key``, so the run is not
+dominated by password hashing. Message ownership is skewed so a few users
+have very long histories, as in production.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+
+SEED_EMAIL_DOMAIN = 'seed.example.com'
+DEVICES = ('gw-east', 'gw-west', 'default')
+STATUSES_SENT = (('sent', 0.9), ('failed', 0.04), ('delivered', 0.06))
+WORDS = ('alert', 'site', 'link', 'down', 'restored', 'maintenance', 'tonight', 'reply', 'ACK', 'ticket',
+         'generator', 'power', 'backup', 'ok', 'check', 'door', 'open', 'temperature', 'high', 'resolved')
+
+
+def seed_email(index):
+    return f'user{index}@{SEED_EMAIL_DOMAIN}'
+
+
+def seed_phone(index):
+    return f'+1555{index:07d}'
+
+
+def _weighted(rng, choices):
+    roll = rng.random()
+    for value, weight in choices:
+        roll -= weight
+        if roll <= 0:
+            return value
+    return choices[-1][0]
+
+
+def seed_users(count, shared_key, chunk=5000):
+    """Insert ``count`` users; returns their ids"""
+    from models import User, db
+
+    shared_hash = bcrypt.hashpw(shared_key.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    start = db.session.query(db.func.count(User.id)).scalar()
+    now = datetime.utcnow()
+    for offset in range(0, count, chunk):
+        rows = [
+            {
+                'email': seed_email(start + index),
+                'phone_number': seed_phone(start + index),
+                'shared_key': shared_hash,
+                'created_at': now,
+                'is_active': True,
+            }
+            for index in range(offset, min(offset + chunk, count))
+        ]
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+    return [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+
+
+def generate_logs(count, user_ids, days, rng):
+    """Yield SMSLog row dicts in timestamp order, spread over the last ``days`` days"""
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    step = (end - start) / max(count, 1)
+    # Pareto-distributed ownership: a handful of users own most of the history
+    weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+    owners = rng.choices(user_ids, weights=weights, k=min(count, 100000)) if user_ids else [None]
+    contacts = [f'+1444{index:07d}' for index in range(2000)]
+    for index in range(count):
+        received = rng.random() < 0.3
+        contact = contacts[int(rng.paretovariate(1.2)) % len(contacts)]
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 25)))
+        timestamp = start + step * index
+        row = {
+            'user_id': None if received else owners[index % len(owners)],
+            'to_number': '+15550000000' if received else contact,
+            'from_number': contact if received else None,
+            'message': text,
+            'direction': 'received' if received else 'sent',
+            'status': 'received' if received else _weighted(rng, STATUSES_SENT),
+            'timestamp': timestamp,
+            'device_response': None if received else f'Message sent to {contact}',
+            'fingerprint': hashlib.sha256(f'seed|{index}|{timestamp.isoformat()}'.encode('utf-8')).hexdigest() if received else None,
+            'device': rng.choice(DEVICES),
+        }
+        yield row
+
+
+def seed_logs(count, user_ids, days=365, chunk=10000, rng=None, progress=True):
+    """Insert ``count`` SMS logs in chunks; returns rows per second"""
+    from models import SMSLog, db
+
+    rng = rng or random.Random()
+    table = SMSLog.__table__
+    started = time.perf_counter()
+    batch = []
+    written = 0
+    for row in generate_logs(count, user_ids, days, rng):
+        batch.append(row)
+        if len(batch) >= chunk:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            written += len(batch)
+            batch = []
+            if progress and written % (chunk * 10) == 0:
+                elapsed = time.perf_counter() - started
+                print(f"  {written:>10,} logs  {written / elapsed:10,.0f} rows/s")
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        written += len(batch)
+    elapsed = time.perf_counter() - started
+    return written / elapsed if elapsed else 0.0
+
+
+def truncate():
+    from models import APILog, SMSDailyStat, SMSLog, User, db
+
+    for model in (APILog, SMSDailyStat, SMSLog, User):
+        db.session.execute(model.__table__.delete())
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--logs', type=int, default=2000000)
+    parser.add_argument('--days', type=int, default=365, help='spread log timestamps over this many days')
+    parser.add_argument('--chunk', type=int, default=10000, help='rows per INSERT batch')
+    parser.add_argument('--shared-key', default=os.getenv('DEFAULT_SHARED_KEY', 'your-default-shared-key-for-user-registration'))
+    parser.add_argument('--seed', type=int, default=1, help='random seed for reproducible data')
+    parser.add_argument('--truncate', action='store_true', help='delete existing users, logs and API logs first')
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+    from services import rollups
+
+    app = create_app({'BACKGROUND_WORKERS': False})
+    with app.app_context():
+        db.create_all()
+        print(f"Seeding {app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]}")
+        if args.truncate:
+            truncate()
+        started = time.perf_counter()
+        user_ids = seed_users(args.users, args.shared_key, chunk=args.chunk)
+        print(f"{args.users:,} users in {time.perf_counter() - started:.1f}s")
+        rate = seed_logs(args.logs, user_ids, days=args.days, chunk=args.chunk, rng=random.Random(args.seed))
+        print(f"{args.logs:,} logs at {rate:,.0f} rows/s")
+        # Core inserts bypass the ORM hook that maintains the rollups
+        rebuilt = time.perf_counter()
+        rollups.rebuild()
+        print(f"Rollups rebuilt in {time.perf_counter() - rebuilt:.1f}s; {time.perf_counter() - started:.1f}s total")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import os
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+def engine_options(database_url):
+    """SQLAlchemy engine options from DB_POOL_* env vars.
+
+    SQLite keeps SQLAlchemy's defaults; for server databases each worker
+    process gets its own pool, so size it for the worker's threads plus the
+    background outbox/inbound/API-log threads.
+    """
+    if database_url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        # Check connections on checkout and recycle them before server-side idle timeouts
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', 'true'),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    }
+
+
+def load_config():
+    """Application config from the environment; read after .env is loaded"""
+    database_url = os.getenv('DATABASE_URL', 'sqlite:///unifi_sms.db')
+    return {
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(database_url),
+        'SECRET_KEY': os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production'),
+        'JWT_SECRET_KEY': os.getenv('SMS_API_KEY', 'dev-jwt-secret-key-change-in-production'),
+        # Start outbox, inbound and API-log threads in create_app; the WSGI entry
+        # point turns this off and starts them per worker after the fork instead
+        'BACKGROUND_WORKERS': _env_bool('SMS_BACKGROUND_WORKERS', 'true'),
+    }
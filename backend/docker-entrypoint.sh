@@ -0,0 +1,10 @@
+#!/bin/sh
+# Bring the schema up to date before serving; a no-op when it already is
+set -e
+
+if [ "${DB_UPGRADE_ON_START:-true}" = "true" ]; then
+    # wsgi:app never starts background threads, so nothing touches the tables before they exist
+    flask --app wsgi db upgrade
+fi
+
+exec "$@"
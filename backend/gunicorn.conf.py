@@ -0,0 +1,40 @@
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8585')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+# Each worker takes its share of UNIFI_MODEM_CONCURRENCY (see services.modem_scheduler)
+os.environ.setdefault('SMS_WORKER_PROCESSES', str(workers))
+# Workers rotating one shared LOG_FILE would clobber each other's records
+os.environ.setdefault('LOG_FILE_PER_PROCESS', 'true')
+# Threaded workers: most request time is spent waiting on the DB or the modem
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Device round trips can take a while; keep this above UNIFI_SSH_ACQUIRE_TIMEOUT
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+# Gunicorn's default format minus the query string (%(U)s is the path alone), so credentials in URLs stay out of the log
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+
+
+def post_fork(server, worker):
+    """Per-worker initialisation, also correct when preload_app is enabled"""
+    from wsgi import app
+    from app import start_background_workers
+    from logging_config import configure_logging
+    from models import db
+
+    # The master's log listener thread did not survive the fork
+    configure_logging()
+    with app.app_context():
+        # Never share pooled DB connections inherited from the master
+        db.engine.dispose(close=False)
+    start_background_workers(app)
+
+
+def worker_exit(server, worker):
+    from wsgi import app
+    from app import stop_background_workers
+
+    stop_background_workers(app)
@@ -0,0 +1,124 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+# Process the listener thread runs in; a forked child inherits _listener without the thread
+_listener_pid = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def _file_handler(path):
+    """Size-based rotation by default, or time-based with LOG_ROTATE=time"""
+    backups = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    if os.getenv('LOG_ROTATE', 'size').lower() == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=os.getenv('LOG_ROTATE_WHEN', 'midnight'), backupCount=backups, encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))), backupCount=backups, encoding='utf-8'
+    )
+
+
+def _log_path(path):
+    """LOG_FILE, or with LOG_FILE_PER_PROCESS one file per process: backend.log -> backend.<pid>.log
+
+    Rotation renames the file, which is only safe when a single process writes it.
+    """
+    if not _per_process():
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.{os.getpid()}{ext}'
+
+
+def _per_process():
+    return os.getenv('LOG_FILE_PER_PROCESS', 'false').lower() in ('1', 'true', 'yes')
+
+
+def _module_levels(spec):
+    """Parse LOG_LEVELS like 'routes.sms=DEBUG,services.ssh_pool=WARNING'"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Route all logging through a queue so handlers do their I/O on a listener thread.
+
+    Request threads only enqueue records; console and file output, rotation
+    and formatting happen in one background QueueListener. Configured by env:
+    LOG_LEVEL, LOG_LEVELS (per module), LOG_FORMAT_JSON, LOG_FILE (empty to
+    disable), LOG_FILE_PER_PROCESS, LOG_ROTATE (size|time), LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN, LOG_BACKUP_COUNT.
+
+    Called again in a forked child (gunicorn's post_fork with preload_app),
+    it starts the child's own listener over the same handlers, or over new
+    ones writing the child's own file with LOG_FILE_PER_PROCESS.
+    """
+    if _listener is not None:
+        if _listener_pid != os.getpid():
+            handlers = _listener.handlers
+            inherited = [handler for handler in handlers if isinstance(handler, logging.FileHandler)]
+            if inherited and _per_process():
+                # Leave the parent's file to the parent
+                for handler in inherited:
+                    handler.close()
+                handlers = _handlers()
+            _start_listener(handlers)
+        return _listener
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in _module_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+    return _start_listener(_handlers())
+
+
+def _handlers():
+    if os.getenv('LOG_FORMAT_JSON', 'false').lower() in ('1', 'true', 'yes'):
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter(LOG_FORMAT)
+
+    handlers = [logging.StreamHandler()]
+    log_file = os.getenv('LOG_FILE', 'backend.log')
+    if log_file:
+        handlers.append(_file_handler(_log_path(log_file)))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _start_listener(handlers):
+    """Point the root logger at a new queue drained by a listener thread of this process"""
+    global _listener, _listener_pid
+    log_queue = queue.SimpleQueue()
+    logging.getLogger().handlers = [logging.handlers.QueueHandler(log_queue)]
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_listener.stop)
+    return _listener
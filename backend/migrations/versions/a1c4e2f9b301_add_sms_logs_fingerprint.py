@@ -0,0 +1,28 @@
+"""add sms_logs fingerprint for received message dedup
+
+Revision ID: a1c4e2f9b301
+Revises: 7e0b9d3c1a54
+Create Date: 2026-10-18 09:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e2f9b301'
+down_revision = '7e0b9d3c1a54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_sms_logs_fingerprint', ['fingerprint'])
+
+
+def downgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_sms_logs_fingerprint', type_='unique')
+        batch_op.drop_column('fingerprint')
@@ -0,0 +1,28 @@
+"""add sms_logs device_reference for delivery report reconciliation
+
+Revision ID: a8e3c1f5d7b9
+Revises: f6c2d9e4a8b3
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e3c1f5d7b9'
+down_revision = 'f6c2d9e4a8b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('device_reference', sa.String(length=16), nullable=True))
+        batch_op.create_index('ix_sms_logs_device_device_reference', ['device', 'device_reference'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.drop_index('ix_sms_logs_device_device_reference')
+        batch_op.drop_column('device_reference')
@@ -0,0 +1,28 @@
+"""add sms_logs send_at for scheduled sends
+
+Revision ID: b4d8f2a6c1e3
+Revises: a8e3c1f5d7b9
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4d8f2a6c1e3'
+down_revision = 'a8e3c1f5d7b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('send_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_sms_logs_status_send_at', ['status', 'send_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.drop_index('ix_sms_logs_status_send_at')
+        batch_op.drop_column('send_at')
@@ -0,0 +1,30 @@
+"""add composite indexes on sms_logs for keyset pagination
+
+Revision ID: b7d2f0c8e412
+Revises: a1c4e2f9b301
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f0c8e412'
+down_revision = 'a1c4e2f9b301'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.create_index('ix_sms_logs_user_id_timestamp_id', ['user_id', 'timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_sms_logs_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_sms_logs_direction_status_id', ['direction', 'status', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.drop_index('ix_sms_logs_direction_status_id')
+        batch_op.drop_index('ix_sms_logs_timestamp_id')
+        batch_op.drop_index('ix_sms_logs_user_id_timestamp_id')
@@ -0,0 +1,42 @@
+"""create api_logs for request timing
+
+Revision ID: c3e9a1d4f7b2
+Revises: b7d2f0c8e412
+Create Date: 2026-10-18 10:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e9a1d4f7b2'
+down_revision = 'b7d2f0c8e412'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('api_logs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('endpoint', sa.String(length=200), nullable=False),
+        sa.Column('method', sa.String(length=10), nullable=False),
+        sa.Column('ip_address', sa.String(length=45), nullable=False),
+        sa.Column('user_agent', sa.String(length=500), nullable=True),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('response_time', sa.Float(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('api_logs', schema=None) as batch_op:
+        batch_op.create_index('ix_api_logs_timestamp', ['timestamp'], unique=False)
+        batch_op.create_index('ix_api_logs_endpoint_timestamp', ['endpoint', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('api_logs', schema=None) as batch_op:
+        batch_op.drop_index('ix_api_logs_endpoint_timestamp')
+        batch_op.drop_index('ix_api_logs_timestamp')
+    op.drop_table('api_logs')
@@ -0,0 +1,28 @@
+"""add sms_logs claimed_at for requeueing stale outbox claims
+
+Revision ID: c7f3a9e1b5d2
+Revises: b4d8f2a6c1e3
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f3a9e1b5d2'
+down_revision = 'b4d8f2a6c1e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    # Rows already stuck in 'sending' become stale claims the outbox requeues
+    op.execute("UPDATE sms_logs SET claimed_at = timestamp WHERE status = 'sending'")
+
+
+def downgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.drop_column('claimed_at')
@@ -0,0 +1,26 @@
+"""add sms_logs device for multi-modem routing
+
+Revision ID: d5f1b3a9c2e6
+Revises: c3e9a1d4f7b2
+Create Date: 2026-10-18 10:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f1b3a9c2e6'
+down_revision = 'c3e9a1d4f7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('device', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('sms_logs', schema=None) as batch_op:
+        batch_op.drop_column('device')
@@ -0,0 +1,30 @@
+"""create modem_send_buckets for a send rate shared across processes
+
+Revision ID: d9b5e3f7a1c4
+Revises: c7f3a9e1b5d2
+Create Date: 2026-10-18 17:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b5e3f7a1c4'
+down_revision = 'c7f3a9e1b5d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('modem_send_buckets',
+        sa.Column('device', sa.String(length=64), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('device')
+    )
+
+
+def downgrade():
+    op.drop_table('modem_send_buckets')
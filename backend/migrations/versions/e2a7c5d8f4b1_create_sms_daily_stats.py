@@ -0,0 +1,43 @@
+"""create sms_daily_stats rollups and backfill from sms_logs
+
+Revision ID: e2a7c5d8f4b1
+Revises: d5f1b3a9c2e6
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c5d8f4b1'
+down_revision = 'd5f1b3a9c2e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sms_daily_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('device', sa.String(length=64), nullable=False),
+        sa.Column('direction', sa.String(length=10), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'day', 'device', 'direction', 'status', name='uq_sms_daily_stats_key')
+    )
+
+    # One full pass to seed the rollups, per user and for all users (-1);
+    # they are maintained incrementally from here on
+    for user_id, group_user in (("COALESCE(user_id, 0)", "COALESCE(user_id, 0), "), ("-1", "")):
+        op.execute(
+            "INSERT INTO sms_daily_stats (user_id, day, device, direction, status, count) "
+            f"SELECT {user_id}, date(timestamp), COALESCE(device, ''), direction, status, COUNT(*) "
+            "FROM sms_logs WHERE timestamp IS NOT NULL AND status IN ('sent', 'delivered', 'failed', 'received') "
+            f"GROUP BY {group_user}date(timestamp), COALESCE(device, ''), direction, status"
+        )
+
+def downgrade():
+    op.drop_table('sms_daily_stats')
@@ -0,0 +1,35 @@
+"""create stream_tickets for /sms/events authentication
+
+Revision ID: e4c8a2f6b9d1
+Revises: d9b5e3f7a1c4
+Create Date: 2026-10-18 18:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4c8a2f6b9d1'
+down_revision = 'd9b5e3f7a1c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stream_tickets',
+        sa.Column('ticket_hash', sa.String(length=64), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('ticket_hash')
+    )
+    with op.batch_alter_table('stream_tickets', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stream_tickets_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stream_tickets', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stream_tickets_expires_at'))
+
+    op.drop_table('stream_tickets')
@@ -0,0 +1,53 @@
+"""scope received message fingerprints by device
+
+Revision ID: f1a7d3c9e5b2
+Revises: e4c8a2f6b9d1
+Create Date: 2026-10-18 18:40:00.000000
+
+"""
+import hashlib
+import logging
+
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a7d3c9e5b2'
+down_revision = 'e4c8a2f6b9d1'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+sms_logs = sa.table('sms_logs',
+    sa.column('id', sa.Integer),
+    sa.column('device', sa.String),
+    sa.column('fingerprint', sa.String)
+)
+
+
+def upgrade():
+    # Single-device installs fingerprinted without a scope; the poller now always
+    # scopes by device name (services.modem_parser.scope_fingerprint)
+    devices = current_app.extensions['unifi_devices'].services
+    if len(devices) > 1:
+        # These rows already carry the device inside the hashed content and cannot be rewritten;
+        # messages still in modem storage are ingested once more
+        logger.warning("Several UniFi devices configured: received fingerprints left as they are")
+        return
+    default = devices[0].name
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(sms_logs.c.id, sms_logs.c.device, sms_logs.c.fingerprint)
+        .where(sms_logs.c.fingerprint.isnot(None))
+    ).fetchall()
+    for row in rows:
+        scoped = hashlib.sha256(f'{row.device or default}\x1f{row.fingerprint}'.encode('utf-8')).hexdigest()
+        conn.execute(sms_logs.update().where(sms_logs.c.id == row.id).values(fingerprint=scoped))
+
+
+def downgrade():
+    # Hashes cannot be unscoped; the previous code re-ingests messages still in modem storage once
+    pass
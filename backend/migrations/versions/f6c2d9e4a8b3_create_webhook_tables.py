@@ -0,0 +1,78 @@
+"""create webhook subscriptions, delivery queue and dead letters
+
+Revision ID: f6c2d9e4a8b3
+Revises: e2a7c5d8f4b1
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6c2d9e4a8b3'
+down_revision = 'e2a7c5d8f4b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_subscriptions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('secret', sa.String(length=255), nullable=True),
+        sa.Column('events', sa.String(length=50), nullable=False),
+        sa.Column('batch_size', sa.Integer(), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_success_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('webhook_deliveries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.String(length=32), nullable=False),
+        sa.Column('event', sa.String(length=20), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claim_token', sa.String(length=32), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['subscription_id'], ['webhook_subscriptions.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('webhook_deliveries', schema=None) as batch_op:
+        batch_op.create_index('ix_webhook_deliveries_status_next_attempt_at', ['status', 'next_attempt_at', 'id'], unique=False)
+        batch_op.create_index('ix_webhook_deliveries_subscription_id_status', ['subscription_id', 'status', 'next_attempt_at'], unique=False)
+        batch_op.create_index('ix_webhook_deliveries_claim_token', ['claim_token'], unique=False)
+    op.create_table('webhook_dead_letters',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('subscription_id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.String(length=32), nullable=False),
+        sa.Column('event', sa.String(length=20), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('failed_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['subscription_id'], ['webhook_subscriptions.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('webhook_dead_letters', schema=None) as batch_op:
+        batch_op.create_index('ix_webhook_dead_letters_subscription_id_id', ['subscription_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('webhook_dead_letters', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_dead_letters_subscription_id_id')
+    op.drop_table('webhook_dead_letters')
+    with op.batch_alter_table('webhook_deliveries', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_deliveries_claim_token')
+        batch_op.drop_index('ix_webhook_deliveries_subscription_id_status')
+        batch_op.drop_index('ix_webhook_deliveries_status_next_attempt_at')
+    op.drop_table('webhook_deliveries')
+    op.drop_table('webhook_subscriptions')
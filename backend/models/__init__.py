@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import bcrypt
+import json
 
 db = SQLAlchemy()
 
@@ -36,6 +37,17 @@ class User(db.Model):
 
 class SMSLog(db.Model):
     __tablename__ = 'sms_logs'
+    __table_args__ = (
+        # Keyset pagination on (timestamp, id), per user and across all logs
+        db.Index('ix_sms_logs_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_sms_logs_timestamp_id', 'timestamp', 'id'),
+        # Outbox claims and direction/status filters
+        db.Index('ix_sms_logs_direction_status_id', 'direction', 'status', 'id'),
+        # Delivery report lookups (services.delivery)
+        db.Index('ix_sms_logs_device_device_reference', 'device', 'device_reference'),
+        # Scheduler reload and overdue sweeps (services.scheduler)
+        db.Index('ix_sms_logs_status_send_at', 'status', 'send_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
@@ -43,9 +55,14 @@ class SMSLog(db.Model):
     from_number = db.Column(db.String(20), nullable=True)
     message = db.Column(db.Text, nullable=False)
     direction = db.Column(db.String(10), nullable=False)  # 'sent' or 'received'
-    status = db.Column(db.String(20), default='pending')  # 'pending', 'sent', 'failed', 'delivered'
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='pending')  # 'scheduled', 'cancelled', 'pending', 'sending', 'sent', 'failed', 'delivered', 'received'
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # send_at for scheduled messages
     device_response = db.Column(db.Text, nullable=True)
+    fingerprint = db.Column(db.String(64), unique=True, nullable=True)  # dedup key for ingested received messages
+    device = db.Column(db.String(64), nullable=True)  # name of the UniFi gateway that sent or received it
+    device_reference = db.Column(db.String(16), nullable=True)  # modem message reference of a sent message, matched by delivery reports
+    send_at = db.Column(db.DateTime, nullable=True)  # when a scheduled message is released to the outbox
+    claimed_at = db.Column(db.DateTime, nullable=True)  # when an outbox worker moved it to 'sending'
     
     def to_dict(self):
         return {
@@ -57,5 +74,154 @@ class SMSLog(db.Model):
             'direction': self.direction,
             'status': self.status,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'device_response': self.device_response
+            'device_response': self.device_response,
+            'device': self.device,
+            'send_at': self.send_at.isoformat() if self.send_at else None
+        }
+
+class SMSDailyStat(db.Model):
+    """Message counts per day/user/device/direction/status, kept current by services.rollups"""
+    __tablename__ = 'sms_daily_stats'
+    __table_args__ = (
+        # Upsert target, and the (user_id, day) range scans of /stats
+        db.UniqueConstraint('user_id', 'day', 'device', 'direction', 'status', name='uq_sms_daily_stats_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, default=0)  # 0 for messages without a user (received), -1 for all users
+    device = db.Column(db.String(64), nullable=False, default='')
+    direction = db.Column(db.String(10), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class WebhookSubscription(db.Model):
+    """An HTTP endpoint that receives SMS events from services.webhooks"""
+    __tablename__ = 'webhook_subscriptions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    secret = db.Column(db.String(255), nullable=True)  # HMAC-SHA256 key for the X-Webhook-Signature header
+    events = db.Column(db.String(50), nullable=False, default='inbound')  # comma-separated: 'inbound', 'sms'
+    batch_size = db.Column(db.Integer, nullable=False, default=1)  # events per POST
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_success_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    
+    def event_types(self):
+        return [name for name in (self.events or '').split(',') if name]
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'events': self.event_types(),
+            'batch_size': self.batch_size,
+            'is_active': self.is_active,
+            'signed': bool(self.secret),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_success_at': self.last_success_at.isoformat() if self.last_success_at else None,
+            'last_error': self.last_error
+        }
+
+class WebhookDelivery(db.Model):
+    """One event waiting to be POSTed to a subscription; deleted once delivered"""
+    __tablename__ = 'webhook_deliveries'
+    __table_args__ = (
+        # Dispatcher claims: due pending rows, oldest first
+        db.Index('ix_webhook_deliveries_status_next_attempt_at', 'status', 'next_attempt_at', 'id'),
+        # ...and the rest of a batch for the same endpoint
+        db.Index('ix_webhook_deliveries_subscription_id_status', 'subscription_id', 'status', 'next_attempt_at'),
+        db.Index('ix_webhook_deliveries_claim_token', 'claim_token'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('webhook_subscriptions.id', ondelete='CASCADE'), nullable=False)
+    event_id = db.Column(db.String(32), nullable=False)  # sent as the event's id; receivers dedupe on it
+    event = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON of the event's data
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending' or 'delivering'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+
+class WebhookDeadLetter(db.Model):
+    """A delivery that failed permanently or ran out of attempts, kept for inspection and replay"""
+    __tablename__ = 'webhook_dead_letters'
+    __table_args__ = (
+        db.Index('ix_webhook_dead_letters_subscription_id_id', 'subscription_id', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('webhook_subscriptions.id', ondelete='CASCADE'), nullable=False)
+    event_id = db.Column(db.String(32), nullable=False)
+    event = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    failed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'subscription_id': self.subscription_id,
+            'event_id': self.event_id,
+            'event': self.event,
+            'data': json.loads(self.payload),
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'failed_at': self.failed_at.isoformat() if self.failed_at else None,
+            'last_error': self.last_error
+        }
+
+class ModemSendBucket(db.Model):
+    """Send tokens of one UniFi device, shared by every process (see services.modem_scheduler)"""
+    __tablename__ = 'modem_send_buckets'
+    
+    device = db.Column(db.String(64), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix time of the last refill
+    version = db.Column(db.Integer, nullable=False, default=0)  # compare-and-set guard for concurrent takes
+
+class StreamTicket(db.Model):
+    """Single-use credential for opening /api/sms/events, where EventSource can only pass a query string"""
+    __tablename__ = 'stream_tickets'
+    ticket_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 hex; the ticket itself is never stored
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class APILog(db.Model):
+    __tablename__ = 'api_logs'
+    __table_args__ = (
+        db.Index('ix_api_logs_timestamp', 'timestamp'),
+        db.Index('ix_api_logs_endpoint_timestamp', 'endpoint', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    endpoint = db.Column(db.String(200), nullable=False)
+    method = db.Column(db.String(10), nullable=False)
+    ip_address = db.Column(db.String(45), nullable=False)
+    user_agent = db.Column(db.String(500))
+    status_code = db.Column(db.Integer)
+    response_time = db.Column(db.Float)  # in milliseconds
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'ip_address': self.ip_address,
+            'user_agent': self.user_agent,
+            'status_code': self.status_code,
+            'response_time': self.response_time,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
@@ -0,0 +1,43 @@
+from flask import Blueprint, request, jsonify, current_app
+from routes.sms import api_key_required
+from services.api_logger import slowest_endpoints, latency_percentiles
+from datetime import datetime, timedelta
+import logging
+
+admin_bp = Blueprint('admin', __name__)
+logger = logging.getLogger(__name__)
+
+def _since():
+    """Start of the reporting window: ?since=<ISO date> or ?hours=<n> (default 24)"""
+    if request.args.get('since'):
+        try:
+            return datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            raise ValueError('Invalid since; expected ISO 8601')
+    return datetime.utcnow() - timedelta(hours=request.args.get('hours', 24, type=float))
+
+@admin_bp.route('/api-logs/slowest', methods=['GET'])
+@api_key_required
+def api_logs_slowest():
+    try:
+        limit = min(request.args.get('limit', 10, type=int), 100)
+        return jsonify(slowest_endpoints(_since(), limit=limit)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/api-logs/percentiles', methods=['GET'])
+@api_key_required
+def api_logs_percentiles():
+    try:
+        return jsonify(latency_percentiles(_since())), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/api-logs/writer', methods=['GET'])
+@api_key_required
+def api_logs_writer_stats():
+    return jsonify(current_app.extensions['api_logger'].stats()), 200
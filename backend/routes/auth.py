@@ -14,7 +14,6 @@ def login():
     
     try:
         data = request.get_json()
-        logger.debug(f"Login request data: {data}")
         
         if not data or not data.get('email') or not data.get('phone_number') or not data.get('shared_key'):
             logger.warning("Missing required fields in login request")
@@ -22,15 +21,13 @@ def login():
         
         # For now, validate against hardcoded shared key from environment
         expected_shared_key = os.getenv('DEFAULT_SHARED_KEY', 'your-default-shared-key-for-user-registration')
-        logger.debug(f"Expected shared key: {expected_shared_key}")
-        logger.debug(f"Provided shared key: {data['shared_key']}")
         
         if data['shared_key'] != expected_shared_key:
-            logger.warning(f"Invalid shared key provided: {data['shared_key']}")
+            logger.warning("Invalid shared key provided for %s", data['email'])
             return jsonify({'error': 'Invalid shared key'}), 401
         
         # Check if user exists or create new user
-        logger.info(f"Looking up user: {data['email']}, {data['phone_number']}")
+        logger.debug("Looking up user: %s", data['email'])
         user = User.query.filter_by(email=data['email'], phone_number=data['phone_number']).first()
         
         if not user:
@@ -44,20 +41,20 @@ def login():
                 )
                 db.session.add(user)
                 db.session.commit()
-                logger.info(f"New user created with ID: {user.id}")
+                logger.info("New user created with ID: %s", user.id)
             except Exception as e:
-                logger.error(f"Failed to create user: {str(e)}")
+                logger.error("Failed to create user: %s", e)
                 db.session.rollback()
                 return jsonify({'error': 'Failed to create user account'}), 500
         else:
-            logger.info(f"Existing user found with ID: {user.id}")
+            logger.debug("Existing user found with ID: %s", user.id)
         
         if not user.is_active:
-            logger.warning(f"Account disabled for user ID: {user.id}")
+            logger.warning("Account disabled for user ID: %s", user.id)
             return jsonify({'error': 'Account is disabled'}), 401
         
         # Generate JWT token
-        logger.info(f"Generating JWT token for user ID: {user.id}")
+        logger.debug("Generating JWT token for user ID: %s", user.id)
         token = jwt.encode({
             'user_id': user.id,
             'email': user.email,
@@ -65,14 +62,14 @@ def login():
             'exp': datetime.utcnow() + timedelta(hours=24)
         }, os.getenv('SMS_API_KEY'), algorithm='HS256')
         
-        logger.info(f"Login successful for user ID: {user.id}")
+        logger.info("Login successful for user ID: %s", user.id)
         return jsonify({
             'token': token,
             'user': user.to_dict()
         }), 200
         
     except Exception as e:
-        logger.error(f"Login failed with error: {str(e)}")
+        logger.error("Login failed with error: %s", e)
         return jsonify({'error': 'Login failed'}), 500
 
 @auth_bp.route('/users', methods=['POST'])
@@ -1,49 +1,71 @@
-from flask import Blueprint, request, jsonify
-from models import SMSLog, db
-from services.unifi_service import UniFiSMSService
+from flask import Blueprint, request, jsonify, Response, stream_with_context, g, current_app
+from werkzeug.local import LocalProxy
+from models import SMSLog, StreamTicket, db
+from services.log_queries import apply_filters, keyset_page, iter_export, archived_rows
+from services.rollups import query_stats
+from services.modem_scheduler import ModemBusyError
+from services.outbox import OutboxFullError
+from services.scheduler import parse_send_at
+from services.unifi_service import CircuitOpenError, DeviceUnavailableError
 import jwt
 import os
+import math
+import hashlib
+import secrets
+from datetime import datetime, timedelta
 import logging
 import jsonpath_ng.ext as jp
 from functools import wraps
 
 sms_bp = Blueprint('sms', __name__)
-unifi_service = UniFiSMSService()
+# Created per app (and so per worker process) by create_app()
+unifi_devices = LocalProxy(lambda: current_app.extensions['unifi_devices'])
+# The gateway picked with ?device=<name> (see device_selected), else the first one
+unifi_service = LocalProxy(lambda: g.get('unifi_service') or current_app.extensions['unifi_service'])
+sms_outbox = LocalProxy(lambda: current_app.extensions['sms_outbox'])
+sms_scheduler = LocalProxy(lambda: current_app.extensions['sms_scheduler'])
+sms_archive = LocalProxy(lambda: current_app.extensions['sms_archive'])
+sms_events = LocalProxy(lambda: current_app.extensions['sms_events'])
 logger = logging.getLogger(__name__)
 
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        logger.debug(f"Token validation for endpoint: {request.endpoint}")
-        token = request.headers.get('Authorization')
-        
-        if not token:
-            logger.warning("No token provided in Authorization header")
-            return jsonify({'error': 'Token is missing'}), 401
-        
-        try:
-            if token.startswith('Bearer '):
-                token = token.split(' ')[1]
-                logger.debug("Extracted Bearer token")
-            
-            logger.debug("Attempting to decode JWT token")
-            data = jwt.decode(token, os.getenv('SMS_API_KEY'), algorithms=['HS256'])
-            current_user_id = data['user_id']
-            logger.info(f"Token validated successfully for user ID: {current_user_id}")
-        except jwt.ExpiredSignatureError:
-            logger.warning("Token has expired")
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError as e:
-            logger.warning(f"Invalid token: {str(e)}")
-            return jsonify({'error': 'Token is invalid'}), 401
-        except Exception as e:
-            logger.error(f"Token validation error: {str(e)}")
-            return jsonify({'error': 'Token validation failed'}), 401
-        
+        logger.debug("Token validation for endpoint: %s", request.endpoint)
+        current_user_id, error = authenticate_token(request.headers.get('Authorization'))
+        if error:
+            return error
         return f(current_user_id, *args, **kwargs)
     
     return decorated
 
+def authenticate_token(token):
+    """Validate a JWT (optionally 'Bearer '-prefixed); returns ``(user_id, None)`` or ``(None, error response)``"""
+    if not token:
+        logger.warning("No token provided in Authorization header")
+        return None, (jsonify({'error': 'Token is missing'}), 401)
+    
+    try:
+        if token.startswith('Bearer '):
+            token = token.split(' ')[1]
+            logger.debug("Extracted Bearer token")
+        
+        logger.debug("Attempting to decode JWT token")
+        data = jwt.decode(token, os.getenv('SMS_API_KEY'), algorithms=['HS256'])
+        current_user_id = data['user_id']
+        g.current_user_id = current_user_id
+        logger.debug("Token validated successfully for user ID: %s", current_user_id)
+        return current_user_id, None
+    except jwt.ExpiredSignatureError:
+        logger.warning("Token has expired")
+        return None, (jsonify({'error': 'Token has expired'}), 401)
+    except jwt.InvalidTokenError as e:
+        logger.warning("Invalid token: %s", e)
+        return None, (jsonify({'error': 'Token is invalid'}), 401)
+    except Exception as e:
+        logger.error("Token validation error: %s", e)
+        return None, (jsonify({'error': 'Token validation failed'}), 401)
+
 def api_key_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -56,34 +78,92 @@ def api_key_required(f):
     
     return decorated
 
+def device_unavailable(e):
+    """503 for a gateway that could not be reached, with Retry-After while its circuit breaker is open"""
+    logger.warning("%s", e)
+    headers = {'Retry-After': str(math.ceil(e.retry_in))} if isinstance(e, CircuitOpenError) else {}
+    return jsonify({'error': str(e), 'device': e.device}), 503, headers
+
+def too_busy(e):
+    """429 with Retry-After for a full modem lane or outbox; nothing was sent or queued"""
+    logger.warning("%s", e)
+    body = {'error': str(e), 'retry_after': e.retry_after}
+    if isinstance(e, ModemBusyError):
+        body['device'] = e.device
+        body['lane'] = e.lane
+    return jsonify(body), 429, {'Retry-After': str(e.retry_after)}
+
+def wants_archived():
+    return request.args.get('archived', '').lower() in ('1', 'true', 'yes')
+
+def device_selected(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        name = request.args.get('device')
+        service = unifi_devices.get(name)
+        if service is None:
+            return jsonify({'error': f'Unknown device: {name}'}), 404
+        g.unifi_service = service
+        return f(*args, **kwargs)
+    
+    return decorated
+
 # Frontend endpoints - all use JWT authentication
 @sms_bp.route('/status', methods=['GET'])
 @token_required
+@device_selected
 def sms_status(current_user_id):
-    logger.info(f"Device status requested by user ID: {current_user_id}")
+    logger.debug("Device status requested by user ID: %s", current_user_id)
     try:
-        status_data = unifi_service.get_device_status()
-        logger.debug(f"Device status retrieved: {status_data}")
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+        status_data = unifi_service.get_device_status(refresh=refresh)
         return jsonify(status_data), 200
+    except ModemBusyError as e:
+        return too_busy(e)
+    except DeviceUnavailableError as e:
+        return device_unavailable(e)
     except Exception as e:
-        logger.error(f"Failed to get device status: {str(e)}")
+        logger.error("Failed to get device status: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@sms_bp.route('/status/cache', methods=['GET'])
+@token_required
+@device_selected
+def sms_status_cache_stats(current_user_id):
+    return jsonify(unifi_service.status_cache.stats()), 200
+
+@sms_bp.route('/pool', methods=['GET'])
+@token_required
+@device_selected
+def sms_pool_stats(current_user_id):
+    return jsonify(unifi_service.pool_stats()), 200
+
 @sms_bp.route('/retrieve', methods=['GET'])
 @token_required
+@device_selected
 def sms_retrieve(current_user_id):
     try:
-        messages = unifi_service.get_received_messages()
+        clear = request.args.get('clear', '').lower() in ('1', 'true', 'yes')
+        messages = unifi_service.get_received_messages(clear=clear)
         return jsonify(messages), 200
+    except ModemBusyError as e:
+        return too_busy(e)
+    except DeviceUnavailableError as e:
+        return device_unavailable(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @sms_bp.route('/clear', methods=['DELETE'])
 @token_required
+@device_selected
 def sms_clear(current_user_id):
     try:
         result = unifi_service.clear_messages()
         return jsonify(result), 200
+    except ModemBusyError as e:
+        return too_busy(e)
+    except DeviceUnavailableError as e:
+        return device_unavailable(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -100,9 +180,18 @@ def sms_send(current_user_id, number):
         else:
             body = request.data.decode('UTF-8')
         
-        result = unifi_service.send_sms(number, body)
-        return {"message": "MESSAGE SENT", "result": result}, 200
+        if request.args.get('send_at'):
+            sms_log = sms_scheduler.schedule(number, body, parse_send_at(request.args['send_at']), user_id=current_user_id)
+        else:
+            sms_log = sms_outbox.enqueue(number, body, user_id=current_user_id)
+        message = "MESSAGE SCHEDULED" if sms_log.status == 'scheduled' else "MESSAGE QUEUED"
+        return {"message": message, "log_id": sms_log.id, "status": sms_log.status}, 202
+    except OutboxFullError as e:
+        return too_busy(e)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     except Exception as e:
+        db.session.rollback()
         return {"error": str(e)}, 500
 
 # Additional endpoints for 3-tier architecture (with JWT authentication)
@@ -115,33 +204,259 @@ def send_sms(current_user_id):
         return jsonify({'error': 'To number and message are required'}), 400
     
     try:
-        result = unifi_service.send_sms(
-            number=data['to_number'],
-            message=data['message'],
-            user_id=current_user_id
-        )
+        # With send_at the message waits in the schedule until then
+        if data.get('send_at'):
+            sms_log = sms_scheduler.schedule(data['to_number'], data['message'], parse_send_at(data['send_at']),
+                                             user_id=current_user_id)
+        else:
+            sms_log = sms_outbox.enqueue(data['to_number'], data['message'], user_id=current_user_id)
         
-        return jsonify(result), 200 if result['success'] else 500
+        return jsonify({
+            'success': True,
+            'message': 'MESSAGE SCHEDULED' if sms_log.status == 'scheduled' else 'MESSAGE QUEUED',
+            'log_id': sms_log.id,
+            'status': sms_log.status,
+            'send_at': sms_log.send_at.isoformat() if sms_log.send_at else None
+        }), 202
+    except OutboxFullError as e:
+        return too_busy(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@sms_bp.route('/messages/<int:log_id>', methods=['GET'])
+@token_required
+def get_message_status(current_user_id, log_id):
+    sms_log = SMSLog.query.filter_by(id=log_id, user_id=current_user_id).first()
+    if not sms_log:
+        return jsonify({'error': 'Message not found'}), 404
+    return jsonify(sms_log.to_dict()), 200
+
+@sms_bp.route('/messages/<int:log_id>', methods=['PATCH'])
+@token_required
+def reschedule_message(current_user_id, log_id):
+    data = request.get_json(silent=True)
+    if not data or not data.get('send_at'):
+        return jsonify({'error': 'send_at is required'}), 400
+    sms_log = SMSLog.query.filter_by(id=log_id, user_id=current_user_id).first()
+    if not sms_log:
+        return jsonify({'error': 'Message not found'}), 404
+    try:
+        if not sms_scheduler.reschedule(sms_log, parse_send_at(data['send_at'])):
+            return jsonify({'error': f'Message is {sms_log.status}, not scheduled'}), 409
+        return jsonify(sms_log.to_dict()), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@sms_bp.route('/messages/<int:log_id>', methods=['DELETE'])
+@token_required
+def cancel_message(current_user_id, log_id):
+    sms_log = SMSLog.query.filter_by(id=log_id, user_id=current_user_id).first()
+    if not sms_log:
+        return jsonify({'error': 'Message not found'}), 404
+    try:
+        if not sms_scheduler.cancel(sms_log):
+            return jsonify({'error': f'Message is {sms_log.status}, not scheduled'}), 409
+        return jsonify(sms_log.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@sms_bp.route('/outbox', methods=['GET'])
+@token_required
+def get_outbox_stats(current_user_id):
+    try:
+        return jsonify(dict(sms_outbox.stats(), scheduler=sms_scheduler.stats())), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@sms_bp.route('/delivery', methods=['GET'])
+@api_key_required
+def get_delivery_stats():
+    # Delivery report reconciler: last poll, errors and rows moved to delivered/failed
+    return jsonify(current_app.extensions['sms_delivery'].stats()), 200
+
+@sms_bp.route('/devices', methods=['GET'])
+@token_required
+def get_devices(current_user_id):
+    return jsonify(unifi_devices.stats()), 200
+
+@sms_bp.route('/send/batch', methods=['POST'])
+@token_required
+def send_sms_batch(current_user_id):
+    data = request.get_json(silent=True)
+    
+    # Accept either explicit pairs or one message broadcast to many numbers
+    if data and isinstance(data.get('messages'), list):
+        messages = [(item.get('to_number'), item.get('message')) for item in data['messages'] if isinstance(item, dict)]
+        if len(messages) != len(data['messages']):
+            return jsonify({'error': 'Each entry must be an object with to_number and message'}), 400
+    elif data and isinstance(data.get('to_numbers'), list):
+        messages = [(number, data.get('message')) for number in data['to_numbers']]
+    else:
+        return jsonify({'error': 'A list of messages or to_numbers is required'}), 400
+    
+    if not messages:
+        return jsonify({'error': 'At least one message is required'}), 400
+    if any(not number or not message for number, message in messages):
+        return jsonify({'error': 'To number and message are required for every entry'}), 400
+    
+    max_batch = int(os.getenv('SMS_BATCH_MAX', '500'))
+    if len(messages) > max_batch:
+        return jsonify({'error': f'Batch size exceeds limit of {max_batch}'}), 400
+    
+    # Every circuit open: refuse now rather than fail each message against a dead device
+    retry_in = unifi_devices.retry_in()
+    if retry_in is not None:
+        return jsonify({'error': 'No UniFi device is responding'}), 503, {'Retry-After': str(math.ceil(retry_in))}
+    
+    try:
+        results = unifi_devices.send_bulk(messages, user_id=current_user_id)
+    except ModemBusyError as e:
+        return too_busy(e)
+    except DeviceUnavailableError as e:
+        # Every gateway became unreachable before any message went out; circuits may not have opened yet
+        body, status, headers = device_unavailable(e)
+        retry_in = unifi_devices.retry_in() or float(os.getenv('UNIFI_CIRCUIT_BACKOFF_BASE', '5'))
+        headers.setdefault('Retry-After', str(math.ceil(retry_in)))
+        return body, status, headers
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    sent = sum(1 for result in results if result['success'])
+    body = {
+        'success': sent == len(results),
+        'sent': sent,
+        'failed': len(results) - sent,
+        'results': results
+    }
+    if sent == len(results):
+        return jsonify(body), 200
+    return jsonify(body), 207 if sent else 500
+
 @sms_bp.route('/history', methods=['GET'])
 @token_required
 def get_sms_history(current_user_id):
     try:
-        # Get user's SMS history
-        sms_logs = SMSLog.query.filter_by(user_id=current_user_id).order_by(SMSLog.timestamp.desc()).all()
+        # Get one page of the user's SMS history
+        query = apply_filters(SMSLog.query.filter_by(user_id=current_user_id), request.args)
+        # ?archived=1 continues into rows moved out by the retention policy
+        archive = sms_archive if wants_archived() else None
+        sms_logs, next_cursor = keyset_page(query, request.args, archive=archive, user_id=current_user_id)
         
-        return jsonify([log.to_dict() for log in sms_logs]), 200
+        return jsonify({'items': [log.to_dict() for log in sms_logs], 'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def redeem_stream_ticket(ticket):
+    """User id of an unexpired stream ticket, deleting it so it works once (in any worker process), else None"""
+    ticket_hash = hashlib.sha256(ticket.encode('utf-8')).hexdigest()
+    stream_ticket = db.session.get(StreamTicket, ticket_hash)
+    if stream_ticket is None:
+        return None
+    user_id = stream_ticket.user_id
+    # Only the request whose DELETE matched the row gets the stream
+    redeemed = StreamTicket.query.filter(
+        StreamTicket.ticket_hash == ticket_hash,
+        StreamTicket.expires_at > datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return user_id if redeemed else None
+
+@sms_bp.route('/events/ticket', methods=['POST'])
+@token_required
+def issue_stream_ticket(current_user_id):
+    try:
+        # EventSource cannot set headers, so it authenticates with a short-lived single-use ticket instead of the JWT
+        ttl = int(os.getenv('SMS_EVENTS_TICKET_TTL', '30'))
+        now = datetime.utcnow()
+        StreamTicket.query.filter(StreamTicket.expires_at <= now).delete(synchronize_session=False)
+        ticket = secrets.token_urlsafe(32)
+        db.session.add(StreamTicket(
+            ticket_hash=hashlib.sha256(ticket.encode('utf-8')).hexdigest(),
+            user_id=current_user_id,
+            expires_at=now + timedelta(seconds=ttl)
+        ))
+        db.session.commit()
+        return jsonify({'ticket': ticket, 'expires_in': ttl}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@sms_bp.route('/events', methods=['GET'])
+def sms_event_stream():
+    # The API key sees every event; browsers pass a ticket from POST /events/ticket, never the JWT, in the query string
+    api_key = request.headers.get('auth')
+    if api_key and api_key == os.getenv('SMS_API_KEY'):
+        current_user_id, admin = None, True
+    elif request.args.get('ticket'):
+        current_user_id = redeem_stream_ticket(request.args['ticket'])
+        if current_user_id is None:
+            return jsonify({'error': 'Ticket is invalid or expired'}), 401
+        admin = False
+    else:
+        current_user_id, error = authenticate_token(request.headers.get('Authorization'))
+        if error:
+            return error
+        admin = False
+    
+    broker = sms_events._get_current_object()
+    subscription = broker.subscribe(current_user_id, admin=admin)
+    if subscription is None:
+        return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': '30'}
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return Response(
+        broker.stream(subscription, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@sms_bp.route('/stats', methods=['GET'])
+@token_required
+def get_sms_stats(current_user_id):
+    try:
+        # Totals and a day/month series for the user, answered from the rollups
+        return jsonify(query_stats(request.args, user_id=current_user_id)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @sms_bp.route('/received', methods=['GET'])
 @api_key_required
+@device_selected
 def get_received_sms():
     try:
-        result = unifi_service.get_received_sms()
-        return jsonify(result), 200
+        # ?live=1 asks the modem directly instead of the ingested copy
+        if request.args.get('live', '').lower() in ('1', 'true', 'yes'):
+            return jsonify(unifi_service.get_received_sms()), 200
+        
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        since_id = request.args.get('since_id', type=int)
+        query = SMSLog.query.filter_by(direction='received')
+        if request.args.get('device'):
+            query = query.filter_by(device=request.args['device'])
+        if since_id is not None:
+            sms_logs = query.filter(SMSLog.id > since_id).order_by(SMSLog.id.asc()).limit(limit).all()
+        else:
+            sms_logs = query.order_by(SMSLog.id.desc()).limit(limit).all()
+        
+        return jsonify({
+            'messages': [log.to_dict() for log in sms_logs],
+            'last_id': max((log.id for log in sms_logs), default=since_id)
+        }), 200
+    except ModemBusyError as e:
+        return too_busy(e)
+    except DeviceUnavailableError as e:
+        return device_unavailable(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -149,9 +464,53 @@ def get_received_sms():
 @api_key_required
 def get_all_sms_logs():
     try:
-        # Get all SMS logs (admin function)
-        sms_logs = SMSLog.query.order_by(SMSLog.timestamp.desc()).all()
+        # Get one page of all SMS logs (admin function)
+        query = apply_filters(SMSLog.query, request.args)
+        user_id = request.args.get('user_id', type=int)
+        if user_id is not None:
+            query = query.filter(SMSLog.user_id == user_id)
+        archive = sms_archive if wants_archived() else None
+        sms_logs, next_cursor = keyset_page(query, request.args, archive=archive, user_id=user_id)
         
-        return jsonify([log.to_dict() for log in sms_logs]), 200
+        return jsonify({'items': [log.to_dict() for log in sms_logs], 'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@sms_bp.route('/logs/stats', methods=['GET'])
+@api_key_required
+def get_all_sms_stats():
+    try:
+        # Totals across all users (admin function), or one with ?user_id=
+        return jsonify(query_stats(request.args, user_id=request.args.get('user_id', type=int))), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@sms_bp.route('/logs/export', methods=['GET'])
+@api_key_required
+def export_sms_logs():
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    try:
+        query = apply_filters(SMSLog.query, request.args)
+        # Archived rows are older than anything left in the table, so they stream first
+        archived = archived_rows(sms_archive, request.args) if wants_archived() else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filename = f"sms_logs.{fmt}" + ('.gz' if compress else '')
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(iter_export(query, fmt=fmt, compress=compress, archived=archived)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
@@ -0,0 +1,137 @@
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.local import LocalProxy
+from urllib.parse import urlparse
+from datetime import datetime
+from models import WebhookDeadLetter, WebhookDelivery, WebhookSubscription, db
+from routes.sms import api_key_required
+from services.webhooks import EVENT_TYPES, MAX_BATCH_SIZE, invalidate_subscriptions
+import logging
+
+webhooks_bp = Blueprint('webhooks', __name__)
+webhook_dispatcher = LocalProxy(lambda: current_app.extensions['webhook_dispatcher'])
+logger = logging.getLogger(__name__)
+
+def _subscription_fields(data, partial=False):
+    """Validated column values from a create/update body; raises ValueError"""
+    fields = {}
+    if 'url' in data or not partial:
+        url = (data.get('url') or '').strip()
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            raise ValueError('url must be an http(s) URL')
+        fields['url'] = url
+    if 'events' in data or not partial:
+        events = data.get('events') or ['inbound']
+        if isinstance(events, str):
+            events = events.split(',')
+        unknown = set(events) - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown events: {', '.join(sorted(unknown))}; expected {', '.join(EVENT_TYPES)}")
+        fields['events'] = ','.join(name for name in EVENT_TYPES if name in events)
+    if 'batch_size' in data:
+        batch_size = data['batch_size']
+        if not isinstance(batch_size, int) or not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}')
+        fields['batch_size'] = batch_size
+    if 'secret' in data:
+        fields['secret'] = data['secret'] or None
+    if 'is_active' in data:
+        fields['is_active'] = bool(data['is_active'])
+    return fields
+
+@webhooks_bp.route('', methods=['POST'])
+@api_key_required
+def create_webhook():
+    try:
+        subscription = WebhookSubscription(**_subscription_fields(request.get_json() or {}))
+        db.session.add(subscription)
+        db.session.commit()
+        invalidate_subscriptions()
+        logger.info("Created webhook subscription %s for %s", subscription.id, subscription.url)
+        return jsonify(subscription.to_dict()), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@webhooks_bp.route('', methods=['GET'])
+@api_key_required
+def list_webhooks():
+    subscriptions = WebhookSubscription.query.order_by(WebhookSubscription.id).all()
+    return jsonify([subscription.to_dict() for subscription in subscriptions]), 200
+
+@webhooks_bp.route('/<int:subscription_id>', methods=['PATCH'])
+@api_key_required
+def update_webhook(subscription_id):
+    subscription = db.session.get(WebhookSubscription, subscription_id)
+    if subscription is None:
+        return jsonify({'error': 'Webhook not found'}), 404
+    try:
+        for name, value in _subscription_fields(request.get_json() or {}, partial=True).items():
+            setattr(subscription, name, value)
+        db.session.commit()
+        invalidate_subscriptions()
+        return jsonify(subscription.to_dict()), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@webhooks_bp.route('/<int:subscription_id>', methods=['DELETE'])
+@api_key_required
+def delete_webhook(subscription_id):
+    subscription = db.session.get(WebhookSubscription, subscription_id)
+    if subscription is None:
+        return jsonify({'error': 'Webhook not found'}), 404
+    # Explicit deletes: SQLite does not enforce ON DELETE CASCADE by default
+    WebhookDelivery.query.filter_by(subscription_id=subscription_id).delete(synchronize_session=False)
+    WebhookDeadLetter.query.filter_by(subscription_id=subscription_id).delete(synchronize_session=False)
+    db.session.delete(subscription)
+    db.session.commit()
+    invalidate_subscriptions()
+    return '', 204
+
+@webhooks_bp.route('/stats', methods=['GET'])
+@api_key_required
+def webhook_stats():
+    return jsonify(webhook_dispatcher.stats()), 200
+
+@webhooks_bp.route('/dead-letters', methods=['GET'])
+@api_key_required
+def list_dead_letters():
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    query = WebhookDeadLetter.query
+    if request.args.get('subscription_id'):
+        query = query.filter_by(subscription_id=request.args.get('subscription_id', type=int))
+    if request.args.get('before_id'):
+        query = query.filter(WebhookDeadLetter.id < request.args.get('before_id', type=int))
+    dead_letters = query.order_by(WebhookDeadLetter.id.desc()).limit(limit).all()
+    return jsonify({
+        'items': [dead_letter.to_dict() for dead_letter in dead_letters],
+        'next_before_id': dead_letters[-1].id if len(dead_letters) == limit else None
+    }), 200
+
+@webhooks_bp.route('/dead-letters/<int:dead_letter_id>/retry', methods=['POST'])
+@api_key_required
+def retry_dead_letter(dead_letter_id):
+    """Queue a dead-lettered event again with a fresh attempt count"""
+    dead_letter = db.session.get(WebhookDeadLetter, dead_letter_id)
+    if dead_letter is None:
+        return jsonify({'error': 'Dead letter not found'}), 404
+    delivery = WebhookDelivery(
+        subscription_id=dead_letter.subscription_id,
+        event_id=dead_letter.event_id,
+        event=dead_letter.event,
+        payload=dead_letter.payload,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+        created_at=dead_letter.created_at
+    )
+    db.session.add(delivery)
+    db.session.delete(dead_letter)
+    db.session.commit()
+    webhook_dispatcher.wake()
+    return jsonify({'delivery_id': delivery.id}), 202
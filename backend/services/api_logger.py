@@ -0,0 +1,197 @@
+import atexit
+import threading
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from flask import g, request
+from models import APILog, db
+from services.metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class APIRequestLogger:
+    """Times every request and records it in APILog without touching the DB on the request path.
+
+    ``after_request`` only appends a dict to an in-memory buffer; a background
+    thread writes the buffer with one executemany INSERT when it reaches
+    ``batch_size`` entries or every ``flush_interval`` seconds.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_buffer=None):
+        self.batch_size = batch_size or int(os.getenv('APILOG_BATCH_SIZE', '200'))
+        self.flush_interval = flush_interval or float(os.getenv('APILOG_FLUSH_INTERVAL', '5'))
+        # Oldest entries are dropped rather than growing without bound if the DB is down
+        self.max_buffer = max_buffer or int(os.getenv('APILOG_MAX_BUFFER', '10000'))
+        self.enabled = os.getenv('APILOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.app = None
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['api_logger'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def start(self):
+        if not self.enabled or self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='api-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def _before_request(self):
+        g._request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        started = g.pop('_request_started', None)
+        if started is None:
+            return response
+        entry = {
+            'user_id': g.get('current_user_id'),
+            'endpoint': (request.url_rule.rule if request.url_rule else request.path)[:200],
+            'method': request.method,
+            'ip_address': (request.remote_addr or '')[:45],
+            'user_agent': (request.user_agent.string or '')[:500],
+            'status_code': response.status_code,
+            'response_time': round((time.perf_counter() - started) * 1000, 3),
+            'timestamp': datetime.utcnow(),
+        }
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return response
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of rows inserted."""
+        with self._lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+        if not batch:
+            return 0
+        try:
+            with self.app.app_context():
+                db.session.execute(APILog.__table__.insert(), batch)
+                db.session.commit()
+        except Exception as e:
+            logger.error("Failed to write %d API log entries: %s", len(batch), e)
+            with self._lock:
+                # Put them back in front for the next attempt, within the buffer limit
+                room = self.max_buffer - len(self._buffer)
+                self.dropped += max(0, len(batch) - room)
+                self._buffer.extendleft(reversed(batch[-room:] if room > 0 else []))
+            return 0
+        self.written += len(batch)
+        return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            'enabled': self.enabled,
+            'buffered': buffered,
+            'written': self.written,
+            'dropped': self.dropped,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+        }
+
+
+def slowest_endpoints(since, limit=10):
+    """Routes with the highest mean response time since ``since``"""
+    mean = db.func.avg(APILog.response_time)
+    rows = db.session.query(
+        APILog.endpoint, APILog.method, db.func.count(APILog.id), mean, db.func.max(APILog.response_time)
+    ).filter(APILog.timestamp >= since).group_by(APILog.endpoint, APILog.method).order_by(mean.desc()).limit(limit)
+    return [
+        {
+            'endpoint': endpoint,
+            'method': method,
+            'count': count,
+            'avg_ms': round(avg_ms or 0, 3),
+            'max_ms': round(max_ms or 0, 3)
+        }
+        for endpoint, method, count, avg_ms, max_ms in rows
+    ]
+
+
+def latency_percentiles(since):
+    """p50/p95/p99 response time per route since ``since``.
+
+    Postgres computes them with percentile_cont; other databases stream the
+    timings sorted per route and compute them here.
+    """
+    base = db.session.query(APILog.endpoint, APILog.method).filter(
+        APILog.timestamp >= since, APILog.response_time.isnot(None)
+    )
+    if db.engine.dialect.name == 'postgresql':
+        percentiles = [
+            db.func.percentile_cont(fraction).within_group(APILog.response_time)
+            for fraction in (0.5, 0.95, 0.99)
+        ]
+        rows = base.add_columns(db.func.count(APILog.id), *percentiles).group_by(APILog.endpoint, APILog.method)
+        stats = [
+            {'endpoint': endpoint, 'method': method, 'count': count, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+            for endpoint, method, count, p50, p95, p99 in rows
+        ]
+    else:
+        stats = []
+        current, timings = None, []
+        rows = base.add_columns(APILog.response_time).order_by(
+            APILog.endpoint, APILog.method, APILog.response_time
+        ).yield_per(5000)
+        for endpoint, method, response_time in rows:
+            if (endpoint, method) != current:
+                if current:
+                    stats.append(_summarize(current, timings))
+                current, timings = (endpoint, method), []
+            timings.append(response_time)
+        if current:
+            stats.append(_summarize(current, timings))
+
+    for entry in stats:
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            entry[key] = round(entry[key], 3) if entry[key] is not None else None
+    return sorted(stats, key=lambda entry: entry['p95_ms'] or 0, reverse=True)
+
+
+def _summarize(route, timings):
+    endpoint, method = route
+    return {
+        'endpoint': endpoint,
+        'method': method,
+        'count': len(timings),
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99)
+    }
@@ -0,0 +1,223 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from models import SMSLog, db
+from services.log_queries import EXPORT_COLUMNS, export_value
+from services.metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process runs the archiver, so no lock is needed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SMS_ARCHIVED = registry.counter('sms_logs_archived_total', 'SMS log rows moved from the database to archive files')
+
+# Outbox rows still scheduled or in flight are never archived, however old
+OPEN_STATUSES = ('scheduled', 'pending', 'sending')
+
+
+class LogArchive:
+    """Archived SMSLog rows as gzip-compressed NDJSON files, one per day.
+
+    Files live at ``<directory>/YYYY/MM/sms_logs-YYYY-MM-DD.ndjson.gz`` and
+    hold the same objects as the NDJSON export. Each append adds a gzip
+    member, so a day can be archived over several batches. A row that was
+    archived twice (its batch was written but not deleted from the
+    database) is read back once.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv('SMS_ARCHIVE_DIR', 'archive')
+
+    def path_for(self, day):
+        return os.path.join(self.directory, f'{day:%Y}', f'{day:%m}', f'sms_logs-{day.isoformat()}.ndjson.gz')
+
+    def days(self, start=None, end=None):
+        """Archived days, oldest first, overlapping [start, end)"""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, '*', '*', 'sms_logs-*.ndjson.gz')):
+            try:
+                day = date.fromisoformat(os.path.basename(path)[len('sms_logs-'):-len('.ndjson.gz')])
+            except ValueError:
+                continue
+            if start is not None and day < start.date():
+                continue
+            if end is not None and datetime.combine(day, datetime.min.time()) >= end:
+                continue
+            found.append(day)
+        return sorted(found)
+
+    def append(self, rows):
+        """Write export-ordered value lists to their day files; durable when this returns"""
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(datetime.fromisoformat(row[EXPORT_COLUMNS.index('timestamp')]).date(), []).append(row)
+        for day, day_rows in by_day.items():
+            path = self.path_for(day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            body = ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')) + '\n' for row in day_rows)
+            with open(path, 'ab') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb') as member:
+                    member.write(body.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_day(self, day):
+        """One day's rows as dicts, oldest first"""
+        path = self.path_for(day)
+        rows, seen = [], set()
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    row = json.loads(line)
+                    if row['id'] not in seen:
+                        seen.add(row['id'])
+                        rows.append(row)
+        except FileNotFoundError:
+            return []
+        except (EOFError, gzip.BadGzipFile) as e:
+            # A member still being written; everything before it is complete
+            logger.warning("Truncated archive file %s: %s", path, e)
+        rows.sort(key=lambda row: (row['timestamp'], row['id']))
+        return rows
+
+    def iter_rows(self, start=None, end=None, newest_first=False):
+        """Archived rows with timestamp in [start, end), ordered by (timestamp, id)"""
+        days = self.days(start, end)
+        for day in reversed(days) if newest_first else days:
+            rows = self.read_day(day)
+            for row in reversed(rows) if newest_first else rows:
+                timestamp = datetime.fromisoformat(row['timestamp'])
+                if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                    yield row
+
+
+class RetentionWorker:
+    """Background move of SMS logs older than the retention period into the LogArchive.
+
+    Rows are archived oldest first in batches of ``batch_size``: each batch is
+    written and fsynced to the archive, then deleted by id in its own short
+    transaction, with a pause between batches so the archiver never holds
+    long locks on sms_logs. Across processes (gunicorn workers) a lock file
+    in the archive directory lets only one archiver run at a time.
+    """
+
+    def __init__(self, archive, retention_days=None, batch_size=None, interval=None, pause=None):
+        self.archive = archive
+        self.retention_days = retention_days if retention_days is not None else int(os.getenv('SMS_RETENTION_DAYS', '0'))
+        self.batch_size = batch_size or int(os.getenv('SMS_ARCHIVE_BATCH_SIZE', '1000'))
+        self.interval = interval if interval is not None else float(os.getenv('SMS_ARCHIVE_INTERVAL', '3600'))
+        self.pause = pause if pause is not None else float(os.getenv('SMS_ARCHIVE_BATCH_PAUSE', '0.05'))
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_archived = 0
+        self.last_error = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_archiver'] = self
+
+    def start(self):
+        if self._thread or self.retention_days <= 0 or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sms-archiver', daemon=True)
+        self._thread.start()
+        logger.info("Started SMS log archiver: rows older than %s days to %s", self.retention_days, self.archive.directory)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def cutoff(self, now=None):
+        return (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+
+    def archive_batch(self, cutoff):
+        """Archive and delete up to ``batch_size`` of the oldest expired rows; returns how many"""
+        columns = [getattr(SMSLog, name) for name in EXPORT_COLUMNS]
+        rows = (
+            db.session.query(*columns)
+            .filter(SMSLog.timestamp < cutoff, SMSLog.status.notin_(OPEN_STATUSES))
+            .order_by(SMSLog.timestamp.asc(), SMSLog.id.asc())
+            .limit(self.batch_size).all()
+        )
+        if not rows:
+            db.session.rollback()
+            return 0
+        self.archive.append([[export_value(value) for value in row] for row in rows])
+        ids = [row.id for row in rows]
+        SMSLog.query.filter(SMSLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        SMS_ARCHIVED.inc(len(ids))
+        return len(ids)
+
+    def run_once(self, now=None):
+        """Archive everything past the retention period; returns the number of rows moved"""
+        with self._exclusive() as acquired:
+            if not acquired:
+                logger.debug("Another process is archiving SMS logs, skipping this run")
+                return 0
+            cutoff = self.cutoff(now)
+            total = 0
+            while not self._stop.is_set():
+                archived = self.archive_batch(cutoff)
+                total += archived
+                if archived < self.batch_size:
+                    break
+                self._stop.wait(self.pause)
+        self.last_run = datetime.utcnow()
+        self.last_archived = total
+        if total:
+            logger.info("Archived %d SMS log row(s) older than %s", total, cutoff.isoformat())
+        return total
+
+    def _exclusive(self):
+        return _FileLock(os.path.join(self.archive.directory, '.lock'))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("SMS log archiving failed: %s", e)
+            self._stop.wait(self.interval)
+
+
+class _FileLock:
+    """Non-blocking exclusive flock; ``with`` yields whether it was acquired"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
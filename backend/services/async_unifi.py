@@ -0,0 +1,257 @@
+import asyncio
+import io
+import logging
+import os
+import time
+import asyncssh
+from services.unifi_service import (
+    STATUS_COMMANDS, MODEM_SHELL, MODEM_HOP_FAILED, BatchOutput, CircuitOpenError, DeviceUnavailableError,
+    remote_command, build_status, send_command, send_response, bulk_send_result
+)
+from services.circuit_breaker import CircuitBreaker
+from services.modem_scheduler import CommandScheduler, ModemBusyError, count_sends, lane_for
+from services.modem_parser import SMSListParser, parse_send_reference
+from services.metrics import DEVICE_COMMAND_SECONDS, SSH_CONNECT_SECONDS, SSH_RETRIES, SMS_SENT, SMS_FAILED, command_label
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncUniFiSMSService:
+    """asyncio counterpart of UniFiSMSService on asyncssh.
+
+    Commands run as channels multiplexed over ``connections`` SSH connections
+    of ``channels`` each, so hundreds of operations can be awaited on one
+    event loop while the device only sees a bounded number of sessions.
+    Every command has a timeout, and cancelling the awaiting task closes its
+    channel. Connections belong to the event loop that opened them; create
+    and use one instance per loop.
+    """
+
+    def __init__(self, name=None, host=None, username=None, password=None, phone_number=None, port=None,
+                 connections=None, channels=None, command_timeout=None, connect_timeout=None, breaker=None,
+                 commands=None):
+        self.name = name or os.getenv("UNIFI_DEVICE_NAME", "default")
+        self.ip = host or os.getenv("UNIFI_HOST")
+        self.port = port or int(os.getenv("UNIFI_SSH_PORT", "22"))
+        self.username = username or os.getenv("UNIFI_USERNAME")
+        self.password = password or os.getenv("UNIFI_PASSWORD")
+        self.phone_number = phone_number if phone_number is not None else os.getenv("UNIFI_PHONE_NUMBER", "")
+        self.connections = connections or int(os.getenv("UNIFI_ASYNC_CONNECTIONS", "2"))
+        self.channels = channels or int(os.getenv("UNIFI_ASYNC_CHANNELS", "8"))
+        self.command_timeout = command_timeout or float(os.getenv("UNIFI_ASYNC_COMMAND_TIMEOUT", "30"))
+        self.connect_timeout = connect_timeout or float(os.getenv("UNIFI_SSH_CONNECT_TIMEOUT", "10"))
+        self.breaker = breaker or CircuitBreaker(self.name)
+        self.commands = commands or CommandScheduler(self.name)
+        self._slots = [None] * self.connections
+        self._slot_locks = [asyncio.Lock() for _ in range(self.connections)]
+        self._channel_limit = asyncio.Semaphore(self.connections * self.channels)
+        self._next_slot = 0
+        self.in_flight = 0
+
+    @classmethod
+    def from_service(cls, service, **kwargs):
+        """Async twin of a configured (blocking) UniFiSMSService"""
+        return cls(
+            name=service.name, host=service.ip, port=service.port, username=service.username,
+            password=service.password, phone_number=service.phone_number, breaker=service.breaker,
+            commands=service.commands, **kwargs
+        )
+
+    async def _open(self):
+        started = time.monotonic()
+        # Like paramiko's AutoAddPolicy, the gateway's host key is not pinned
+        options = {'port': self.port, 'known_hosts': None}
+        if self.username:
+            options['username'] = self.username
+        if self.password:
+            options['password'] = self.password
+        conn = await asyncio.wait_for(asyncssh.connect(self.ip, **options), self.connect_timeout)
+        # Bring the modem link up once per connection, as the blocking service does
+        await asyncio.wait_for(conn.run("ifconfig usb0 up", check=False), self.command_timeout)
+        SSH_CONNECT_SECONDS.observe(time.monotonic() - started)
+        return conn
+
+    async def _connection(self, slot):
+        async with self._slot_locks[slot]:
+            conn = self._slots[slot]
+            if conn is None or conn.is_closed():
+                self._slots[slot] = conn = await self._open()
+            return conn
+
+    def _drop(self, slot, conn):
+        if self._slots[slot] is conn:
+            self._slots[slot] = None
+        conn.close()
+
+    async def _exec(self, remote, stdin_data=None, label='other', timeout=None, lane='status', sends=0):
+        """Run a remote command in a modem slot, through the device's circuit breaker (see UniFiSMSService._exec)"""
+        async with self.commands.slot_async(lane, sends):
+            return await self._exec_guarded(remote, stdin_data, label, timeout)
+
+    async def _exec_guarded(self, remote, stdin_data=None, label='other', timeout=None):
+        retry_in = self.breaker.before_call()
+        if retry_in is not None:
+            raise CircuitOpenError(self.name, retry_in)
+        try:
+            out, err, exit_code = await self._exec_channel(remote, stdin_data, label, timeout)
+        except (DeviceUnavailableError, TimeoutError) as e:
+            self.breaker.record_failure(e)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if exit_code == MODEM_HOP_FAILED:
+            self.breaker.record_failure(err.strip() or "SSH hop to the modem failed")
+        else:
+            self.breaker.record_success()
+        return out, err, exit_code
+
+    async def _exec_channel(self, remote, stdin_data=None, label='other', timeout=None):
+        """Run a remote command and return ``(stdout, stderr, exit_code)``.
+
+        Failures before the command reached the device raise
+        DeviceUnavailableError; a timeout raises TimeoutError. Either way, or
+        on cancellation, the channel is closed.
+        """
+        timeout = timeout or self.command_timeout
+        async with self._channel_limit:
+            self.in_flight += 1
+            try:
+                for attempt in range(2):
+                    slot = self._next_slot
+                    self._next_slot = (slot + 1) % self.connections
+                    conn = None
+                    try:
+                        conn = await self._connection(slot)
+                        process = await conn.create_process(remote)
+                    except (asyncssh.ChannelOpenError, asyncssh.DisconnectError) as e:
+                        # The connection is gone; the command did not run, so retrying is safe
+                        if conn is not None:
+                            self._drop(slot, conn)
+                        if attempt or conn is None:
+                            raise DeviceUnavailableError(self.name, e) from e
+                        logger.warning("SSH connection to %s broken (%s), reconnecting", self.name, e)
+                        SSH_RETRIES.inc()
+                        continue
+                    except (OSError, asyncssh.Error, asyncio.TimeoutError) as e:
+                        raise DeviceUnavailableError(self.name, e) from e
+
+                    started = time.perf_counter()
+                    try:
+                        if stdin_data is not None:
+                            process.stdin.write(stdin_data)
+                            process.stdin.write_eof()
+                        completed = await asyncio.wait_for(process.wait(check=False), timeout)
+                    except asyncio.TimeoutError:
+                        process.close()
+                        raise TimeoutError(f"'{label}' on {self.name} timed out after {timeout}s")
+                    except BaseException:
+                        process.close()
+                        raise
+                    DEVICE_COMMAND_SECONDS.observe(time.perf_counter() - started, command=label)
+                    return completed.stdout or '', completed.stderr or '', completed.exit_status
+            finally:
+                self.in_flight -= 1
+
+    async def execute(self, command, timeout=None, lane=None):
+        out, err, _exit_code = await self._exec(remote_command(command), label=command_label(command), timeout=timeout,
+                                                lane=lane or lane_for([command]), sends=count_sends([command]))
+        return out, err
+
+    async def execute_batch(self, commands, timeout=None, lane=None):
+        """Several cm commands in one remote shell, as UniFiSMSService.execute_batch"""
+        batch = BatchOutput(commands)
+        out, err, _exit_code = await self._exec(MODEM_SHELL, stdin_data=batch.script, label='batch', timeout=timeout,
+                                                lane=lane or lane_for(commands), sends=count_sends(commands))
+        for line in io.StringIO(out):
+            batch.feed_line(line)
+        return batch.results(err)
+
+    async def get_device_status(self):
+        """Fresh device status in one round trip (not cached, unlike the blocking service)"""
+        results = await self.execute_batch(list(STATUS_COMMANDS.values()))
+        return build_status({
+            section: result['stdout'].strip() for section, result in zip(STATUS_COMMANDS, results)
+        })
+
+    async def list_messages(self):
+        out, _err = await self.execute("sms list")
+        return self._parse_messages(out)
+
+    async def get_received_messages(self, clear=False):
+        commands = ["sms count", "sms list"]
+        if clear:
+            commands.append("sms clear")
+        results = await self.execute_batch(commands)
+        messages = self._parse_messages(results[1]['stdout'])
+        count = results[0]['stdout'].strip()
+        return {
+            'count': int(count) if count.isdigit() else len(messages),
+            'messages': messages
+        }
+
+    @staticmethod
+    def _parse_messages(output):
+        parser = SMSListParser()
+        messages = []
+        for line in io.StringIO(output):
+            record = parser.feed_line(line)
+            if record:
+                messages.append(record)
+        last = parser.close()
+        if last:
+            messages.append(last)
+        return messages
+
+    async def clear_messages(self):
+        await self.execute("sms clear")
+        return "ALL STORED MESSAGES CLEARED"
+
+    async def send_sms(self, number, message, timeout=None):
+        """Send one message. Logging to SMSLog is left to the caller."""
+        command = send_command(number, message)
+        try:
+            out, err, exit_code = await self._exec(remote_command(command), label=command_label(command), timeout=timeout,
+                                                   lane=lane_for([command]), sends=1)
+            device_response = send_response(self.name, out, err, exit_code)
+        except Exception:
+            SMS_FAILED.inc(mode='async')
+            raise
+        SMS_SENT.inc(mode='async')
+        return {'success': True, 'message': 'MESSAGE SENT', 'device_response': device_response,
+                'reference': parse_send_reference(device_response)}
+
+    async def send_bulk(self, messages, timeout=None):
+        """``(number, message)`` pairs in one remote shell, chunked by the send burst as the blocking service does"""
+        commands = [send_command(number, message) for number, message in messages]
+        chunk = self.commands.max_batch_sends or len(commands) or 1
+        results = []
+        for start in range(0, len(commands), chunk):
+            try:
+                results.extend(await self.execute_batch(commands[start:start + chunk], timeout=timeout, lane='bulk'))
+            except (DeviceUnavailableError, ModemBusyError) as e:
+                if not start:
+                    raise
+                logger.warning("Bulk send on %s stopped after %d message(s): %s", self.name, start, e)
+                results.extend({'stdout': '', 'stderr': str(e), 'exit_code': None} for _ in commands[start:])
+                break
+        sent = [bulk_send_result(number, outcome) for (number, _message), outcome in zip(messages, results)]
+        succeeded = sum(1 for result in sent if result['success'])
+        SMS_SENT.inc(succeeded, mode='async')
+        SMS_FAILED.inc(len(sent) - succeeded, mode='async')
+        return sent
+
+    async def close(self):
+        for slot, conn in enumerate(self._slots):
+            if conn is not None:
+                self._drop(slot, conn)
+                await conn.wait_closed()
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'channels_per_connection': self.channels,
+            'open': sum(1 for conn in self._slots if conn is not None and not conn.is_closed()),
+            'in_flight': self.in_flight,
+            'command_timeout': self.command_timeout,
+        }
@@ -0,0 +1,135 @@
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Stops calling a device that keeps failing, and probes it back in.
+
+    Closed, every call goes through; ``threshold`` consecutive failures open
+    the circuit. Open, calls are refused at once (``before_call`` returns the
+    seconds until the next probe) instead of each waiting out the connect
+    timeout. When the probe is due the circuit is half-open and lets exactly
+    one call through: success closes it, failure opens it again for twice as
+    long, jittered, up to ``backoff_max``.
+
+    Thread-safe; one breaker is shared by every session to a device.
+    """
+
+    def __init__(self, name, threshold=None, backoff_base=None, backoff_max=None):
+        self.name = name
+        self.threshold = threshold or int(os.getenv('UNIFI_CIRCUIT_THRESHOLD', '3'))
+        self.backoff_base = backoff_base or float(os.getenv('UNIFI_CIRCUIT_BACKOFF_BASE', '5'))
+        self.backoff_max = backoff_max or float(os.getenv('UNIFI_CIRCUIT_BACKOFF_MAX', '300'))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._probing = False
+        self._opened = 0  # consecutive times opened, the backoff exponent
+        self._retry_at = 0.0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self.last_contact = None
+        self.last_error = None
+
+    def _current(self, now):
+        """State with a due probe shown as half-open. Caller holds the lock."""
+        if self._state == OPEN and now >= self._retry_at:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current(time.monotonic())
+
+    def available(self):
+        """Whether a call now would be let through (closed, or a probe is due)"""
+        with self._lock:
+            state = self._current(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and not self._probing)
+
+    def backoff(self, opened):
+        """Seconds before the probe after the circuit opened ``opened`` times in a row"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (opened - 1))
+        return random.uniform(delay / 2, delay)
+
+    def before_call(self):
+        """None if the call may go ahead, else the seconds until the next probe.
+
+        A caller let through must report back with ``record_success``,
+        ``record_failure`` or ``release``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current(now)
+            if state == CLOSED:
+                return None
+            if state == HALF_OPEN and not self._probing:
+                self._state = HALF_OPEN
+                self._probing = True
+                logger.info("Probing device %s after %d consecutive failures", self.name, self.consecutive_failures)
+                return None
+            self.rejected += 1
+            # A probe is in flight: try again about when it will have finished
+            return max(self._retry_at - now, 1.0)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.warning("Device %s reachable again, circuit closed", self.name)
+            self._state = CLOSED
+            self._probing = False
+            self._opened = 0
+            self.consecutive_failures = 0
+            self.last_contact = datetime.utcnow()
+
+    def record_failure(self, error):
+        with self._lock:
+            self.last_error = str(error)
+            if self._state == OPEN:
+                # A call already in flight when the circuit opened: its failure is no news
+                # and must not push the probe further out
+                return
+            self.consecutive_failures += 1
+            if self._state == HALF_OPEN or self.consecutive_failures >= self.threshold:
+                self._opened += 1
+                delay = self.backoff(self._opened)
+                self._retry_at = time.monotonic() + delay
+                if self._state == CLOSED:
+                    self.trips += 1
+                    logger.warning("Device %s failed %d times in a row, circuit open for %.0fs: %s",
+                                   self.name, self.consecutive_failures, delay, error)
+                self._state = OPEN
+            self._probing = False
+
+    def release(self):
+        """End a call that says nothing about the device (e.g. the session pool was busy)"""
+        with self._lock:
+            if self._probing:
+                # Let the next call probe instead
+                self._state = OPEN
+                self._probing = False
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current(now)
+            return {
+                'state': state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in': round(max(0.0, self._retry_at - now), 1) if state == OPEN else 0.0,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'last_contact': self.last_contact.isoformat() if self.last_contact else None,
+                'last_error': self.last_error,
+            }
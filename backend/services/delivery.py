@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from models import SMSLog, db
+from services import events, rollups, webhooks
+from services.metrics import registry
+from services.modem_parser import delivery_outcome, is_status_report, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+SMS_DELIVERY_REPORTS = registry.counter(
+    'sms_delivery_reports_total', 'Modem delivery reports by the status they moved a message to', ['status'])
+
+# Modem and server clocks drift; a report may carry a time slightly before its message was logged
+CLOCK_SKEW = timedelta(minutes=5)
+# IN-list size per statement, well under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+
+class DeliveryReconciler:
+    """Background matching of modem delivery reports to sent SMS logs.
+
+    Sends record the modem's message reference on the SMSLog row
+    (``device_reference``). Status reports are taken out of each device's
+    storage listing and the matching ``sent`` rows move to ``delivered`` or
+    ``failed`` with one bulk UPDATE per status. The inbound poller lists
+    storage anyway and hands its reports over, so while it runs the
+    reconciler does not poll on its own; without it, the reconciler lists
+    every device's storage each interval itself.
+
+    The reference is a single byte and wraps, so reports are matched per
+    device and reference, newest report to the newest message sent before
+    it, within ``window_hours``; replaying an old report is a no-op.
+    """
+
+    def __init__(self, router, interval=None, window_hours=None):
+        self.router = router
+        self.interval = interval if interval is not None else float(os.getenv('SMS_DELIVERY_POLL_INTERVAL', '60'))
+        self.window = timedelta(hours=window_hours or float(os.getenv('SMS_DELIVERY_WINDOW_HOURS', '72')))
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_poll = None
+        self.last_error = None
+        self.reconciled = Counter()
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_delivery'] = self
+
+    def start(self):
+        if self._thread or self.interval <= 0:
+            return
+        inbound = self.app.extensions.get('sms_inbound')
+        if inbound is not None and inbound.reconciler is self and inbound.interval > 0:
+            logger.info("Delivery reports come from the inbound poller's listing")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sms-delivery', daemon=True)
+        self._thread.start()
+        logger.info("Started delivery report reconciler every %ss", self.interval)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'window_hours': self.window.total_seconds() / 3600,
+            'last_poll': self.last_poll.isoformat() if self.last_poll else None,
+            'last_error': self.last_error,
+            'reconciled': dict(self.reconciled),
+        }
+
+    def poll_once(self):
+        """Read and apply every device's status reports; one unreachable device does not stop the others"""
+        applied = Counter()
+        errors = []
+        for service in self.router.services:
+            try:
+                if service.count_messages() == 0:
+                    continue
+                listing = service.get_received_messages()['messages']
+                reports = [record for record in listing if is_status_report(record)]
+                applied.update(self.apply_reports(service.name, reports))
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Delivery report poll of %s failed: %s", service.name, e)
+                errors.append(f"{service.name}: {e}")
+        self.last_poll = datetime.utcnow()
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return dict(applied)
+
+    def apply_reports(self, device, reports):
+        """Move the sent messages these reports settle; returns ``{status: rows moved}``"""
+        settled = {}
+        for report in reports:
+            outcome = delivery_outcome(report.get('status'))
+            reference = report.get('reference')
+            if outcome is None or not reference:
+                continue
+            reported_at = parse_timestamp(report.get('timestamp')) or datetime.utcnow()
+            settled.setdefault(reference, []).append((reported_at, outcome))
+        if not settled:
+            return {}
+
+        oldest = min(min(found)[0] for found in settled.values()) - self.window
+        candidates = {}
+        for row in (
+            db.session.query(SMSLog.id, SMSLog.device_reference, SMSLog.timestamp, SMSLog.status)
+            .filter(SMSLog.device == device, SMSLog.device_reference.in_(list(settled)),
+                    SMSLog.direction == 'sent', SMSLog.timestamp >= oldest)
+            .order_by(SMSLog.timestamp.desc(), SMSLog.id.desc())
+        ):
+            candidates.setdefault(row.device_reference, []).append(row)
+
+        # Newest report first to the newest message sent before it, the next to the one before that, and so on
+        targets = {}
+        for reference, found in settled.items():
+            rows = iter(candidates.get(reference, ()))
+            for reported_at, outcome in sorted(found, reverse=True):
+                row = next((row for row in rows if row.timestamp <= reported_at + CLOCK_SKEW), None)
+                if row is None:
+                    break
+                if row.status == 'sent':
+                    targets.setdefault(outcome, []).append(row.id)
+
+        moved = {}
+        for status, ids in targets.items():
+            rows = []
+            for start in range(0, len(ids), CHUNK_SIZE):
+                rows.extend(self._move(ids[start:start + CHUNK_SIZE], status))
+            if rows:
+                moved[status] = len(rows)
+                self._announce(rows, status)
+        db.session.commit()
+        for status, count in moved.items():
+            SMS_DELIVERY_REPORTS.inc(count, status=status)
+            self.reconciled[status] += count
+        if moved:
+            logger.info("Delivery reports from %s: %s", device, ', '.join(f"{count} {status}" for status, count in moved.items()))
+        return moved
+
+    def _move(self, ids, status):
+        """One UPDATE moving still-``sent`` rows to ``status``; returns the rows it changed as they were before"""
+        table = SMSLog.__table__
+        statement = update(table).where(table.c.id.in_(ids), table.c.status == 'sent').values(status=status)
+        connection = db.session.connection()
+        if connection.dialect.update_returning:
+            # Only rows this statement changed, even if another worker reconciles the same report
+            return [dict(row._mapping, status='sent') for row in connection.execute(statement.returning(*table.c))]
+        rows = [dict(row._mapping) for row in connection.execute(
+            table.select().where(table.c.id.in_(ids), table.c.status == 'sent').with_for_update())]
+        connection.execute(statement)
+        return rows
+
+    def _announce(self, rows, status):
+        """What the flush hooks would have done for these rows: rollup deltas, stream events and webhooks"""
+        deltas = Counter()
+        changed = []
+        for row in rows:
+            old = rollups.rollup_key(row['timestamp'], row['user_id'], row['device'], row['direction'], 'sent')
+            new = rollups.rollup_key(row['timestamp'], row['user_id'], row['device'], row['direction'], status)
+            deltas[old] -= 1
+            deltas[new] += 1
+            changed.append(('sms', SMSLog(**dict(row, status=status)).to_dict(), row['user_id']))
+        rollups.apply_deltas(db.session.connection(), rollups.with_all_users(deltas))
+        events.queue_events(db.session, changed)
+        webhooks.queue_events(db.session, changed)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.poll_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("Delivery report reconciliation failed: %s", e)
+            self._stop.wait(self.interval)
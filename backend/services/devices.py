@@ -0,0 +1,346 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from services.unifi_service import UniFiSMSService, CircuitOpenError, DeviceUnavailableError
+from services.modem_scheduler import ModemBusyError
+
+logger = logging.getLogger(__name__)
+
+ROUTING_POLICIES = ('least_queue', 'sticky')
+
+
+class NoDeviceAvailableError(Exception):
+    """Raised when every device is excluded, or none frees a send slot in time"""
+
+
+def load_devices():
+    """UniFi gateways from the JSON file named by UNIFI_DEVICES_FILE.
+
+    The file holds a list of objects with ``name``, ``host``, ``username``,
+    ``password`` and optionally ``port``, ``phone_number``, ``pool_size`` and
+    ``max_concurrency``; missing credentials fall back to the UNIFI_* env vars.
+    Without the file the single device from UNIFI_HOST is used.
+    """
+    path = os.getenv('UNIFI_DEVICES_FILE')
+    if not path:
+        return [{'service': UniFiSMSService()}]
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if not entries:
+        raise ValueError(f'{path} lists no devices')
+    devices = []
+    for entry in entries:
+        if not entry.get('name') or not entry.get('host'):
+            raise ValueError(f'Every device in {path} needs a name and host')
+        service = UniFiSMSService(
+            name=entry['name'],
+            host=entry['host'],
+            port=entry.get('port'),
+            username=entry.get('username'),
+            password=entry.get('password'),
+            phone_number=entry.get('phone_number'),
+            pool_size=entry.get('pool_size')
+        )
+        devices.append({'service': service, 'max_concurrency': entry.get('max_concurrency')})
+    return devices
+
+
+class _DeviceState:
+    """Router bookkeeping for one device"""
+
+    def __init__(self, service, max_concurrency):
+        self.service = service
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.routed = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.last_error = None
+
+    @property
+    def name(self):
+        return self.service.name
+
+    def healthy(self, now):
+        return now >= self.unhealthy_until and self.service.breaker.available()
+
+    def load(self, planned=0):
+        return (self.in_flight + planned) / self.max_concurrency
+
+
+class DeviceRouter:
+    """Spreads sends over several UniFi gateways.
+
+    Each message goes to the healthy device with the lowest in-flight load
+    (``least_queue``), or with ``sticky`` to the device a recipient hashes to
+    while that device is healthy and has a free slot. A device is taken out
+    of rotation for ``cooldown`` seconds after ``failure_threshold``
+    consecutive connection failures, or while its circuit breaker is open;
+    sends that never reached a device fail over to the next one, as do sends
+    a device's command scheduler turned away (not counted as failures).
+    """
+
+    def __init__(self, devices, policy=None, failure_threshold=None, cooldown=None, acquire_timeout=None):
+        self.policy = policy or os.getenv('UNIFI_ROUTING_POLICY', 'least_queue')
+        if self.policy not in ROUTING_POLICIES:
+            raise ValueError(f'Unknown routing policy {self.policy!r}, expected one of {ROUTING_POLICIES}')
+        self.failure_threshold = failure_threshold or int(os.getenv('UNIFI_DEVICE_FAILURE_THRESHOLD', '3'))
+        self.cooldown = cooldown if cooldown is not None else float(os.getenv('UNIFI_DEVICE_COOLDOWN', '60'))
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else float(os.getenv('UNIFI_DEVICE_ACQUIRE_TIMEOUT', '30'))
+        self._lock = threading.Condition()
+        self._states = {}
+        for device in devices:
+            service = device['service']
+            if service.name in self._states:
+                raise ValueError(f'Duplicate device name {service.name!r}')
+            limit = device.get('max_concurrency') or service.pool.max_size
+            self._states[service.name] = _DeviceState(service, limit)
+
+    @classmethod
+    def from_env(cls):
+        return cls(load_devices())
+
+    @property
+    def services(self):
+        return [state.service for state in self._states.values()]
+
+    @property
+    def primary(self):
+        return next(iter(self._states.values())).service
+
+    def get(self, name=None):
+        """The named device's service, or the first device without a name. None if unknown."""
+        if not name:
+            return self.primary
+        state = self._states.get(name)
+        return state.service if state else None
+
+    def _preferred(self, number):
+        """Rendezvous hash: stable per recipient, and only moves recipients of a removed device"""
+        return max(
+            self._states,
+            key=lambda name: hashlib.sha256(f'{name}\x1f{number}'.encode('utf-8')).digest()
+        )
+
+    def _ranked(self, number=None, exclude=(), planned=None):
+        """Devices to try in order: healthy by policy, then unhealthy ones as a last resort. Caller holds the lock."""
+        now = time.monotonic()
+        planned = planned or {}
+        states = [state for name, state in self._states.items() if name not in exclude]
+        healthy = sorted(
+            (state for state in states if state.healthy(now)),
+            key=lambda state: (state.load(planned.get(state.name, 0)), state.routed)
+        )
+        if self.policy == 'sticky' and number is not None:
+            preferred = self._preferred(number)
+            healthy.sort(key=lambda state: state.name != preferred)
+        unhealthy = sorted((state for state in states if not state.healthy(now)), key=lambda state: state.unhealthy_until)
+        return healthy + unhealthy
+
+    def _acquire(self, number=None, exclude=(), device=None):
+        """Reserve a send slot on the best device with spare capacity, waiting up to acquire_timeout"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                if device is not None:
+                    ranked = [self._states[device]]
+                else:
+                    ranked = self._ranked(number, exclude)
+                if not ranked:
+                    raise NoDeviceAvailableError('No UniFi device left to try')
+                for state in ranked:
+                    if state.in_flight < state.max_concurrency:
+                        state.in_flight += 1
+                        state.routed += 1
+                        return state
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoDeviceAvailableError(f'No UniFi device had a free send slot after {self.acquire_timeout}s')
+                self._lock.wait(remaining)
+
+    def _record(self, state, error=None):
+        """Update a device's health after a send. Caller holds the lock."""
+        if error is None:
+            state.consecutive_failures = 0
+            state.unhealthy_until = 0.0
+            return
+        state.failures += 1
+        state.consecutive_failures += 1
+        state.last_error = str(error)
+        if state.consecutive_failures >= self.failure_threshold:
+            now = time.monotonic()
+            was_healthy = state.healthy(now)
+            state.unhealthy_until = now + self.cooldown
+            if was_healthy:
+                logger.warning("Device %s marked unhealthy for %ss: %s", state.name, self.cooldown, error)
+
+    def _release(self, state, error=None):
+        with self._lock:
+            state.in_flight -= 1
+            self._record(state, error)
+            self._lock.notify_all()
+
+    def retry_in(self):
+        """Seconds until the first device's circuit lets a call through, or None while any device is available"""
+        breakers = [service.breaker for service in self.services]
+        if any(breaker.available() for breaker in breakers):
+            return None
+        return min(max(breaker.stats()['retry_in'], 1.0) for breaker in breakers)
+
+    def choose(self, number=None, exclude=()):
+        """Name of the device to send to next, without reserving a slot.
+
+        For callers that bound concurrency themselves, like the async outbox;
+        report the outcome with ``record``.
+        """
+        with self._lock:
+            ranked = self._ranked(number, exclude)
+            if not ranked:
+                raise NoDeviceAvailableError('No UniFi device left to try')
+            ranked[0].routed += 1
+            return ranked[0].name
+
+    def record(self, name, error=None):
+        with self._lock:
+            self._record(self._states[name], error)
+
+    def send_sms(self, number, message, user_id=None):
+        """Send through the best device, failing over while the device could not be reached.
+
+        Returns ``(device_name, result)``.
+        """
+        tried = set()
+        busy = None
+        while True:
+            try:
+                state = self._acquire(number, exclude=tried)
+            except NoDeviceAvailableError:
+                if busy is not None:
+                    raise busy
+                raise
+            try:
+                result = state.service.send_sms(number, message, user_id=user_id)
+            except ModemBusyError as e:
+                self._release(state)
+                tried.add(state.name)
+                if busy is None or e.retry_after < busy.retry_after:
+                    busy = e
+                if len(tried) == len(self._states):
+                    raise busy
+                continue
+            except DeviceUnavailableError as e:
+                self._release(state, e)
+                tried.add(state.name)
+                if len(tried) == len(self._states):
+                    raise
+                logger.warning("Failing over from %s: %s", state.name, e)
+                continue
+            except Exception as e:
+                # The command may have reached the modem, so resending elsewhere could duplicate it
+                self._release(state, e)
+                raise
+            self._release(state)
+            return state.name, result
+
+    def send_bulk(self, messages, user_id=None):
+        """Split ``(number, message)`` pairs across devices and send each share as one batch.
+
+        Device batches run in parallel; a share whose device could not be
+        reached or was too busy is re-routed to the remaining devices. Returns
+        one result per message, in order, each tagged with the device that
+        handled it. Raises ModemBusyError if every device turned the batch away,
+        or DeviceUnavailableError if none could be reached.
+        """
+        app = current_app._get_current_object()
+        results = [None] * len(messages)
+        pending = list(range(len(messages)))
+        tried = set()
+        busy = None
+        unavailable = None
+
+        def run(name, indexes):
+            state = self._acquire(device=name)
+            try:
+                with app.app_context():
+                    outcome = state.service.send_bulk([messages[index] for index in indexes], user_id=user_id)
+            except Exception as e:
+                self._release(state, e)
+                raise
+            self._release(state)
+            return outcome
+
+        while pending:
+            groups = {}
+            with self._lock:
+                planned = {}
+                for index in pending:
+                    ranked = self._ranked(messages[index][0], exclude=tried, planned=planned)
+                    if not ranked:
+                        break
+                    name = ranked[0].name
+                    groups.setdefault(name, []).append(index)
+                    planned[name] = planned.get(name, 0) + 1 / len(pending)
+            if not groups:
+                if busy is not None and len(pending) == len(messages):
+                    # Every device turned the whole batch away: back off rather than fail it
+                    raise busy
+                if unavailable is not None and len(pending) == len(messages):
+                    # Nothing reached a modem: the caller retries the whole batch, like an open circuit up front
+                    raise unavailable
+                for index in pending:
+                    results[index] = {'to_number': messages[index][0], 'success': False, 'error': 'No UniFi device available'}
+                break
+
+            pending = []
+            with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix='sms-bulk') as executor:
+                futures = {name: executor.submit(run, name, indexes) for name, indexes in groups.items()}
+            for name, future in futures.items():
+                indexes = groups[name]
+                try:
+                    outcome = future.result()
+                except (DeviceUnavailableError, ModemBusyError, NoDeviceAvailableError) as e:
+                    if isinstance(e, ModemBusyError) and (busy is None or e.retry_after < busy.retry_after):
+                        busy = e
+                    if isinstance(e, DeviceUnavailableError) and not isinstance(unavailable, CircuitOpenError):
+                        unavailable = e
+                    logger.warning("Re-routing %d message(s) away from %s: %s", len(indexes), name, e)
+                    tried.add(name)
+                    pending.extend(indexes)
+                    continue
+                except Exception as e:
+                    outcome = [{'to_number': messages[index][0], 'success': False, 'error': str(e)} for index in indexes]
+                for index, result in zip(indexes, outcome):
+                    result['device'] = name
+                    results[index] = result
+            pending.sort()
+        return results
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'devices': [
+                    {
+                        'name': state.name,
+                        'host': state.service.ip,
+                        'healthy': state.healthy(now),
+                        'in_flight': state.in_flight,
+                        'max_concurrency': state.max_concurrency,
+                        'routed': state.routed,
+                        'failures': state.failures,
+                        'consecutive_failures': state.consecutive_failures,
+                        'retry_in': round(max(0.0, state.unhealthy_until - now), 1),
+                        'last_error': state.last_error,
+                        'circuit': state.service.breaker.stats(),
+                        'commands': state.service.commands.stats()
+                    }
+                    for state in self._states.values()
+                ]
+            }
@@ -0,0 +1,330 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+import uuid
+from collections import deque
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from models import SMSLog, db
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'sms_events'
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_BYTES = 7900
+
+
+def default_max_streams():
+    """SMS_EVENTS_MAX_STREAMS, or half the worker's request threads.
+
+    A stream holds a gthread request thread for its lifetime, so the cap
+    leaves the other half to the API.
+    """
+    configured = os.getenv('SMS_EVENTS_MAX_STREAMS')
+    if configured:
+        return int(configured)
+    return max(1, int(os.getenv('GUNICORN_THREADS', '8')) // 2)
+
+
+class Subscription:
+    """One open event stream: a bounded queue of events for one user (or all, for admins)"""
+
+    def __init__(self, user_id=None, admin=False, maxsize=256):
+        self.user_id = user_id
+        self.admin = admin
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def wants(self, item):
+        return self.admin or item['user_id'] is None or item['user_id'] == self.user_id
+
+
+class EventBroker:
+    """In-process publisher behind the /api/sms/events Server-Sent Events stream.
+
+    Events are ``inbound`` (a received message was stored), ``sms`` (a sent
+    message was queued or changed status; only its owner and admins get it)
+    and ``device`` (a gateway's status or health changed). Each stream has a
+    bounded queue; a client too slow to drain it gets a ``reset`` event and
+    is disconnected so it can reconnect and refetch. Recent events are kept
+    so a reconnecting client resumes from ``Last-Event-ID``.
+
+    Device status is polled once per interval for all streams together, and
+    only while at least one stream is open. On Postgres, message events are
+    sent with NOTIFY in the writing transaction and every process LISTENs,
+    so a stream sees changes made by any gunicorn worker.
+    """
+
+    def __init__(self, history=None, queue_size=None, max_streams=None, keepalive=None, max_age=None,
+                 device_interval=None):
+        self.history_size = history or int(os.getenv('SMS_EVENTS_HISTORY', '1000'))
+        self.queue_size = queue_size or int(os.getenv('SMS_EVENTS_QUEUE_SIZE', '256'))
+        self.max_streams = max_streams if max_streams is not None else default_max_streams()
+        self.keepalive = keepalive or float(os.getenv('SMS_EVENTS_KEEPALIVE', '15'))
+        self.max_age = max_age if max_age is not None else float(os.getenv('SMS_EVENTS_MAX_AGE', '300'))
+        self.device_interval = device_interval if device_interval is not None else float(os.getenv('SMS_EVENTS_DEVICE_INTERVAL', '30'))
+        # Event ids are only meaningful to the process that issued them
+        self.instance = uuid.uuid4().hex[:8]
+        self.app = None
+        self.notify = False
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._history = deque(maxlen=self.history_size)
+        self._sequence = itertools.count(1)
+        self._devices = {}
+        self._stop = threading.Event()
+        self._poll_now = threading.Event()
+        self._threads = []
+        self.published = 0
+        self.dropped_streams = 0
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_events'] = self
+        with app.app_context():
+            self.notify = db.engine.dialect.name == 'postgresql'
+            self._dsn = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        targets = [('sms-events-devices', self._monitor_devices)] if self.device_interval > 0 else []
+        if self.notify:
+            targets.append(('sms-events-listen', self._listen))
+        for name, target in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        self._poll_now.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def subscribe(self, user_id=None, admin=False):
+        """Open a stream; returns None when this process already serves max_streams"""
+        subscription = Subscription(user_id, admin, self.queue_size)
+        with self._lock:
+            if self.max_streams and len(self._subscriptions) >= self.max_streams:
+                return None
+            self._subscriptions.add(subscription)
+            devices = list(self._devices.values())
+        # A new dashboard starts with the last known state of every device
+        for item in devices:
+            subscription.queue.put_nowait(item)
+        if not devices:
+            self._poll_now.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event_type, data, user_id=None):
+        """Deliver an event to the streams of this process that may see it"""
+        item = {
+            'id': f"{self.instance}-{next(self._sequence)}",
+            'event': event_type,
+            'data': data,
+            'user_id': user_id,
+        }
+        with self._lock:
+            self._history.append(item)
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(item)]
+            self.published += 1
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(item)
+            except queue.Full:
+                subscription.overflowed = True
+        return item
+
+    def replay(self, subscription, last_event_id):
+        """Events after ``last_event_id`` for a reconnecting stream, or None if they are no longer known"""
+        instance, _, sequence = (last_event_id or '').partition('-')
+        if instance != self.instance or not sequence.isdigit():
+            return None
+        with self._lock:
+            history = list(self._history)
+        if history and int(history[0]['id'].partition('-')[2]) > int(sequence) + 1:
+            return None
+        return [item for item in history if int(item['id'].partition('-')[2]) > int(sequence) and subscription.wants(item)]
+
+    def stream(self, subscription, last_event_id=None):
+        """Yield the Server-Sent Events body for a subscription until the client goes away or max_age passes"""
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id:
+                missed = self.replay(subscription, last_event_id)
+                if missed is None:
+                    # Too far behind (or another process's ids): the client refetches over REST
+                    yield _frame({'id': None, 'event': 'reset', 'data': {'reason': 'history'}})
+                else:
+                    for item in missed:
+                        yield _frame(item)
+            opened = time.monotonic()
+            while not self._stop.is_set():
+                if subscription.overflowed:
+                    self.dropped_streams += 1
+                    yield _frame({'id': None, 'event': 'reset', 'data': {'reason': 'overflow'}})
+                    return
+                if self.max_age and time.monotonic() - opened > self.max_age:
+                    return
+                try:
+                    item = subscription.queue.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _frame(item)
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            streams = len(self._subscriptions)
+        return {
+            'streams': streams,
+            'max_streams': self.max_streams,
+            'published': self.published,
+            'dropped_streams': self.dropped_streams,
+            'notify': self.notify,
+        }
+
+    def _monitor_devices(self):
+        router = self.app.extensions['unifi_devices']
+        while not self._stop.is_set():
+            self._poll_now.wait(self.device_interval)
+            self._poll_now.clear()
+            with self._lock:
+                if not self._subscriptions:
+                    continue
+            try:
+                self.poll_devices(router)
+            except Exception as e:
+                logger.error("Device status poll for event streams failed: %s", e)
+
+    def poll_devices(self, router):
+        """Publish a ``device`` event for each gateway whose status or health changed"""
+        health = {device['name']: device['healthy'] for device in router.stats()['devices']}
+        for service in router.services:
+            # Served from the status cache, shared with /status
+            try:
+                status, error = service.get_device_status(), None
+            except Exception as e:
+                status, error = None, str(e)
+            snapshot = {'device': service.name, 'healthy': health.get(service.name), 'status': status, 'error': error}
+            with self._lock:
+                changed = self._devices.get(service.name, {}).get('data') != snapshot
+            if changed:
+                item = self.publish('device', snapshot)
+                with self._lock:
+                    self._devices[service.name] = item
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self._dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                logger.info("Listening for SMS events on Postgres channel %s", NOTIFY_CHANNEL)
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = json.loads(conn.notifies.pop(0).payload)
+                        self.publish(payload['event'], payload['data'], payload['user_id'])
+            except Exception as e:
+                logger.error("SMS event listener failed, reconnecting: %s", e)
+                self._stop.wait(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+def _frame(item):
+    lines = [f"id: {item['id']}"] if item['id'] else []
+    lines.append(f"event: {item['event']}")
+    lines.append(f"data: {json.dumps(item['data'], separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def message_events(session):
+    """``(event, data, user_id)`` for the SMSLog rows this flush inserts or changes status on"""
+    events = []
+    for obj in session.new:
+        if isinstance(obj, SMSLog):
+            if obj.direction == 'received':
+                events.append(('inbound', obj.to_dict(), None))
+            else:
+                events.append(('sms', obj.to_dict(), obj.user_id))
+    for obj in session.dirty:
+        if isinstance(obj, SMSLog) and inspect(obj).attrs.status.history.has_changes():
+            events.append(('sms', obj.to_dict(), obj.user_id))
+    return events
+
+
+def _notify_payload(event_type, data, user_id):
+    payload = json.dumps({'event': event_type, 'data': data, 'user_id': user_id}, separators=(',', ':'))
+    if len(payload.encode('utf-8')) > MAX_NOTIFY_BYTES:
+        data = dict(data, message=None, device_response=None, truncated=True)
+        payload = json.dumps({'event': event_type, 'data': data, 'user_id': user_id}, separators=(',', ':'))
+    return payload
+
+
+def queue_events(session, events):
+    """Publish ``(event, data, user_id)`` tuples once ``session`` commits.
+
+    Called by the flush hook; callers that change SMSLog rows with bulk
+    statements, which the hook cannot see, pass their changes here.
+    """
+    if not events:
+        return
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        # Delivered to every listening process when (and only if) the transaction commits
+        for event_type, data, user_id in events:
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {'channel': NOTIFY_CHANNEL, 'payload': _notify_payload(event_type, data, user_id)})
+    else:
+        session.info.setdefault('sms_events', []).extend(events)
+
+
+def _after_flush(session, flush_context):
+    queue_events(session, message_events(session))
+
+
+def _after_commit(session):
+    events = session.info.pop('sms_events', None)
+    if not events or not has_app_context():
+        return
+    broker = current_app.extensions.get('sms_events')
+    if broker is not None:
+        for event_type, data, user_id in events:
+            broker.publish(event_type, data, user_id)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    session.info.pop('sms_events', None)
+
+
+def install():
+    """Publish SMSLog changes made through any ORM session once they commit"""
+    for name, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                           ('after_soft_rollback', _after_soft_rollback)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
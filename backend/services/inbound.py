@@ -0,0 +1,139 @@
+import threading
+import logging
+import os
+from datetime import datetime, timedelta
+from models import SMSLog, db
+from services.modem_parser import parse_timestamp, fingerprint_messages, is_status_report
+
+logger = logging.getLogger(__name__)
+
+
+class InboundPoller:
+    """Background ingestion of received SMS from the modem into SMSLog.
+
+    Each poll reads every device's ``sms count``; only when storage holds
+    messages does it fetch ``sms list`` (and, with ``clear_after_ingest``,
+    ``sms clear``) in one batch. Status reports in the listing go to the
+    delivery reconciler, so storage is listed once for both. Parsed messages
+    are fingerprinted so repeated polls insert only new rows. Messages
+    cleared from the modem but not yet stored are kept in memory and stored
+    on the next poll.
+    """
+
+    def __init__(self, router, interval=None, clear_after_ingest=None, reconciler=None):
+        self.router = router
+        # Delivery reports share the modem's storage with received messages
+        self.reconciler = reconciler
+        self.interval = interval if interval is not None else float(os.getenv('SMS_INBOUND_POLL_INTERVAL', '30'))
+        if clear_after_ingest is None:
+            clear_after_ingest = os.getenv('SMS_INBOUND_CLEAR', 'false').lower() in ('1', 'true', 'yes')
+        self.clear_after_ingest = clear_after_ingest
+        # Messages already past retention would be archived and then re-ingested on every poll
+        self.retention_days = int(os.getenv('SMS_RETENTION_DAYS', '0'))
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_poll = None
+        self.last_error = None
+        # Fingerprinted messages per device, already cleared from the modem when their commit failed
+        self._unsaved = {}
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_inbound'] = self
+
+    def start(self):
+        if self._thread or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sms-inbound', daemon=True)
+        self._thread.start()
+        logger.info("Started inbound SMS poller every %ss", self.interval)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def poll_once(self):
+        """Poll every device; one unreachable device does not stop the others. Returns the new SMSLog rows."""
+        new_rows = []
+        errors = []
+        for service in self.router.services:
+            try:
+                new_rows.extend(self.poll_device(service))
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Inbound SMS poll of %s failed: %s", service.name, e)
+                errors.append(f"{service.name}: {e}")
+        self.last_poll = datetime.utcnow()
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return new_rows
+
+    def poll_device(self, service):
+        """Fetch one device's stored messages and insert unseen ones"""
+        if service.count_messages() == 0:
+            # An empty mailbox costs one short command instead of a full listing
+            listing = []
+        else:
+            # The clear runs right after the listing in the same modem shell, so only
+            # messages arriving in between are lost
+            listing = service.get_received_messages(clear=self.clear_after_ingest)['messages']
+        reports = [record for record in listing if is_status_report(record)]
+        if reports and self.reconciler is not None:
+            self.reconciler.apply_reports(service.name, reports)
+        # Scoped even with one device, so adding a gateway leaves stored fingerprints valid
+        messages = fingerprint_messages([record for record in listing if not is_status_report(record)], scope=service.name)
+        messages = self._unsaved.pop(service.name, []) + messages
+        try:
+            return self.ingest(messages, service)
+        except Exception:
+            if self.clear_after_ingest:
+                self._unsaved[service.name] = messages
+            raise
+
+    def ingest(self, messages, service):
+        """Insert parsed messages whose fingerprint is not stored yet, in one commit"""
+        if not messages:
+            return []
+        fingerprints = [message['fingerprint'] for message in messages]
+        existing = {
+            row.fingerprint for row in
+            db.session.query(SMSLog.fingerprint).filter(SMSLog.fingerprint.in_(fingerprints))
+        }
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days) if self.retention_days > 0 else None
+        rows = []
+        for message in messages:
+            if message['fingerprint'] in existing:
+                continue
+            timestamp = parse_timestamp(message.get('timestamp')) or datetime.utcnow()
+            if cutoff is not None and timestamp < cutoff:
+                continue
+            rows.append(SMSLog(
+                to_number=service.phone_number,
+                from_number=message.get('sender'),
+                message=message.get('text') or '',
+                direction='received',
+                status='received',
+                timestamp=timestamp,
+                fingerprint=message['fingerprint'],
+                device=service.name
+            ))
+        if rows:
+            db.session.add_all(rows)
+            db.session.commit()
+            logger.info("Ingested %d received SMS message(s) from %s", len(rows), service.name)
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.poll_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("Inbound SMS poll failed: %s", e)
+            self._stop.wait(self.interval)
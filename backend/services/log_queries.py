@@ -0,0 +1,172 @@
+import base64
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from itertools import islice
+from sqlalchemy import or_, tuple_
+from models import SMSLog
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sms_log):
+    """Opaque cursor for the position just after ``sms_log`` in (timestamp, id) DESC order"""
+    raw = f"{sms_log.timestamp.isoformat()}|{sms_log.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def parse_datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name} date, expected ISO 8601')
+
+
+def apply_filters(query, args):
+    """Narrow an SMSLog query by the direction/status/number/device/start/end request args"""
+    if args.get('direction'):
+        query = query.filter(SMSLog.direction == args['direction'])
+    if args.get('status'):
+        query = query.filter(SMSLog.status == args['status'])
+    if args.get('number'):
+        query = query.filter(or_(SMSLog.to_number == args['number'], SMSLog.from_number == args['number']))
+    if args.get('device'):
+        query = query.filter(SMSLog.device == args['device'])
+    if args.get('start'):
+        query = query.filter(SMSLog.timestamp >= parse_datetime(args['start'], 'start'))
+    if args.get('end'):
+        query = query.filter(SMSLog.timestamp < parse_datetime(args['end'], 'end'))
+    return query
+
+
+def archived_row_matches(row, args, user_id=None):
+    """apply_filters (and an optional user_id) for an archived row dict"""
+    if user_id is not None and row['user_id'] != user_id:
+        return False
+    if args.get('direction') and row['direction'] != args['direction']:
+        return False
+    if args.get('status') and row['status'] != args['status']:
+        return False
+    if args.get('number') and args['number'] not in (row['to_number'], row['from_number']):
+        return False
+    if args.get('device') and row['device'] != args['device']:
+        return False
+    return True
+
+
+def archived_rows(archive, args, user_id=None, newest_first=False, before=None):
+    """Archived rows matching the request args, optionally only those before a (timestamp, id) position"""
+    start = parse_datetime(args['start'], 'start') if args.get('start') else None
+    end = parse_datetime(args['end'], 'end') if args.get('end') else None
+    if before is not None:
+        end = min(end, before[0] + timedelta(microseconds=1)) if end else before[0] + timedelta(microseconds=1)
+    for row in archive.iter_rows(start, end, newest_first=newest_first):
+        if before is not None and (datetime.fromisoformat(row['timestamp']), row['id']) >= before:
+            continue
+        if archived_row_matches(row, args, user_id):
+            yield row
+
+
+def archived_log(row):
+    """Detached SMSLog for an archived row, so it serialises like a live one"""
+    values = {name: row.get(name) for name in EXPORT_COLUMNS}
+    for name in ('timestamp', 'send_at'):
+        values[name] = datetime.fromisoformat(values[name]) if values[name] else None
+    return SMSLog(**values)
+
+
+def page_size(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_page(query, args, archive=None, user_id=None):
+    """Return one page of ``query`` newest first, plus the cursor for the next page.
+
+    Seeks on (timestamp, id) instead of OFFSET so every page costs the same
+    regardless of depth. With an ``archive``, pages continue into archived
+    rows once the table runs out (``user_id`` narrows those as the query
+    does).
+    """
+    limit = page_size(args)
+    position = decode_cursor(args['cursor']) if args.get('cursor') else None
+    if position:
+        query = query.filter(tuple_(SMSLog.timestamp, SMSLog.id) < tuple_(*position))
+    rows = query.order_by(SMSLog.timestamp.desc(), SMSLog.id.desc()).limit(limit + 1).all()
+    if archive is not None and len(rows) <= limit:
+        older = archived_rows(archive, args, user_id=user_id, newest_first=True, before=position)
+        rows += [archived_log(row) for row in islice(older, limit + 1)]
+        rows.sort(key=lambda row: (row.timestamp or datetime.min, row.id), reverse=True)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+EXPORT_COLUMNS = [column.name for column in SMSLog.__table__.columns]
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_export_rows(query, archived=None):
+    """Yield plain column tuples oldest first, fetched in chunks from a server-side cursor.
+
+    Rows from ``archived`` (archived row dicts, oldest first) come before the table's.
+    """
+    for row in archived or ():
+        yield [row.get(name) for name in EXPORT_COLUMNS]
+    columns = [getattr(SMSLog, name) for name in EXPORT_COLUMNS]
+    rows = query.with_entities(*columns).order_by(SMSLog.timestamp.asc(), SMSLog.id.asc())
+    for row in rows.yield_per(EXPORT_CHUNK_ROWS):
+        yield [export_value(value) for value in row]
+
+
+def iter_export(query, fmt='ndjson', compress=False, archived=None):
+    """Yield the export body as byte chunks of roughly EXPORT_FLUSH_BYTES.
+
+    Memory stays bounded by the chunk size no matter how many rows match.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    for row in iter_export_rows(query, archived):
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')))
+            buffer.write('\n')
+        if buffer.tell() >= EXPORT_FLUSH_BYTES:
+            chunk = drain()
+            if chunk:
+                yield chunk
+
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,260 @@
+import re
+import hashlib
+from datetime import datetime, timedelta
+
+# "Key: value" lines in cm output; the key may carry a suffix such as "Text (12)" or "(PN)"
+FIELD_LINE = re.compile(r'^\s*([A-Za-z][A-Za-z0-9 _/.-]*?)\s*(?:\([^)]*\))?\s*:\s?(.*)$')
+SEPARATOR_LINE = re.compile(r'^\s*-{3,}\s*$')
+# The character count some cm builds print for a message body, "Text (12): ..."
+TEXT_LENGTH = re.compile(r'^\s*[A-Za-z][A-Za-z0-9 _/.-]*?\s*\((\d+)\)\s*:')
+
+# Field names used by different cm builds, mapped to one record key
+SMS_FIELD_ALIASES = {
+    'sender': 'sender',
+    'from': 'sender',
+    'originating_address': 'sender',
+    'phone_number': 'sender',
+    'timestamp': 'timestamp',
+    'time': 'timestamp',
+    'date': 'timestamp',
+    'text': 'text',
+    'message': 'text',
+    'content': 'text',
+    'body': 'text',
+    'id': 'slot',
+    'index': 'slot',
+    'type': 'type',
+    # Status reports (delivery receipts) for messages this modem sent
+    'reference': 'reference',
+    'message_reference': 'reference',
+    'ref': 'reference',
+    'tp_mr': 'reference',
+    'mr': 'reference',
+    'status': 'status',
+    'delivery_status': 'status',
+    'recipient': 'recipient',
+    'destination': 'recipient',
+}
+
+# The message reference (3GPP TP-MR) in ``cm sms send`` output, e.g. "Message reference: 17"
+SEND_REFERENCE = re.compile(r'\b(?:message[ _-]?reference|reference|ref|tp[ _-]?mr|mr)\b\s*[:=#]?\s*(\d+)', re.IGNORECASE)
+
+# Status report states, as words or TP-ST values; anything else means the network is still trying
+DELIVERED_STATES = {'delivered', 'success', 'succeeded', 'ok', 'received', 'completed', '0'}
+FAILED_STATES = {'failed', 'failure', 'expired', 'rejected', 'undeliverable', 'deleted', 'error', 'permanent_error'}
+
+# Modem timestamps look like "24/01/02,10:00:00+04" (3GPP) or plain ISO-ish strings
+TIMESTAMP_FORMATS = (
+    '%y/%m/%d,%H:%M:%S',
+    '%y/%m/%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%d/%m/%Y %H:%M:%S',
+)
+# Trailing "+04" / "-20" of a 3GPP timestamp: the zone offset in quarter hours
+QUARTER_HOUR_OFFSET = re.compile(r'(?<=\d)[+-]\d{1,2}$')
+
+
+def normalize_key(key):
+    return re.sub(r'[^a-z0-9]+', '_', key.strip().lower()).strip('_')
+
+
+def parse_timestamp(value):
+    """Best-effort conversion of a modem timestamp to a naive UTC datetime, or None.
+
+    3GPP timestamps end in the network's offset from UTC in quarter hours
+    ("+04" is UTC+1); they are shifted back by it. Timestamps without an
+    offset are taken as UTC already.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    offset = QUARTER_HOUR_OFFSET.search(value)
+    if offset:
+        value = value[:offset.start()]
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if offset:
+            parsed -= timedelta(minutes=15 * int(offset.group(0)))
+        return parsed
+    return None
+
+
+class SMSListParser:
+    """Incremental parser for ``cm sms list`` output.
+
+    Feed it one line at a time as the output arrives from the SSH channel;
+    ``feed_line`` returns a completed message dict when a record ends and
+    ``close`` returns the last one. Each dict has ``sender``, ``timestamp``
+    (raw string), ``text`` and, when the device reports them, ``slot`` and
+    ``type``. Status reports carry ``reference``, ``status`` and
+    ``recipient`` instead of a sender and text.
+
+    Text may span several lines, and a line of the body may look like a
+    field (``Time: 22:00``). With a ``Text (N)`` length the body runs for N
+    characters whatever it contains. Without one it runs until a separator,
+    an ``ID:``/``Index:`` line, or a blank line followed by a field the
+    record already has (the next record of an unseparated listing).
+    """
+
+    def __init__(self):
+        self.current = {}
+        self.field = None
+        # Characters of a "Text (N)" body not yet seen, or None when cm printed no length
+        self.text_left = None
+
+    def _finish(self):
+        record = None
+        if self.current.get('text') is not None or self.current.get('sender') or self.current.get('reference'):
+            record = dict(self.current)
+            record['text'] = record.get('text', '').rstrip('\n')
+        self.current = {}
+        self.field = None
+        self.text_left = None
+        return record
+
+    def _continues_text(self, line):
+        """Whether a line inside a text field is more of the body. Counts it off a known length."""
+        if self.text_left is not None:
+            # A further line needs room for its newline and at least one character
+            if self.text_left > 1:
+                self.text_left -= len(line) + 1
+                return True
+            return False
+        match = FIELD_LINE.match(line)
+        key = SMS_FIELD_ALIASES.get(normalize_key(match.group(1))) if match else None
+        if key == 'slot':
+            return False
+        return not (key in self.current and self.current['text'].endswith('\n'))
+
+    def feed_line(self, line):
+        line = line.rstrip('\r\n')
+        if SEPARATOR_LINE.match(line):
+            return self._finish()
+        if self.field == 'text':
+            if self._continues_text(line):
+                self.current['text'] += '\n' + line
+                return None
+            self.field = None
+        match = FIELD_LINE.match(line)
+        key = SMS_FIELD_ALIASES.get(normalize_key(match.group(1))) if match else None
+        if key:
+            # A repeated field means the previous record ended without a separator
+            record = self._finish() if key in self.current else None
+            if key == 'text':
+                self.current['text'] = match.group(2)
+                length = TEXT_LENGTH.match(line)
+                self.text_left = int(length.group(1)) - len(match.group(2)) if length else None
+            else:
+                self.current[key] = match.group(2).strip()
+            self.field = key
+            return record
+        if not line.strip():
+            self.field = None
+        return None
+
+    def close(self):
+        return self._finish()
+
+
+def parse_sms_list(output):
+    """Parse a complete ``cm sms list`` output string into a list of message dicts"""
+    parser = SMSListParser()
+    messages = [record for record in map(parser.feed_line, output.splitlines()) if record]
+    last = parser.close()
+    if last:
+        messages.append(last)
+    return messages
+
+
+def parse_send_reference(output):
+    """Message reference from ``sms send`` output, as a string, or None when the modem did not print one"""
+    match = SEND_REFERENCE.search(output or '')
+    return match.group(1) if match else None
+
+
+def is_status_report(record):
+    """Whether an ``sms list`` record is a delivery report rather than a received message"""
+    kind = normalize_key(record.get('type') or '')
+    if kind in ('sr', 'status_report', 'status', 'report', 'delivery_report'):
+        return True
+    return bool(record.get('reference')) and not record.get('sender')
+
+
+def delivery_outcome(state):
+    """'delivered' or 'failed' for a status report's state, or None while delivery is still pending"""
+    state = normalize_key(state or '')
+    if state in DELIVERED_STATES:
+        return 'delivered'
+    if state in FAILED_STATES:
+        return 'failed'
+    # Numeric TP-ST: 0x00-0x1F completed, 0x20-0x3F still trying, 0x40 and up permanent or given-up errors
+    if state.isdigit():
+        value = int(state)
+        if value < 0x20:
+            return 'delivered'
+        if value >= 0x40:
+            return 'failed'
+    return None
+
+
+def coerce_value(value):
+    """Turn purely numeric strings into int/float, leave everything else as text"""
+    value = value.strip()
+    if re.fullmatch(r'-?\d+', value):
+        digits = value.lstrip('-')
+        # Long or zero-padded digit strings (IMEI, ICCID, IMSI) are identifiers, not numbers
+        if len(digits) > 9 or (len(digits) > 1 and digits.startswith('0')):
+            return value
+        return int(value)
+    if re.fullmatch(r'-?(0|[1-9]\d*)?\.\d+', value):
+        return float(value)
+    return value
+
+
+def parse_key_values(output):
+    """Parse ``Key: value`` lines (``info all``, ``sim info``) into a dict with normalised keys"""
+    fields = {}
+    for line in output.splitlines():
+        match = FIELD_LINE.match(line)
+        if match and match.group(2).strip():
+            fields[normalize_key(match.group(1))] = coerce_value(match.group(2))
+    return fields
+
+
+def parse_temperatures(output):
+    """Parse ``temp all`` output into {sensor: degrees}, keeping the first number on each line"""
+    temperatures = {}
+    for line in output.splitlines():
+        match = FIELD_LINE.match(line)
+        if not match:
+            continue
+        number = re.search(r'[+-]?\d+(?:\.\d+)?', match.group(2))
+        if number:
+            temperatures[normalize_key(match.group(1))] = float(number.group(0))
+    return temperatures
+
+
+def scope_fingerprint(scope, fingerprint):
+    """Fingerprint of the device ``scope``: a hash over the content fingerprint, so stored ones can be rescoped"""
+    return hashlib.sha256(f'{scope}\x1f{fingerprint}'.encode('utf-8')).hexdigest()
+
+
+def fingerprint_messages(messages, scope=None):
+    """Attach a stable content fingerprint to each parsed message.
+
+    Identical messages within one listing get an occurrence number so they
+    are still stored separately. ``scope`` (a device name) keeps identical
+    messages received by different devices apart.
+    """
+    seen = {}
+    for message in messages:
+        base = '\x1f'.join((message.get('sender') or '', message.get('timestamp') or '', message.get('text') or ''))
+        occurrence = seen.get(base, 0)
+        seen[base] = occurrence + 1
+        fingerprint = hashlib.sha256(f'{base}\x1f{occurrence}'.encode('utf-8')).hexdigest()
+        message['fingerprint'] = scope_fingerprint(scope, fingerprint) if scope else fingerprint
+    return messages
@@ -0,0 +1,433 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from models import ModemSendBucket
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Highest priority first
+LANES = ('interactive', 'inbound', 'status', 'bulk')
+DEFAULT_DEPTHS = {'interactive': 200, 'inbound': 10, 'status': 20, 'bulk': 20}
+# Tries at a shared bucket's compare-and-set before the take counts as short of tokens
+SHARED_TAKE_ATTEMPTS = 3
+
+MODEM_QUEUE_WAIT = registry.histogram(
+    'unifi_modem_queue_wait_seconds', 'Time cm commands waited for a modem slot', ['lane'])
+MODEM_REJECTED = registry.counter(
+    'unifi_modem_rejected_total', 'Commands refused because their lane was full or the wait timed out', ['lane'])
+
+
+def count_sends(commands):
+    return sum(1 for command in commands if command.startswith('sms send'))
+
+
+def lane_for(commands):
+    """Default lane of a command list: sends in a batch are bulk, a single send interactive,
+    SMS storage commands inbound and everything else status"""
+    if count_sends(commands):
+        return 'bulk' if len(commands) > 1 else 'interactive'
+    if commands and commands[0].startswith('sms '):
+        return 'inbound'
+    return 'status'
+
+
+class ModemBusyError(Exception):
+    """A device's queue for this lane is full, or the wait for a slot timed out; nothing ran"""
+
+    def __init__(self, device, lane, retry_after):
+        super().__init__(f"Device {device} is busy ({lane} lane), retry in {retry_after}s")
+        self.device = device
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``rate`` tokens a second up to ``capacity``; a rate of 0 never runs dry. Caller locks."""
+
+    # Whether refill() has tokens to fetch from elsewhere
+    shared = False
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, count, now):
+        """Spend ``count`` tokens if there are enough (a count above capacity goes into debt)"""
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        if self.tokens < min(count, self.capacity):
+            return False
+        self.tokens -= count
+        return True
+
+    def wait_time(self, count, now):
+        """Seconds until ``take(count)`` can succeed"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(count, self.capacity) - self.tokens) / self.rate)
+
+    def available(self, now):
+        """Tokens there are now"""
+        self._refill(now)
+        return self.tokens
+
+    def refill(self, count):
+        """Fetch tokens for a send of ``count`` from outside the process; False as there is nowhere to fetch from"""
+        return False
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket kept in a modem_send_buckets row, so every process sending through the device shares it.
+
+    ``take``, ``wait_time`` and ``available`` only look at this process's
+    reservation and the row as last read, so the scheduler never waits on
+    the database under its lock. A send short of tokens reserves them with
+    ``refill``, which its waiting thread (or an executor, for asyncio
+    callers) runs without the lock: a read and a compare-and-set UPDATE on
+    the row's version, so no database lock is needed on either SQLite or
+    Postgres. Refills use wall-clock time, the only clock processes share.
+    While the database fails, the process paces itself with a local bucket.
+    """
+
+    shared = True
+
+    def __init__(self, rate, capacity, device, engine):
+        super().__init__(rate, capacity)
+        self.device = device
+        self.engine = engine
+        self._table = ModemSendBucket.__table__
+        # Tokens reserved from the row and not spent yet; reserved only for a waiting send
+        self.tokens = 0.0
+        self._row_tokens = float(capacity)
+        self._row_seen = time.time()
+        self._local = threading.Lock()
+        self._refilling = threading.Lock()
+        self._fallback = TokenBucket(rate, capacity)
+        self.failed = False
+
+    def _read(self, conn, now):
+        """``(tokens, version)`` of the device's row refilled to ``now``, creating it full"""
+        table = self._table
+        row = conn.execute(select(table.c.tokens, table.c.updated_at, table.c.version)
+                           .where(table.c.device == self.device)).first()
+        if row is None:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(table).values(device=self.device, tokens=float(self.capacity), updated_at=now, version=0))
+                return float(self.capacity), 0
+            except IntegrityError:
+                # Another process created it first
+                return self._read(conn, now)
+        return min(self.capacity, row.tokens + max(0.0, now - row.updated_at) * self.rate), row.version
+
+    def _row_estimate(self):
+        """Tokens in the row by now, from the last read"""
+        return min(self.capacity, self._row_tokens + max(0.0, time.time() - self._row_seen) * self.rate)
+
+    def take(self, count, now):
+        if self.rate <= 0:
+            return True
+        if self.failed:
+            return self._fallback.take(count, now)
+        with self._local:
+            if self.tokens < min(count, self.capacity):
+                return False
+            self.tokens -= count
+            return True
+
+    def wait_time(self, count, now):
+        if self.rate <= 0:
+            return 0.0
+        if self.failed:
+            return self._fallback.wait_time(count, now)
+        return max(0.0, (min(count, self.capacity) - self.tokens - self._row_estimate()) / self.rate)
+
+    def available(self, now):
+        if self.failed:
+            return self._fallback.available(now)
+        return self.tokens + self._row_estimate()
+
+    def refill(self, count):
+        """Reserve what a send of ``count`` still lacks from the row. Never call it holding the scheduler lock.
+
+        Returns True if tokens were added. Only one refill per process talks
+        to the database at a time; the others return False at once.
+        """
+        if self.rate <= 0 or not self._refilling.acquire(blocking=False):
+            return False
+        table = self._table
+        try:
+            with self._local:
+                # A batch above capacity left a debt; the row never holds more than capacity
+                wanted = min(min(count, self.capacity) - self.tokens, self.capacity)
+            if wanted <= 0:
+                return False
+            for _attempt in range(SHARED_TAKE_ATTEMPTS):
+                wall = time.time()
+                with self.engine.begin() as conn:
+                    tokens, version = self._read(conn, wall)
+                    self._row_tokens, self._row_seen = tokens, wall
+                    if tokens < wanted:
+                        break
+                    taken = conn.execute(
+                        update(table).where(table.c.device == self.device, table.c.version == version)
+                        .values(tokens=tokens - wanted, updated_at=wall, version=version + 1)
+                    ).rowcount
+                if taken:
+                    self._row_tokens = tokens - wanted
+                    with self._local:
+                        self.tokens += wanted
+                    self.failed = False
+                    return True
+            # Short of tokens, or other processes kept winning; the waiter tries again later
+            self.failed = False
+            return False
+        except SQLAlchemyError as e:
+            if not self.failed:
+                logger.warning("Shared send bucket of %s unavailable, pacing this process alone: %s", self.device, e)
+            self.failed = True
+            return False
+        finally:
+            self._refilling.release()
+
+
+class _Waiter:
+    __slots__ = ('lane', 'sends', 'notify', 'granted', 'queued_at')
+
+    def __init__(self, lane, sends, notify):
+        self.lane = lane
+        self.sends = sends
+        self.notify = notify
+        self.granted = False
+        self.queued_at = time.monotonic()
+
+
+class CommandScheduler:
+    """Admission control for one device's ``cm`` commands.
+
+    At most ``concurrency`` commands run on the modem at once. Waiting
+    commands queue in priority lanes (``LANES``: interactive sends, inbound
+    polls, status, bulk sends) and a free slot goes to the oldest command of
+    the highest lane. ``sms send`` commands also spend tokens from a bucket
+    refilled at ``send_rate`` per minute, so the modem never sends faster
+    than the carrier allows; while a send waits for tokens, commands that
+    send nothing may still use the free slot.
+
+    A lane already holding its configured depth refuses new commands with
+    ModemBusyError (an estimated ``retry_after`` included), as does a wait
+    longer than ``wait_timeout`` plus the time the command's sends take to
+    earn. Nothing has reached the device then, so the caller may retry it
+    anywhere. One scheduler is shared by the blocking and async services of
+    a device.
+
+    Each process has its own scheduler, so ``UNIFI_MODEM_CONCURRENCY`` is
+    split between the ``SMS_WORKER_PROCESSES`` (set by gunicorn.conf.py),
+    at least one slot each. Once ``share`` gives it the database, the send
+    bucket is one row every process draws from.
+    """
+
+    def __init__(self, name, concurrency=None, send_rate=None, send_burst=None, depths=None, wait_timeout=None):
+        self.name = name
+        processes = int(os.getenv('SMS_WORKER_PROCESSES', '1'))
+        self.concurrency = concurrency or max(1, int(os.getenv('UNIFI_MODEM_CONCURRENCY', '2')) // processes)
+        send_rate = send_rate if send_rate is not None else float(os.getenv('UNIFI_SEND_RATE_PER_MINUTE', '0'))
+        self.send_rate = send_rate
+        self.bucket = TokenBucket(send_rate / 60, send_burst or int(os.getenv('UNIFI_SEND_BURST', '5')))
+        self.depths = {
+            lane: int(os.getenv(f'UNIFI_MODEM_QUEUE_DEPTH_{lane.upper()}', str(default)))
+            for lane, default in DEFAULT_DEPTHS.items()
+        }
+        if depths:
+            self.depths.update(depths)
+        self.wait_timeout = wait_timeout or float(os.getenv('UNIFI_MODEM_WAIT_TIMEOUT', '60'))
+        self._lock = threading.Lock()
+        self._lanes = {lane: deque() for lane in LANES}
+        self.active = 0
+        # Moving average of how long a command holds its slot, for Retry-After estimates
+        self._hold_seconds = 1.0
+        self.rejected = {lane: 0 for lane in LANES}
+
+    def share(self, engine):
+        """Pace sends with a bucket in the database behind ``engine``, shared with other processes"""
+        if self.send_rate > 0:
+            self.bucket = SharedTokenBucket(self.bucket.rate, self.bucket.capacity, self.name, engine)
+
+    @property
+    def max_batch_sends(self):
+        """Most sends one batch should carry so it paces like single sends, or None without a rate"""
+        return self.bucket.capacity if self.send_rate > 0 else None
+
+    def _dispatch(self):
+        """Hand free slots to waiters in priority order. Caller holds the lock."""
+        now = time.monotonic()
+        # Once a send is short of tokens, later sends queue behind it instead of taking the refill
+        send_blocked = False
+        for lane in LANES:
+            for waiter in list(self._lanes[lane]):
+                if self.active >= self.concurrency:
+                    return
+                if waiter.sends:
+                    if send_blocked or not self.bucket.take(waiter.sends, now):
+                        send_blocked = True
+                        continue
+                self._lanes[lane].remove(waiter)
+                self.active += 1
+                waiter.granted = True
+                MODEM_QUEUE_WAIT.observe(now - waiter.queued_at, lane=lane)
+                waiter.notify()
+
+    def _retry_after(self, lane, sends=0):
+        """Rough seconds until a command queued now on ``lane`` would run. Caller holds the lock."""
+        ahead = self.active + sum(len(self._lanes[name]) for name in LANES[:LANES.index(lane) + 1])
+        estimate = ahead * self._hold_seconds / self.concurrency
+        if sends:
+            queued_sends = sum(waiter.sends for name in LANES for waiter in self._lanes[name])
+            estimate = max(estimate, self.bucket.wait_time(queued_sends + sends, time.monotonic()))
+        return max(1, math.ceil(estimate))
+
+    def _enqueue(self, lane, sends, notify):
+        with self._lock:
+            queue = self._lanes[lane]
+            if len(queue) >= self.depths[lane]:
+                self.rejected[lane] += 1
+                MODEM_REJECTED.inc(lane=lane)
+                raise ModemBusyError(self.name, lane, self._retry_after(lane, sends))
+            waiter = _Waiter(lane, sends, notify)
+            queue.append(waiter)
+            self._dispatch()
+            return waiter
+
+    def _deadline(self, sends):
+        """When a command queued now gives up: the wait timeout, plus the time its sends take to earn"""
+        earn = sends * 60 / self.send_rate if sends and self.send_rate > 0 else 0.0
+        return time.monotonic() + self.wait_timeout + earn
+
+    def _recheck_in(self, waiter, deadline):
+        """How long a waiter sleeps before dispatching again itself: tokens only refill with time"""
+        remaining = max(0.0, deadline - time.monotonic())
+        if waiter.sends and self.send_rate > 0:
+            return min(remaining, max(0.05, 60 / self.send_rate))
+        return remaining
+
+    def _poll(self, waiter, deadline):
+        """Dispatch again after a timed-out wait; True once granted. Raises ModemBusyError past the deadline."""
+        with self._lock:
+            if not waiter.granted:
+                self._dispatch()
+            if waiter.granted:
+                return True
+            if time.monotonic() < deadline:
+                return False
+            self._lanes[waiter.lane].remove(waiter)
+            self.rejected[waiter.lane] += 1
+            MODEM_REJECTED.inc(lane=waiter.lane)
+            raise ModemBusyError(self.name, waiter.lane, self._retry_after(waiter.lane, waiter.sends))
+
+    def _release(self, held):
+        with self._lock:
+            self.active -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            self._dispatch()
+
+    def _abandon(self, waiter):
+        """Withdraw a waiter whose caller gave up, giving back a slot it was granted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                self.active -= 1
+                self._dispatch()
+            else:
+                self._lanes[waiter.lane].remove(waiter)
+
+    @contextmanager
+    def slot(self, lane, sends=0):
+        """Hold a modem slot on ``lane`` for the body, with ``sends`` send tokens spent"""
+        event = threading.Event()
+        waiter = self._enqueue(lane, sends, event.set)
+        deadline = self._deadline(sends)
+        try:
+            while not event.is_set():
+                # A shared bucket's tokens come from the database, fetched here without the lock
+                if waiter.sends and self.bucket.refill(waiter.sends) and self._poll(waiter, deadline):
+                    break
+                if event.wait(self._recheck_in(waiter, deadline)) or self._poll(waiter, deadline):
+                    break
+        except ModemBusyError:
+            raise
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def slot_async(self, lane, sends=0):
+        """``slot`` for asyncio callers; waits without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(lane, sends, notify)
+        deadline = self._deadline(sends)
+        try:
+            while not granted.done():
+                # The database round trip runs in an executor, off the event loop
+                if (waiter.sends and self.bucket.shared
+                        and await loop.run_in_executor(None, self.bucket.refill, waiter.sends)
+                        and self._poll(waiter, deadline)):
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(granted), self._recheck_in(waiter, deadline))
+                    break
+                except asyncio.TimeoutError:
+                    if self._poll(waiter, deadline):
+                        break
+        except ModemBusyError:
+            raise
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def queued(self):
+        with self._lock:
+            return {lane: len(self._lanes[lane]) for lane in LANES}
+
+    def stats(self):
+        with self._lock:
+            # A shared bucket answers from its last read of the row, without a query
+            tokens = self.bucket.available(time.monotonic()) if self.send_rate > 0 else None
+            return {
+                'concurrency': self.concurrency,
+                'active': self.active,
+                'queued': {lane: len(self._lanes[lane]) for lane in LANES},
+                'depths': dict(self.depths),
+                'rejected': dict(self.rejected),
+                'send_rate_per_minute': self.send_rate,
+                'send_tokens': round(tokens, 2) if tokens is not None else None,
+                'shared_bucket': self.bucket.shared,
+            }
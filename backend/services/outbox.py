@@ -0,0 +1,300 @@
+import asyncio
+import math
+import threading
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from models import SMSLog, db
+from services.modem_scheduler import ModemBusyError
+from services.devices import NoDeviceAvailableError
+from services.unifi_service import DeviceUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Retry-After for a full outbox when no send rate says how fast it drains
+FULL_RETRY_AFTER = 30
+
+
+class OutboxFullError(Exception):
+    """The outbox already holds ``max_depth`` pending messages; nothing was queued"""
+
+    def __init__(self, depth, retry_after):
+        super().__init__(f"Outbox full ({depth} messages pending), retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SMSOutbox:
+    """Durable outbox for outgoing SMS.
+
+    Requests only insert a ``pending`` SMSLog row; background workers claim
+    rows oldest first, send them through the device router and record the
+    outcome and the device used on the same row. A message that reached no
+    modem (every device unreachable, behind an open circuit breaker, out of
+    free send slots or turned away by its command scheduler) goes back to
+    ``pending`` and the workers pause for
+    ``poll_interval`` rather than failing the queue. Once ``max_depth``
+    messages are pending, ``enqueue`` refuses more with OutboxFullError.
+
+    A claim records ``claimed_at``. Rows still ``sending`` ``claim_timeout``
+    seconds later (the worker died, or its commit failed) go back to
+    ``pending``. Such a message may have reached the modem before the worker
+    stopped, so it can be sent twice.
+
+    With ``async_concurrency`` set, one thread instead claims up to that many
+    rows at a time and sends them concurrently on an asyncio event loop
+    through AsyncUniFiSMSService, so in-flight sends are not capped by the
+    number of worker threads.
+    """
+
+    def __init__(self, router, workers=None, poll_interval=None, async_concurrency=None, max_depth=None,
+                 claim_timeout=None):
+        self.router = router
+        self.claim_timeout = claim_timeout or float(os.getenv('SMS_OUTBOX_CLAIM_TIMEOUT', '300'))
+        self.max_depth = max_depth if max_depth is not None else int(os.getenv('SMS_OUTBOX_MAX_DEPTH', '10000'))
+        self.workers = workers if workers is not None else int(os.getenv('SMS_OUTBOX_WORKERS', '2'))
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.getenv('SMS_OUTBOX_POLL_INTERVAL', '2'))
+        if async_concurrency is None:
+            async_concurrency = int(os.getenv('SMS_OUTBOX_ASYNC_CONCURRENCY', '0'))
+        self.async_concurrency = async_concurrency
+        self.app = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._next_requeue = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_outbox'] = self
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        if self.async_concurrency > 0 and self.workers > 0:
+            thread = threading.Thread(target=self._run_async, name='sms-outbox-async', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            logger.info("Started async SMS outbox worker with %d concurrent sends", self.async_concurrency)
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(index,), name=f'sms-outbox-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %d SMS outbox worker(s)", self.workers)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    def enqueue(self, number, message, user_id=None):
+        """Store a pending message and wake a worker. Returns the SMSLog row."""
+        self.check_capacity()
+        sms_log = SMSLog(
+            user_id=user_id,
+            to_number=number,
+            message=message,
+            direction='sent',
+            status='pending'
+        )
+        db.session.add(sms_log)
+        db.session.commit()
+        self._wakeup.set()
+        return sms_log
+
+    def depth(self):
+        """Number of messages waiting to be sent"""
+        return SMSLog.query.filter_by(direction='sent', status='pending').count()
+
+    def check_capacity(self):
+        """Raise OutboxFullError if ``max_depth`` messages are already pending (0 means no limit)"""
+        if self.max_depth <= 0:
+            return
+        # Counting stops at the limit, so a long queue costs no more than a full one
+        depth = (db.session.query(SMSLog.id).filter_by(direction='sent', status='pending')
+                 .limit(self.max_depth).count())
+        if depth < self.max_depth:
+            return
+        rate = sum(service.commands.send_rate for service in self.router.services)
+        retry_after = math.ceil(depth * 60 / rate) if rate > 0 else FULL_RETRY_AFTER
+        raise OutboxFullError(depth, retry_after)
+
+    def stats(self):
+        return {
+            'workers': len(self._threads),
+            'async_concurrency': self.async_concurrency,
+            'max_depth': self.max_depth,
+            'pending': self.depth(),
+            'sending': SMSLog.query.filter_by(direction='sent', status='sending').count()
+        }
+
+    def requeue_stale(self, now=None):
+        """Return rows claimed more than ``claim_timeout`` seconds ago, and never settled, to ``pending``"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.claim_timeout)
+        requeued = SMSLog.query.filter(
+            SMSLog.direction == 'sent', SMSLog.status == 'sending', SMSLog.claimed_at < cutoff
+        ).update({'status': 'pending', 'claimed_at': None}, synchronize_session=False)
+        db.session.commit()
+        if requeued:
+            logger.warning("Requeued %d outbox message(s) stuck in 'sending'", requeued)
+            self._wakeup.set()
+        return requeued
+
+    def _requeue_due(self):
+        """requeue_stale at most every tenth of claim_timeout, from one thread per process"""
+        if time.monotonic() >= self._next_requeue:
+            self._next_requeue = time.monotonic() + self.claim_timeout / 10
+            self.requeue_stale()
+
+    def claim_next(self):
+        """Atomically move the oldest pending row to 'sending'. Safe across threads and processes."""
+        while True:
+            candidate = db.session.query(SMSLog.id).filter_by(
+                direction='sent', status='pending'
+            ).order_by(SMSLog.id).first()
+            if candidate is None:
+                return None
+            claimed = SMSLog.query.filter_by(id=candidate.id, status='pending').update(
+                {'status': 'sending', 'claimed_at': datetime.utcnow()}, synchronize_session=False
+            )
+            db.session.commit()
+            if claimed:
+                return db.session.get(SMSLog, candidate.id)
+
+    def process(self, sms_log):
+        """Send a claimed row. Returns False if it went back to the queue."""
+        try:
+            outcome = self.router.send_sms(sms_log.to_number, sms_log.message)
+        except Exception as e:
+            outcome = e
+        sent = self._record(sms_log, outcome)
+        db.session.commit()
+        return sent
+
+    def _record(self, sms_log, outcome):
+        """Store a ``(device, result)`` send outcome, or the exception it raised, on the row.
+
+        Returns False if the row went back to ``pending`` instead.
+        """
+        if isinstance(outcome, (DeviceUnavailableError, ModemBusyError, NoDeviceAvailableError)):
+            # Never reached a device; released like claim_next took it, without a status event
+            logger.warning("Outbox send for log %s deferred: %s", sms_log.id, outcome)
+            SMSLog.query.filter_by(id=sms_log.id, status='sending').update(
+                {'status': 'pending', 'claimed_at': None}, synchronize_session=False
+            )
+            return False
+        if isinstance(outcome, BaseException):
+            logger.error("Outbox send failed for log %s: %s", sms_log.id, outcome)
+            sms_log.status = 'failed'
+            sms_log.device_response = str(outcome) or type(outcome).__name__
+            sms_log.device = getattr(outcome, 'device', None)
+            return True
+        device, result = outcome
+        sms_log.device = device
+        sms_log.status = 'sent'
+        sms_log.device_response = result.get('device_response')
+        sms_log.device_reference = result.get('reference')
+        return True
+
+    def drain_once(self):
+        """Send one queued message. Returns False when the outbox is empty or the devices are down."""
+        sms_log = self.claim_next()
+        if sms_log is None:
+            return False
+        return self.process(sms_log)
+
+    def drain_async(self, loop, services):
+        """Claim up to async_concurrency messages and send them concurrently on ``loop``.
+
+        Returns False when the outbox is empty or no message could be sent.
+        """
+        batch = []
+        while len(batch) < self.async_concurrency:
+            sms_log = self.claim_next()
+            if sms_log is None:
+                break
+            batch.append(sms_log)
+        if not batch:
+            return False
+        try:
+            outcomes = loop.run_until_complete(self._send_all(services, batch))
+        except Exception as e:
+            # Never leave claimed rows stuck in 'sending'
+            outcomes = [e] * len(batch)
+        sent = [self._record(sms_log, outcome) for sms_log, outcome in zip(batch, outcomes)]
+        db.session.commit()
+        return any(sent)
+
+    async def _send_all(self, services, batch):
+        return await asyncio.gather(
+            *(self._send_async(services, sms_log.to_number, sms_log.message) for sms_log in batch),
+            return_exceptions=True
+        )
+
+    async def _send_async(self, services, number, message):
+        """Route one message, failing over while the chosen device could not be reached"""
+        tried = set()
+        while True:
+            name = self.router.choose(number, exclude=tried)
+            try:
+                result = await services[name].send_sms(number, message)
+            except ModemBusyError:
+                # Turned away before reaching the modem; says nothing about its health
+                tried.add(name)
+                if len(tried) == len(services):
+                    raise
+                continue
+            except DeviceUnavailableError as e:
+                self.router.record(name, e)
+                tried.add(name)
+                if len(tried) == len(services):
+                    raise
+                logger.warning("Failing over from %s: %s", name, e)
+                continue
+            except Exception as e:
+                self.router.record(name, e)
+                raise
+            self.router.record(name)
+            return name, result
+
+    def _run_async(self):
+        # Imported here so the threaded mode does not load asyncssh
+        from services.async_unifi import AsyncUniFiSMSService
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        services = {service.name: AsyncUniFiSMSService.from_service(service) for service in self.router.services}
+        try:
+            while not self._stop.is_set():
+                try:
+                    with self.app.app_context():
+                        self._requeue_due()
+                        while not self._stop.is_set() and self.drain_async(loop, services):
+                            pass
+                except Exception as e:
+                    logger.error("Async outbox worker error: %s", e)
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        finally:
+            loop.run_until_complete(asyncio.gather(*(service.close() for service in services.values())))
+            loop.close()
+
+    def _run(self, index):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    if index == 0:
+                        self._requeue_due()
+                    while not self._stop.is_set() and self.drain_once():
+                        pass
+            except Exception as e:
+                logger.error("Outbox worker error: %s", e)
+            # Woken early by enqueue(); the timeout picks up rows queued by other processes
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
@@ -0,0 +1,185 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, func, insert, inspect, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import SMSDailyStat, SMSLog, db
+
+# Messages are counted once they settle; pending/sending are live outbox state (see /outbox)
+COUNTED_STATUSES = ('sent', 'delivered', 'failed', 'received')
+KEY_COLUMNS = ('user_id', 'day', 'device', 'direction', 'status')
+# Every message is also counted under this user_id, so totals across users read one row per day/device/status
+ALL_USERS = -1
+MAX_STATS_DAYS = 3660
+
+
+def rollup_key(timestamp, user_id, device, direction, status):
+    """The sms_daily_stats row a message with these values counts towards, or None"""
+    if status not in COUNTED_STATUSES or timestamp is None:
+        return None
+    return (user_id or 0, timestamp.date(), device or '', direction, status)
+
+
+# SMSLog attributes rollup_key reads, in its argument order
+ROLLUP_ATTRIBUTES = ('timestamp', 'user_id', 'device', 'direction', 'status')
+
+
+def _values(sms_log, previous=False):
+    """Key columns of an SMSLog as flushed, or as they were loaded when ``previous``"""
+    state = inspect(sms_log)
+    values = []
+    for name in ROLLUP_ATTRIBUTES:
+        value = getattr(sms_log, name)
+        if previous:
+            history = state.attrs[name].history
+            if history.deleted:
+                value = history.deleted[0]
+        values.append(value)
+    return values
+
+
+def collect_deltas(session):
+    """Count changes implied by the SMSLog rows this flush inserts or updates"""
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, SMSLog):
+            key = rollup_key(*_values(obj))
+            if key:
+                deltas[key] += 1
+    for obj in session.dirty:
+        if isinstance(obj, SMSLog) and session.is_modified(obj):
+            old, new = rollup_key(*_values(obj, previous=True)), rollup_key(*_values(obj))
+            if old != new:
+                if old:
+                    deltas[old] -= 1
+                if new:
+                    deltas[new] += 1
+    # Deleting or archiving logs leaves the totals alone: rollups are the long-term history
+    return with_all_users({key: delta for key, delta in deltas.items() if delta})
+
+
+def with_all_users(deltas):
+    """Per-user deltas plus the matching ALL_USERS ones"""
+    combined = Counter(deltas)
+    for (_user_id, day, device, direction, status), delta in deltas.items():
+        combined[(ALL_USERS, day, device, direction, status)] += delta
+    return {key: delta for key, delta in combined.items() if delta}
+
+
+def apply_deltas(connection, deltas):
+    """Add ``{key: delta}`` to the rollups on ``connection``, in key order so concurrent writers never deadlock"""
+    if not deltas:
+        return
+    table = SMSDailyStat.__table__
+    rows = [dict(zip(KEY_COLUMNS, key), count=delta) for key, delta in sorted(deltas.items())]
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        upsert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=list(KEY_COLUMNS), set_={'count': table.c.count + upsert.excluded['count']}
+        )
+        connection.execute(upsert, rows)
+        return
+    for row in rows:
+        matched = connection.execute(
+            update(table).where(*(table.c[name] == row[name] for name in KEY_COLUMNS))
+            .values(count=table.c.count + row['count'])
+        ).rowcount
+        if not matched:
+            connection.execute(insert(table), row)
+
+
+def _after_flush(session, flush_context):
+    deltas = collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def _track_previous(target, value, oldvalue, initiator):
+    """No-op; registered with active_history so the old value is in the history"""
+
+
+def install():
+    """Keep sms_daily_stats in step with SMSLog writes made through any ORM session.
+
+    Bulk ``Query.update``/Core statements bypass this; callers that change
+    counted columns that way pass their changes to apply_deltas themselves.
+    """
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+    for name in ROLLUP_ATTRIBUTES:
+        # Setting a column of an expired row (any row after a commit) would otherwise record no old value,
+        # and a status change would move no count
+        attribute = getattr(SMSLog, name)
+        if not event.contains(attribute, 'set', _track_previous):
+            event.listen(attribute, 'set', _track_previous, active_history=True)
+
+
+def rebuild():
+    """Recompute every rollup from sms_logs with one GROUP BY (after bulk loads that bypass the ORM)"""
+    day = func.date(SMSLog.timestamp)
+    device = func.coalesce(SMSLog.device, '')
+    db.session.execute(SMSDailyStat.__table__.delete())
+    user_id = func.coalesce(SMSLog.user_id, 0)
+    for user_column, grouping in ((user_id, (user_id,)), (db.literal(ALL_USERS), ())):
+        grouped = (
+            db.select(user_column, day, device, SMSLog.direction, SMSLog.status, func.count(SMSLog.id))
+            .where(SMSLog.timestamp.isnot(None), SMSLog.status.in_(COUNTED_STATUSES))
+            .group_by(*grouping, day, device, SMSLog.direction, SMSLog.status)
+        )
+        db.session.execute(insert(SMSDailyStat.__table__).from_select([*KEY_COLUMNS, 'count'], grouped))
+    db.session.commit()
+
+
+def parse_day(value, name):
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        raise ValueError(f'Invalid {name} date, expected YYYY-MM-DD')
+
+
+def query_stats(args, user_id=None):
+    """Totals and a per-day or per-month series from the rollups for the request args.
+
+    Cost depends on the number of days and device/status combinations in
+    range, not on how many messages were logged.
+    """
+    end = parse_day(args['end'], 'end') if args.get('end') else datetime.utcnow().date() + timedelta(days=1)
+    start = parse_day(args['start'], 'start') if args.get('start') else end - timedelta(days=30)
+    if start >= end:
+        raise ValueError('start must be before end')
+    if (end - start).days > MAX_STATS_DAYS:
+        raise ValueError(f'Date range is limited to {MAX_STATS_DAYS} days')
+    interval = args.get('interval', 'day')
+    if interval not in ('day', 'month'):
+        raise ValueError('interval must be day or month')
+
+    # (user_id, day, device, direction, status) is unique, so rows need no further grouping
+    query = (
+        db.select(SMSDailyStat.day, SMSDailyStat.device, SMSDailyStat.direction, SMSDailyStat.status, SMSDailyStat.count)
+        .where(SMSDailyStat.user_id == (ALL_USERS if user_id is None else user_id),
+               SMSDailyStat.day >= start, SMSDailyStat.day < end)
+    )
+    for name in ('device', 'direction', 'status'):
+        if args.get(name):
+            query = query.where(getattr(SMSDailyStat, name) == args[name])
+    rows = db.session.execute(query).all()
+
+    totals, by_direction, by_device, series = Counter(), Counter(), Counter(), {}
+    for day, device, direction, status, total in rows:
+        total = int(total or 0)
+        totals[status] += total
+        by_direction[direction] += total
+        by_device[device or 'unknown'] += total
+        period = day.isoformat() if interval == 'day' else day.strftime('%Y-%m')
+        series.setdefault(period, Counter())[status] += total
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'interval': interval,
+        'total': sum(totals.values()),
+        'by_status': dict(totals),
+        'by_direction': dict(by_direction),
+        'by_device': dict(by_device),
+        'series': [{'period': period, **series[period]} for period in sorted(series)],
+    }
@@ -0,0 +1,250 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update
+from models import SMSLog, db
+from services import events, webhooks
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SMS_SCHEDULE_LAG = registry.histogram(
+    'sms_schedule_lag_seconds', 'Delay between a scheduled send_at and the message entering the outbox')
+
+# IN-list size per release statement, well under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+# Wait before retrying after the database failed a release
+ERROR_BACKOFF = 5.0
+
+
+def parse_send_at(value):
+    """A request's ``send_at`` as naive UTC: ISO 8601, with an offset or else taken as UTC"""
+    try:
+        when = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError('Invalid send_at, expected ISO 8601')
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+
+class SendScheduler:
+    """Holds messages until their ``send_at``, then hands them to the outbox.
+
+    Scheduled messages wait in sms_logs with status ``scheduled``. Each
+    process keeps a min-heap of ``(send_at, id)``, loaded from the table when
+    the thread starts and pushed to as messages are scheduled here. The one
+    thread sleeps until the earliest entry is due, moves every due row to
+    ``pending`` with one UPDATE and wakes the outbox, so nothing polls the
+    table however many messages are waiting.
+
+    Cancelling or rescheduling leaves the old heap entry behind; the UPDATE
+    only matches rows still scheduled and due, so stale entries (and rows
+    another process released first) are no-ops. Every ``sweep_interval`` one
+    indexed UPDATE also releases overdue rows this process never saw, such as
+    those scheduled by a worker that has since exited.
+    """
+
+    def __init__(self, outbox, sweep_interval=None, max_days=None):
+        self.outbox = outbox
+        self.sweep_interval = sweep_interval if sweep_interval is not None else float(os.getenv('SMS_SCHEDULER_SWEEP_INTERVAL', '300'))
+        self.max_ahead = timedelta(days=max_days or int(os.getenv('SMS_SCHEDULE_MAX_DAYS', '365')))
+        self.app = None
+        self._heap = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.released = 0
+        self.last_error = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['sms_scheduler'] = self
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sms-scheduler', daemon=True)
+        self._thread.start()
+        logger.info("Started SMS send scheduler")
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _push(self, send_at, log_id):
+        with self._cond:
+            heapq.heappush(self._heap, (send_at, log_id))
+            if self._heap[0] == (send_at, log_id):
+                # Sooner than whatever the thread is sleeping towards
+                self._cond.notify()
+
+    def _check(self, send_at):
+        if send_at - datetime.utcnow() > self.max_ahead:
+            raise ValueError(f'send_at must be within {self.max_ahead.days} days')
+
+    def schedule(self, number, message, send_at, user_id=None):
+        """Store a message to go out at ``send_at`` (naive UTC); one already due is queued at once. Returns the SMSLog row."""
+        self._check(send_at)
+        if send_at <= datetime.utcnow():
+            return self.outbox.enqueue(number, message, user_id=user_id)
+        # The timestamp is when the message goes out, so history, stats and retention see it then
+        sms_log = SMSLog(
+            user_id=user_id,
+            to_number=number,
+            message=message,
+            direction='sent',
+            status='scheduled',
+            send_at=send_at,
+            timestamp=send_at
+        )
+        db.session.add(sms_log)
+        db.session.commit()
+        self._push(send_at, sms_log.id)
+        return sms_log
+
+    def reschedule(self, sms_log, send_at):
+        """Move a still-scheduled message to ``send_at``. False if it already left the schedule."""
+        self._check(send_at)
+        changed = SMSLog.query.filter_by(id=sms_log.id, status='scheduled').update(
+            {'send_at': send_at, 'timestamp': send_at}, synchronize_session=False
+        )
+        self._announce(sms_log, changed)
+        if changed:
+            self._push(send_at, sms_log.id)
+        return bool(changed)
+
+    def cancel(self, sms_log):
+        """Cancel a still-scheduled message. False if it already left the schedule."""
+        changed = SMSLog.query.filter_by(id=sms_log.id, status='scheduled').update(
+            {'status': 'cancelled'}, synchronize_session=False
+        )
+        self._announce(sms_log, changed)
+        return bool(changed)
+
+    def _announce(self, sms_log, changed):
+        """Commit a guarded update, with the stream event and webhook the flush hooks cannot see"""
+        if changed:
+            db.session.refresh(sms_log)
+            changes = [('sms', sms_log.to_dict(), sms_log.user_id)]
+            events.queue_events(db.session, changes)
+            webhooks.queue_events(db.session, changes)
+        db.session.commit()
+
+    def load(self):
+        """Rebuild the heap from every scheduled row, keeping entries pushed meanwhile"""
+        entries = [(send_at, log_id) for send_at, log_id in
+                   db.session.query(SMSLog.send_at, SMSLog.id).filter(SMSLog.status == 'scheduled')]
+        db.session.commit()
+        with self._cond:
+            entries.extend(self._heap)
+            heapq.heapify(entries)
+            self._heap = entries
+            self._cond.notify()
+        logger.info("Loaded %d scheduled message(s)", len(entries))
+
+    def release_due(self, now=None):
+        """Move every due message in the heap to ``pending``; returns how many rows this call moved"""
+        now = now or datetime.utcnow()
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        if not due:
+            return 0
+        try:
+            ids = [log_id for _send_at, log_id in due]
+            released = sum(self._release(SMSLog.id.in_(ids[start:start + CHUNK_SIZE]), now)
+                           for start in range(0, len(ids), CHUNK_SIZE))
+        except Exception:
+            db.session.rollback()
+            with self._cond:
+                for entry in due:
+                    heapq.heappush(self._heap, entry)
+            raise
+        for send_at, _log_id in due:
+            SMS_SCHEDULE_LAG.observe((now - send_at).total_seconds())
+        return released
+
+    def sweep(self, now=None):
+        """Release overdue scheduled rows whether or not this process's heap has them"""
+        return self._release(None, now or datetime.utcnow())
+
+    def _release(self, criterion, now):
+        """One UPDATE moving due scheduled rows to ``pending``, announced like the outbox's own enqueues"""
+        table = SMSLog.__table__
+        due = [table.c.status == 'scheduled', table.c.send_at <= now]
+        if criterion is not None:
+            due.append(criterion)
+        statement = update(table).where(*due).values(status='pending')
+        connection = db.session.connection()
+        if connection.dialect.update_returning:
+            # Only rows this statement changed, even if another process releases the same ones
+            rows = [dict(row._mapping) for row in connection.execute(statement.returning(*table.c))]
+        else:
+            rows = [dict(row._mapping, status='pending') for row in connection.execute(
+                table.select().where(*due).with_for_update())]
+            ids = [row['id'] for row in rows]
+            for start in range(0, len(ids), CHUNK_SIZE):
+                connection.execute(statement.where(table.c.id.in_(ids[start:start + CHUNK_SIZE])))
+        # The flush hooks cannot see a bulk UPDATE
+        changes = [('sms', SMSLog(**row).to_dict(), row['user_id']) for row in rows]
+        events.queue_events(db.session, changes)
+        webhooks.queue_events(db.session, changes)
+        db.session.commit()
+        if rows:
+            self.released += len(rows)
+            self.outbox.wake()
+        return len(rows)
+
+    def stats(self):
+        with self._cond:
+            entries = len(self._heap)
+            next_due = self._heap[0][0] if self._heap else None
+        return {
+            'scheduled': SMSLog.query.filter_by(status='scheduled').count(),
+            'heap_entries': entries,
+            'next_due': next_due.isoformat() if next_due else None,
+            'released': self.released,
+            'last_error': self.last_error,
+        }
+
+    def _run(self):
+        loaded = False
+        next_sweep = time.monotonic() + self.sweep_interval
+        while not self._stop.is_set():
+            delay = None
+            try:
+                with self.app.app_context():
+                    if not loaded:
+                        self.load()
+                        loaded = True
+                        # Rows that fell due while no process was running
+                        self.sweep()
+                    self.release_due()
+                    if self.sweep_interval > 0 and time.monotonic() >= next_sweep:
+                        self.sweep()
+                        next_sweep = time.monotonic() + self.sweep_interval
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("SMS scheduler error: %s", e)
+                delay = ERROR_BACKOFF
+            with self._cond:
+                if self._stop.is_set():
+                    break
+                if delay is None:
+                    delay = next_sweep - time.monotonic() if self.sweep_interval > 0 else None
+                    if self._heap:
+                        due_in = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+                        delay = due_in if delay is None else min(delay, due_in)
+                if delay is None or delay > 0:
+                    self._cond.wait(delay)
@@ -0,0 +1,194 @@
+import paramiko
+import threading
+import logging
+import time
+from contextlib import contextmanager
+from services.metrics import SSH_CONNECT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the SSH transport underneath a pooled client is unusable
+TRANSPORT_ERRORS = (paramiko.SSHException, EOFError, OSError)
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no pooled SSH session becomes available in time"""
+
+
+class SSHConnectionPool:
+    """Keeps authenticated SSH clients to the UniFi device alive between calls.
+
+    Clients are created by ``factory`` (which also runs the ``usb0`` bring-up),
+    so that work happens once per session instead of once per request.
+    """
+
+    def __init__(self, factory, max_size=4, idle_timeout=300, keepalive_interval=30, acquire_timeout=30):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._lock = threading.Condition()
+        self._idle = []  # list of (client, last_used) - most recently used last
+        self._in_use = set()
+        self._connecting = 0
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'reconnects': 0,
+            'expired': 0,
+            'discarded': 0,
+            'connect_failures': 0,
+            'last_connect_ms': None,
+            'last_error': None,
+        }
+
+    @staticmethod
+    def is_alive(client):
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _open(self):
+        started = time.monotonic()
+        try:
+            client = self.factory()
+        except Exception as e:
+            with self._lock:
+                self._stats['connect_failures'] += 1
+                self._stats['last_error'] = str(e)
+            raise
+        transport = client.get_transport()
+        if transport is not None and self.keepalive_interval:
+            transport.set_keepalive(self.keepalive_interval)
+        elapsed = time.monotonic() - started
+        SSH_CONNECT_SECONDS.observe(elapsed)
+        with self._lock:
+            self._stats['created'] += 1
+            self._stats['last_connect_ms'] = round(elapsed * 1000, 2)
+        logger.debug("Opened pooled SSH session")
+        return client
+
+    def _close(self, client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def _take_idle(self):
+        """Pop a usable idle client, closing expired or dead ones. Caller holds the lock."""
+        now = time.monotonic()
+        stale = []
+        client = None
+        while self._idle:
+            candidate, last_used = self._idle.pop()
+            if now - last_used > self.idle_timeout:
+                self._stats['expired'] += 1
+                stale.append(candidate)
+            elif not self.is_alive(candidate):
+                self._stats['reconnects'] += 1
+                stale.append(candidate)
+            else:
+                client = candidate
+                break
+        # Anything older than the one we picked is older still
+        for candidate, last_used in list(self._idle):
+            if now - last_used > self.idle_timeout:
+                self._idle.remove((candidate, last_used))
+                self._stats['expired'] += 1
+                stale.append(candidate)
+        return client, stale
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                client, stale = self._take_idle()
+                if client is not None:
+                    self._stats['reused'] += 1
+                    self._in_use.add(client)
+                    break
+                if len(self._in_use) + self._connecting < self.max_size:
+                    # Reserve the slot while connecting outside the lock
+                    self._connecting += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f'No SSH session available after {self.acquire_timeout}s')
+                self._lock.wait(remaining)
+
+        for candidate in stale:
+            self._close(candidate)
+        if client is not None:
+            return client
+
+        try:
+            client = self._open()
+        except Exception:
+            with self._lock:
+                self._connecting -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._connecting -= 1
+            self._in_use.add(client)
+        return client
+
+    def release(self, client):
+        with self._lock:
+            if client not in self._in_use:
+                return
+            self._in_use.discard(client)
+            alive = self.is_alive(client)
+            if alive:
+                self._idle.append((client, time.monotonic()))
+            self._lock.notify()
+        if not alive:
+            self._close(client)
+
+    def discard(self, client):
+        """Drop a client whose transport is broken so the next caller reconnects"""
+        with self._lock:
+            if client not in self._in_use:
+                return
+            self._in_use.discard(client)
+            self._stats['discarded'] += 1
+            self._lock.notify()
+        self._close(client)
+        logger.warning("Discarded broken SSH session")
+
+    @contextmanager
+    def connection(self):
+        client = self.acquire()
+        try:
+            yield client
+        except TRANSPORT_ERRORS:
+            self.discard(client)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        else:
+            self.release(client)
+
+    def close_all(self):
+        with self._lock:
+            idle = [client for client, _ in self._idle]
+            self._idle = []
+        for client in idle:
+            self._close(client)
+
+    def stats(self):
+        with self._lock:
+            in_use = len(self._in_use)
+            idle = len(self._idle)
+            return {
+                'max_size': self.max_size,
+                'idle_timeout': self.idle_timeout,
+                'keepalive_interval': self.keepalive_interval,
+                'open': in_use + idle,
+                'in_use': in_use,
+                'idle': idle,
+                'connecting': self._connecting,
+                **self._stats,
+            }
@@ -0,0 +1,136 @@
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """One in-progress load that concurrent callers wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Per-key TTL cache with single-flight loading and stale-while-revalidate.
+
+    ``loader`` takes a list of keys and returns a dict of their values, so
+    several expired keys are fetched together. Concurrent callers for a key
+    that is already loading wait for that load instead of starting another.
+    Entries past their TTL but within ``stale_ttl`` are served immediately
+    while a background refresh runs.
+    """
+
+    def __init__(self, loader, ttls=None, default_ttl=60, stale_ttl=0):
+        self.loader = loader
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (value, fetched_at)
+        self._inflight = {}  # key -> _Flight
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'background_refreshes': 0,
+            'errors': 0,
+        }
+
+    def ttl(self, key):
+        return self.ttls.get(key, self.default_ttl)
+
+    def get_many(self, keys, refresh=False):
+        """Return {key: value}, loading missing or expired keys. ``refresh`` skips cached values."""
+        now = time.monotonic()
+        result = {}
+        load, revalidate, wait = [], [], {}
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                age = now - entry[1] if entry else None
+                if not refresh and entry and age <= self.ttl(key):
+                    self._stats['hits'] += 1
+                    result[key] = entry[0]
+                elif not refresh and entry and age <= self.ttl(key) + self.stale_ttl:
+                    self._stats['stale_hits'] += 1
+                    result[key] = entry[0]
+                    if key not in self._inflight:
+                        self._inflight[key] = _Flight()
+                        revalidate.append(key)
+                elif key in self._inflight:
+                    self._stats['coalesced'] += 1
+                    wait[key] = self._inflight[key]
+                else:
+                    self._stats['misses'] += 1
+                    self._inflight[key] = _Flight()
+                    load.append(key)
+
+        if revalidate:
+            with self._lock:
+                self._stats['background_refreshes'] += 1
+            threading.Thread(target=self._load, args=(revalidate, False), daemon=True).start()
+        if load:
+            result.update(self._load(load, True))
+        for key, flight in wait.items():
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            result[key] = flight.value
+        return result
+
+    def get(self, key, refresh=False):
+        return self.get_many([key], refresh=refresh)[key]
+
+    def _load(self, keys, raise_errors):
+        with self._lock:
+            flights = {key: self._inflight[key] for key in keys}
+        try:
+            values = self.loader(keys)
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                for key, flight in flights.items():
+                    flight.error = e
+                    self._inflight.pop(key, None)
+            for flight in flights.values():
+                flight.event.set()
+            if raise_errors:
+                raise
+            logger.warning("Background cache refresh failed: %s", e)
+            return {}
+
+        fetched_at = time.monotonic()
+        with self._lock:
+            for key, flight in flights.items():
+                self._entries[key] = (values.get(key), fetched_at)
+                flight.value = values.get(key)
+                self._inflight.pop(key, None)
+        for flight in flights.values():
+            flight.event.set()
+        return {key: values.get(key) for key in keys}
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                **self._stats,
+                'ttls': dict(self.ttls),
+                'default_ttl': self.default_ttl,
+                'stale_ttl': self.stale_ttl,
+                'ages': {key: round(now - fetched_at, 1) for key, (_, fetched_at) in self._entries.items()},
+                'loading': sorted(self._inflight),
+            }
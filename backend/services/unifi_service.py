@@ -1,75 +1,402 @@
 import paramiko
 import os
+import logging
+import re
+import shlex
+import time
+import uuid
 from models import SMSLog, db
 from datetime import datetime
+from services.ssh_pool import SSHConnectionPool, PoolExhaustedError, TRANSPORT_ERRORS
+from services.circuit_breaker import CircuitBreaker
+from services.modem_scheduler import CommandScheduler, ModemBusyError, count_sends, lane_for
+from services.status_cache import TTLCache
+from services.modem_parser import SMSListParser, parse_key_values, parse_send_reference, parse_temperatures
+from services.metrics import DEVICE_COMMAND_SECONDS, SSH_RETRIES, SMS_SENT, SMS_FAILED, command_label
+
+logger = logging.getLogger(__name__)
+
+CM_BINARY = "/legato/systems/current/bin/cm"
+
+# Device status sections and the cm command that produces each
+STATUS_COMMANDS = {
+    'device_info': "info all",
+    'sim_info': "sim info",
+    'temperature_info': "temp all",
+}
+
+
+# Remote command that runs a shell script from stdin on the modem
+MODEM_SHELL = "ssh -y root@$(cat /var/run/topipv6) sh"
+
+# Exit status of the gateway's ssh client when the hop to the modem failed (usb0 link down)
+MODEM_HOP_FAILED = 255
+
+
+def remote_command(command):
+    """Wrap a cm command in the hop from the gateway to the modem.
+    
+    The command is quoted once more for the gateway's shell, so arguments
+    quoted in ``command`` arrive intact on the modem.
+    """
+    return f"ssh -y root@$(cat /var/run/topipv6) {shlex.quote(f'{CM_BINARY} {command}')}"
+
+
+class BatchOutput:
+    """Script and output splitting for running several cm commands in one shell.
+    
+    Each command is followed by a sentinel line on stdout and stderr so the
+    combined output can be split back up per command. Stdout lines are fed in
+    as they arrive; ``on_line(index, line)`` receives them instead of the
+    results when given.
+    """
+    
+    def __init__(self, commands, on_line=None):
+        self.commands = commands
+        self.marker = f"__CM_DONE_{uuid.uuid4().hex}__"
+        self.script = "".join(
+            f"{CM_BINARY} {command}; rc=$?; printf '\\n{self.marker} {index} %d\\n' $rc; printf '\\n{self.marker} {index}\\n' >&2\n"
+            for index, command in enumerate(commands)
+        )
+        self._results = [{'command': command, 'stdout': '', 'stderr': '', 'exit_code': None} for command in commands]
+        self._buffers = [[] for _ in commands]
+        self._emit = on_line or (lambda index, line: self._buffers[index].append(line))
+        # The sentinel is printed after a newline, so the line just before it is
+        # either the command's unterminated last line or an empty filler line
+        self._index = 0
+        self._held = None
+    
+    def feed_line(self, line):
+        line = line.rstrip('\r\n')
+        if line.startswith(self.marker):
+            _, index, exit_code = line.split()
+            if self._held:
+                self._emit(self._index, self._held)
+            self._held = None
+            self._results[int(index)]['exit_code'] = int(exit_code)
+            self._index = int(index) + 1
+            return
+        if self._held is not None and self._index < len(self.commands):
+            self._emit(self._index, self._held)
+        self._held = line
+    
+    def results(self, err):
+        """Finish the stdout stream and split ``err``; returns one dict per command"""
+        if self._held and self._index < len(self.commands):
+            self._emit(self._index, self._held)
+        self._held = None
+        for result, lines in zip(self._results, self._buffers):
+            result['stdout'] = "".join(f"{line}\n" for line in lines)
+        err_parts = re.split(rf"\n{self.marker} (\d+)\n", err)
+        for index in range(1, len(err_parts), 2):
+            self._results[int(err_parts[index])]['stderr'] = err_parts[index - 1]
+        return self._results
+
+
+def build_status(sections):
+    """API status payload from the raw ``info all``/``sim info``/``temp all`` output"""
+    return {
+        'device_info': sections['device_info'],
+        'sim_info': sections['sim_info'],
+        'temperature_info': sections['temperature_info'],
+        'device': parse_key_values(sections['device_info']),
+        'sim': parse_key_values(sections['sim_info']),
+        'temperatures': parse_temperatures(sections['temperature_info']),
+        'status': 'online'
+    }
+
+
+def send_command(number, message):
+    return f"sms send {shlex.quote(number)} {shlex.quote(message)}"
+
+
+def bulk_send_result(number, outcome):
+    """Per-recipient result of one ``sms send`` inside a batch"""
+    output = (outcome['stdout'].strip() + "\n" + outcome['stderr'].strip()).strip()
+    if outcome['exit_code'] is None:
+        return {'to_number': number, 'success': False, 'error': outcome['stderr'].strip() or 'No response from device'}
+    if outcome['exit_code'] != 0:
+        return {'to_number': number, 'success': False, 'error': output or f"Exit code {outcome['exit_code']}"}
+    return {'to_number': number, 'success': True, 'device_response': output, 'reference': parse_send_reference(output)}
+
+
+class DeviceUnavailableError(Exception):
+    """The device could not be reached, so the command never ran on it"""
+
+    def __init__(self, device, error):
+        super().__init__(f"Device {device} unavailable: {error}")
+        self.device = device
+
+
+class SendFailedError(Exception):
+    """The modem ran ``sms send`` and reported failure, so the message did not go out"""
+
+    def __init__(self, device, error, exit_code):
+        super().__init__(f"Send on {device} failed: {error}")
+        self.device = device
+        self.exit_code = exit_code
+
+
+def send_response(device, out, err, exit_code):
+    """Device response of a single ``sms send``, raising unless the modem sent it (see bulk_send_result)"""
+    if exit_code == MODEM_HOP_FAILED:
+        # The command never reached the modem, so another device may send it
+        raise DeviceUnavailableError(device, err.strip() or "SSH hop to the modem failed")
+    if exit_code:
+        output = (out.strip() + "\n" + err.strip()).strip()
+        raise SendFailedError(device, output or f"Exit code {exit_code}", exit_code)
+    return (out.strip() or err.strip()) or None
+
+
+class CircuitOpenError(DeviceUnavailableError):
+    """The device's circuit breaker is open, so the command was refused without trying it"""
+
+    def __init__(self, device, retry_in):
+        super().__init__(device, f"not responding, next attempt in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
 
 class UniFiSMSService:
-    def __init__(self):
-        self.ip = os.getenv("UNIFI_HOST")
-        self.username = os.getenv("UNIFI_USERNAME")
-        self.password = os.getenv("UNIFI_PASSWORD")
+    """One UniFi LTE gateway. Arguments default to the single-device UNIFI_* env vars."""
+
+    def __init__(self, name=None, host=None, username=None, password=None, phone_number=None, pool_size=None, port=None):
+        self.name = name or os.getenv("UNIFI_DEVICE_NAME", "default")
+        self.ip = host or os.getenv("UNIFI_HOST")
+        self.port = port or int(os.getenv("UNIFI_SSH_PORT", "22"))
+        self.username = username or os.getenv("UNIFI_USERNAME")
+        self.password = password or os.getenv("UNIFI_PASSWORD")
+        self.phone_number = phone_number if phone_number is not None else os.getenv("UNIFI_PHONE_NUMBER", "")
+        self.connect_timeout = float(os.getenv("UNIFI_SSH_CONNECT_TIMEOUT", "10"))
+        self.command_timeout = float(os.getenv("UNIFI_SSH_COMMAND_TIMEOUT", "30"))
+        # Shared with the async twin, so both fail fast while the device is down
+        self.breaker = CircuitBreaker(self.name)
+        # Priority lanes and send pacing for the modem, likewise shared
+        self.commands = CommandScheduler(self.name)
+        self.pool = SSHConnectionPool(
+            self.build_client,
+            max_size=pool_size or int(os.getenv("UNIFI_SSH_POOL_SIZE", "4")),
+            idle_timeout=float(os.getenv("UNIFI_SSH_IDLE_TIMEOUT", "300")),
+            keepalive_interval=int(os.getenv("UNIFI_SSH_KEEPALIVE", "30")),
+            acquire_timeout=float(os.getenv("UNIFI_SSH_ACQUIRE_TIMEOUT", "30"))
+        )
+        self.status_cache = TTLCache(
+            self._load_status_sections,
+            ttls={
+                'device_info': float(os.getenv("STATUS_CACHE_TTL_DEVICE_INFO", "300")),
+                'sim_info': float(os.getenv("STATUS_CACHE_TTL_SIM_INFO", "300")),
+                'temperature_info': float(os.getenv("STATUS_CACHE_TTL_TEMPERATURE", "30")),
+            },
+            stale_ttl=float(os.getenv("STATUS_CACHE_STALE_SECONDS", "120"))
+        )
     
     def build_client(self):
         """Build SSH client connection to UniFi device (from original sms.py)"""
         client = paramiko.client.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(self.ip, username=self.username, password=self.password)
-        client.exec_command("ifconfig usb0 up")
+        client.connect(self.ip, port=self.port, username=self.username, password=self.password, timeout=self.connect_timeout,
+                       banner_timeout=self.connect_timeout, auth_timeout=self.connect_timeout)
+        # Bring the modem link up once per session; wait so the first command doesn't race it
+        _stdin, _stdout, _stderr = client.exec_command("ifconfig usb0 up")
+        _stdout.channel.recv_exit_status()
         return client
     
+    def remote_command(self, command):
+        """Wrap a cm command in the hop from the gateway to the modem"""
+        return remote_command(command)
+    
     def run_command(self, client, command):
         """Run command on UniFi device (from original sms.py)"""
-        _stdin, _stdout, _stderr = client.exec_command(f"ssh -y root@$(cat /var/run/topipv6) '/legato/systems/current/bin/cm {command}'")
+        _stdin, _stdout, _stderr = client.exec_command(self.remote_command(command))
         return _stdout.read().decode(), _stderr.read().decode()
     
-    def get_device_status(self):
-        """Get device status (from original sms.py)"""
-        client = self.build_client()
+    def _exec(self, remote, stdin_data=None, on_line=None, label='other', lane='status', sends=0):
+        """Run a remote command in a modem slot on ``lane``, through the device's circuit breaker.
         
-        out_info, err_info = self.run_command(client, "info all")
-        out_sim, err_sim = self.run_command(client, "sim info")
-        out_temp, err_temp = self.run_command(client, "temp all")
+        The command first waits its turn in the command scheduler, which
+        raises ModemBusyError when the lane is full. While the circuit is open
+        this raises CircuitOpenError at once. Failed connects, broken or
+        timed-out sessions and a failed hop to the modem count towards opening
+        it; anything that completes closes it.
+        """
+        with self.commands.slot(lane, sends):
+            return self._exec_guarded(remote, stdin_data, on_line, label)
+    
+    def _exec_guarded(self, remote, stdin_data=None, on_line=None, label='other'):
+        retry_in = self.breaker.before_call()
+        if retry_in is not None:
+            raise CircuitOpenError(self.name, retry_in)
+        try:
+            out, err, exit_code = self._exec_pooled(remote, stdin_data, on_line, label)
+        except DeviceUnavailableError as e:
+            if isinstance(e.__cause__, PoolExhaustedError):
+                # Every session busy says nothing about the device
+                self.breaker.release()
+            else:
+                self.breaker.record_failure(e)
+            raise
+        except TRANSPORT_ERRORS as e:
+            self.breaker.record_failure(e)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if exit_code == MODEM_HOP_FAILED:
+            self.breaker.record_failure(err.strip() or "SSH hop to the modem failed")
+        else:
+            self.breaker.record_success()
+        return out, err, exit_code
+    
+    def _exec_pooled(self, remote, stdin_data=None, on_line=None, label='other'):
+        """Run a remote command over a pooled session, reconnecting once if the transport is broken.
         
-        client.close()
+        With ``on_line`` stdout is handed over line by line as it arrives from
+        the channel instead of being buffered, and the returned stdout is empty.
+        Failures before the command reached the device are raised as
+        DeviceUnavailableError, so callers know it is safe to try another device.
+        """
+        ran = False
+        try:
+            for attempt in range(2):
+                with self.pool.connection() as client:
+                    try:
+                        _stdin, _stdout, _stderr = client.exec_command(remote, timeout=self.command_timeout)
+                    except TRANSPORT_ERRORS as e:
+                        # The channel never opened, so the command did not run and retrying is safe
+                        self.pool.discard(client)
+                        if attempt:
+                            raise
+                        logger.warning("SSH session to %s broken (%s), reconnecting", self.name, e)
+                        SSH_RETRIES.inc()
+                        continue
+                    ran = True
+                    started = time.perf_counter()
+                    if stdin_data is not None:
+                        _stdin.write(stdin_data)
+                        _stdin.flush()
+                        _stdin.channel.shutdown_write()
+                    if on_line is None:
+                        out = _stdout.read().decode()
+                    else:
+                        out = ''
+                        for line in _stdout:
+                            on_line(line.decode() if isinstance(line, bytes) else line)
+                    err = _stderr.read().decode()
+                    exit_code = _stdout.channel.recv_exit_status()
+                    DEVICE_COMMAND_SECONDS.observe(time.perf_counter() - started, command=label)
+                    return out, err, exit_code
+        except (PoolExhaustedError, *TRANSPORT_ERRORS) as e:
+            if ran:
+                raise
+            raise DeviceUnavailableError(self.name, e) from e
+    
+    def execute(self, command, lane=None):
+        """Run a single cm command over a pooled session"""
+        out, err, _exit_code = self._exec(self.remote_command(command), label=command_label(command),
+                                          lane=lane or lane_for([command]), sends=count_sends([command]))
+        return out, err
+    
+    def execute_batch(self, commands, on_line=None, lane=None):
+        """Run several cm commands in one remote exec on the modem.
         
-        # Return structured data for API
-        return {
-            'device_info': out_info.strip(),
-            'sim_info': out_sim.strip(),
-            'temperature_info': out_temp.strip(),
-            'status': 'online'
-        }
+        The commands are fed to a single shell behind one nested ssh hop (see
+        BatchOutput). Returns one dict per command with ``stdout``, ``stderr``
+        and ``exit_code`` (None if the device stopped before reaching it).
+        
+        Stdout is consumed line by line; with ``on_line(index, line)`` the lines
+        are passed on as they arrive and not kept in the results.
+        """
+        batch = BatchOutput(commands, on_line)
+        _out, err, _exit_code = self._exec(MODEM_SHELL, stdin_data=batch.script, on_line=batch.feed_line, label='batch',
+                                           lane=lane or lane_for(commands), sends=count_sends(commands))
+        return batch.results(err)
+    
+    def pool_stats(self):
+        """SSH session pool size, idle timeout and health counters"""
+        return self.pool.stats()
+    
+    def _load_status_sections(self, sections):
+        """Cache loader: fetch the given status sections from the device"""
+        results = self.execute_batch([STATUS_COMMANDS[section] for section in sections])
+        return {section: result['stdout'].strip() for section, result in zip(sections, results)}
+    
+    def get_device_status(self, refresh=False):
+        """Get device status (from original sms.py), served from the status cache"""
+        sections = self.status_cache.get_many(list(STATUS_COMMANDS), refresh=refresh)
+        return build_status(sections)
 
-    def get_received_messages(self):
-        """Get received SMS messages (from original sms.py)"""
-        client = self.build_client()
+    def list_messages(self):
+        """Stream ``sms list`` from the device through the incremental parser"""
+        parser = SMSListParser()
+        messages = []
         
-        out_count, err_count = self.run_command(client, "sms count")
+        def handle(line):
+            record = parser.feed_line(line)
+            if record:
+                messages.append(record)
         
-        count = out_count.replace("\n", "")
-        if count == "0":
-            result = "NO STORED MESSAGES"
-        else:
-            out_list, err_list = self.run_command(client, "sms list")
-            result = f"{count} STORED MESSAGES:\n{out_list}"
+        self._exec(self.remote_command("sms list"), on_line=handle, label='sms list', lane='inbound')
+        last = parser.close()
+        if last:
+            messages.append(last)
+        return messages
+    
+    def count_messages(self):
+        """Number of messages in modem storage, or None if the device's answer is not a number"""
+        out, _err = self.execute("sms count")
+        count = out.strip()
+        return int(count) if count.isdigit() else None
+    
+    def get_received_messages(self, clear=False):
+        """Get received SMS messages (from original sms.py) as parsed records, optionally clearing them afterwards.
         
-        client.close()
-        return result
+        count, list and clear go to the device in one batch; the listing is
+        parsed while it streams in.
+        """
+        commands = ["sms count", "sms list"]
+        if clear:
+            commands.append("sms clear")
+        parser = SMSListParser()
+        messages = []
+        counts = []
+        
+        def handle(index, line):
+            if index == 0:
+                counts.append(line.strip())
+            elif index == 1:
+                record = parser.feed_line(line)
+                if record:
+                    messages.append(record)
+        
+        self.execute_batch(commands, on_line=handle)
+        last = parser.close()
+        if last:
+            messages.append(last)
+        
+        count = "".join(counts)
+        return {
+            'count': int(count) if count.isdigit() else len(messages),
+            'messages': messages
+        }
     
     def clear_messages(self):
         """Clear all stored messages (from original sms.py)"""
-        client = self.build_client()
-        self.run_command(client, "sms clear")
-        client.close()
+        self.execute("sms clear")
         return "ALL STORED MESSAGES CLEARED"
     
     def send_sms(self, number, message, user_id=None):
         """Send SMS message (from original sms.py with optional logging)"""
-        client = self.build_client()
-        
-        self.run_command(client, f"sms send {number} \"{message}\"")
-        
-        client.close()
+        command = send_command(number, message)
+        try:
+            # execute() drops the exit code, and a failed send exits non-zero
+            out, err, exit_code = self._exec(self.remote_command(command), label=command_label(command),
+                                             lane=lane_for([command]), sends=1)
+            device_response = send_response(self.name, out, err, exit_code)
+        except Exception:
+            SMS_FAILED.inc(mode='single')
+            raise
+        SMS_SENT.inc(mode='single')
+        # Delivery reports name the message by this reference (see services.delivery)
+        reference = parse_send_reference(device_response)
         
         # Log the SMS if user_id is provided (for 3-tier architecture)
         if user_id:
@@ -79,7 +406,10 @@ class UniFiSMSService:
                     to_number=number,
                     message=message,
                     direction='sent',
-                    status='sent'
+                    status='sent',
+                    device_response=device_response,
+                    device=self.name,
+                    device_reference=reference
                 )
                 db.session.add(sms_log)
                 db.session.commit()
@@ -88,10 +418,63 @@ class UniFiSMSService:
             except Exception as e:
                 return {'success': False, 'error': f'Message sent but logging failed: {str(e)}'}
         
-        return {'success': True, 'message': 'MESSAGE SENT'}
+        return {'success': True, 'message': 'MESSAGE SENT', 'device_response': device_response, 'reference': reference}
+    
+    def send_bulk(self, messages, user_id=None):
+        """Send many SMS messages through one pooled session and one shell on the modem.
+        
+        ``messages`` is a list of ``(number, message)`` tuples. Returns one result
+        dict per message, in order. With a send rate set the batch goes out in
+        chunks of at most the send burst, each waiting for its tokens; if a
+        later chunk cannot get a slot, its messages fail without being sent.
+        """
+        commands = [send_command(number, message) for number, message in messages]
+        chunk = self.commands.max_batch_sends or len(commands) or 1
+        results = []
+        for start in range(0, len(commands), chunk):
+            try:
+                results.extend(self.execute_batch(commands[start:start + chunk], lane='bulk'))
+            except (DeviceUnavailableError, ModemBusyError) as e:
+                if not start:
+                    # Nothing went out yet, so the caller may send it all elsewhere
+                    raise
+                logger.warning("Bulk send on %s stopped after %d message(s): %s", self.name, start, e)
+                results.extend({'stdout': '', 'stderr': str(e), 'exit_code': None} for _ in commands[start:])
+                break
+        sent = [bulk_send_result(number, outcome) for (number, _message), outcome in zip(messages, results)]
+        succeeded = sum(1 for result in sent if result['success'])
+        SMS_SENT.inc(succeeded, mode='batch')
+        SMS_FAILED.inc(len(sent) - succeeded, mode='batch')
+        
+        if user_id:
+            # One INSERT batch and one commit for the whole broadcast
+            logs = [
+                SMSLog(
+                    user_id=user_id,
+                    to_number=number,
+                    message=message,
+                    direction='sent',
+                    status='sent' if result['success'] else 'failed',
+                    device_response=result.get('device_response') or result.get('error'),
+                    device=self.name,
+                    device_reference=result.get('reference')
+                )
+                for (number, message), result in zip(messages, sent)
+            ]
+            try:
+                db.session.add_all(logs)
+                db.session.commit()
+                for result, sms_log in zip(sent, logs):
+                    result['log_id'] = sms_log.id
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Bulk send logging failed: %s", e)
+                for result in sent:
+                    result['logging_error'] = str(e)
+        
+        return sent
     
     # Additional methods for the 3-tier architecture compatibility
     def get_received_sms(self):
         """Get received SMS for JSON API response"""
-        messages = self.get_received_messages()
-        return {'messages': messages}
+        return self.get_received_messages()
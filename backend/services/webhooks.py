@@ -0,0 +1,345 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+from models import WebhookDeadLetter, WebhookDelivery, WebhookSubscription, db
+from services.events import message_events
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('inbound', 'sms')
+MAX_BATCH_SIZE = 100
+# Subscriptions are read on every SMSLog flush; changes made in other processes apply within this many seconds
+SUBSCRIPTION_CACHE_SECONDS = 10
+# Client errors worth retrying; any other 4xx means the endpoint rejects the request itself
+RETRY_STATUSES = (408, 425, 429)
+
+WEBHOOK_POST_SECONDS = registry.histogram(
+    'webhook_post_seconds', 'Time for a webhook endpoint to answer a POST', ['outcome'])
+WEBHOOK_DELIVERY_LAG_SECONDS = registry.histogram(
+    'webhook_delivery_lag_seconds', 'Time from an event being queued to its successful delivery',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 21600.0))
+WEBHOOK_EVENTS = registry.counter(
+    'webhook_events_total', 'Webhook events by delivery outcome', ['outcome'])
+
+_cache_lock = threading.Lock()
+_cache = {'expires': 0.0, 'subscriptions': []}
+
+
+def active_subscriptions(connection):
+    """``(id, event types)`` of the active subscriptions, cached for SUBSCRIPTION_CACHE_SECONDS"""
+    now = time.monotonic()
+    with _cache_lock:
+        if now < _cache['expires']:
+            return _cache['subscriptions']
+    table = WebhookSubscription.__table__
+    rows = connection.execute(select(table.c.id, table.c.events).where(table.c.is_active.is_(True))).all()
+    subscriptions = [(row.id, set(filter(None, row.events.split(',')))) for row in rows]
+    with _cache_lock:
+        _cache.update(expires=now + SUBSCRIPTION_CACHE_SECONDS, subscriptions=subscriptions)
+    return subscriptions
+
+
+def invalidate_subscriptions():
+    with _cache_lock:
+        _cache['expires'] = 0.0
+
+
+def sign(secret, timestamp, body):
+    """X-Webhook-Signature value: HMAC-SHA256 of ``<timestamp>.<body>``"""
+    digest = hmac.new(secret.encode('utf-8'), f'{timestamp}.'.encode('utf-8') + body, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def _retry_after(response):
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', '')))
+    except ValueError:
+        return None
+
+
+class WebhookDispatcher:
+    """Background delivery of queued webhook events.
+
+    Events are queued as WebhookDelivery rows in the transaction that writes
+    the SMSLog (see install), so none are lost to a crash or a rollback.
+    ``workers`` threads claim the oldest due rows, up to the subscription's
+    batch_size for one endpoint, and POST them as one JSON body over a
+    keep-alive HTTP session per thread. Failed deliveries are retried with
+    jittered exponential backoff; after ``max_attempts``, or on a client
+    error other than 408/425/429, they move to webhook_dead_letters.
+    Delivery is at least once: receivers dedupe on the event ``id``.
+    """
+
+    def __init__(self, workers=None, poll_interval=None, timeout=None, max_attempts=None, backoff_base=None,
+                 backoff_max=None):
+        self.workers = workers if workers is not None else int(os.getenv('WEBHOOK_WORKERS', '4'))
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.getenv('WEBHOOK_POLL_INTERVAL', '2'))
+        self.timeout = timeout or float(os.getenv('WEBHOOK_TIMEOUT', '10'))
+        self.max_attempts = max_attempts or int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '10'))
+        self.backoff_base = backoff_base or float(os.getenv('WEBHOOK_BACKOFF_BASE', '5'))
+        self.backoff_max = backoff_max or float(os.getenv('WEBHOOK_BACKOFF_MAX', '3600'))
+        self.app = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['webhook_dispatcher'] = self
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(index,), name=f'webhook-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self._threads:
+            logger.info("Started %d webhook delivery worker(s)", self.workers)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stats(self):
+        counts = dict(db.session.query(WebhookDelivery.status, db.func.count(WebhookDelivery.id))
+                      .group_by(WebhookDelivery.status).all())
+        return {
+            'workers': len(self._threads),
+            'pending': counts.get('pending', 0),
+            'delivering': counts.get('delivering', 0),
+            'dead_letters': db.session.query(db.func.count(WebhookDeadLetter.id)).scalar(),
+        }
+
+    def depth(self):
+        return WebhookDelivery.query.filter_by(status='pending').count()
+
+    def backoff(self, attempts, retry_after=None):
+        """Seconds before attempt ``attempts + 1``: exponential, jittered, never sooner than Retry-After"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def requeue_stale(self, now=None):
+        """Return rows claimed by a process that died mid-delivery to the queue"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.timeout * 2 + 60)
+        requeued = WebhookDelivery.query.filter(
+            WebhookDelivery.status == 'delivering', WebhookDelivery.claimed_at < cutoff
+        ).update({'status': 'pending', 'claim_token': None, 'claimed_at': None}, synchronize_session=False)
+        db.session.commit()
+        return requeued
+
+    def claim_batch(self):
+        """Claim the oldest due delivery plus more for the same endpoint, up to its batch_size.
+
+        Returns ``(subscription, deliveries)``, or None when nothing is due.
+        Safe across threads and processes.
+        """
+        while True:
+            now = datetime.utcnow()
+            head = (
+                db.session.query(WebhookDelivery.subscription_id)
+                .join(WebhookSubscription, WebhookSubscription.id == WebhookDelivery.subscription_id)
+                .filter(WebhookDelivery.status == 'pending', WebhookDelivery.next_attempt_at <= now,
+                        WebhookSubscription.is_active.is_(True))
+                .order_by(WebhookDelivery.next_attempt_at, WebhookDelivery.id).first()
+            )
+            if head is None:
+                db.session.rollback()
+                return None
+            subscription = db.session.get(WebhookSubscription, head.subscription_id)
+            batch_size = max(1, min(subscription.batch_size or 1, MAX_BATCH_SIZE))
+            ids = [
+                row.id for row in
+                db.session.query(WebhookDelivery.id)
+                .filter(WebhookDelivery.subscription_id == subscription.id, WebhookDelivery.status == 'pending',
+                        WebhookDelivery.next_attempt_at <= now)
+                .order_by(WebhookDelivery.next_attempt_at, WebhookDelivery.id).limit(batch_size)
+            ]
+            token = uuid.uuid4().hex
+            claimed = WebhookDelivery.query.filter(
+                WebhookDelivery.id.in_(ids), WebhookDelivery.status == 'pending'
+            ).update({'status': 'delivering', 'claim_token': token, 'claimed_at': now}, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                deliveries = WebhookDelivery.query.filter_by(claim_token=token).order_by(WebhookDelivery.id).all()
+                return subscription, deliveries
+
+    def deliver(self, subscription, deliveries):
+        """POST one claimed batch and record the outcome on its rows"""
+        body = json.dumps({'events': [
+            {
+                'id': delivery.event_id,
+                'event': delivery.event,
+                'created_at': delivery.created_at.isoformat(),
+                'data': json.loads(delivery.payload),
+            }
+            for delivery in deliveries
+        ]}, separators=(',', ':')).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'unifi-sms-gateway-webhooks/1.0'}
+        if subscription.secret:
+            headers['X-Webhook-Signature'] = sign(subscription.secret, int(time.time()), body)
+
+        error, permanent, retry_after = None, False, None
+        started = time.perf_counter()
+        try:
+            response = self._http().post(subscription.url, data=body, headers=headers, timeout=self.timeout)
+            if not 200 <= response.status_code < 300:
+                error = f'HTTP {response.status_code}'
+                permanent = 400 <= response.status_code < 500 and response.status_code not in RETRY_STATUSES
+                retry_after = _retry_after(response)
+        except requests.RequestException as e:
+            error = str(e) or type(e).__name__
+        WEBHOOK_POST_SECONDS.observe(time.perf_counter() - started, outcome='ok' if error is None else 'error')
+        self._record(subscription, deliveries, error, permanent, retry_after)
+        db.session.commit()
+
+    def _record(self, subscription, deliveries, error, permanent=False, retry_after=None):
+        now = datetime.utcnow()
+        if error is None:
+            for delivery in deliveries:
+                WEBHOOK_DELIVERY_LAG_SECONDS.observe((now - delivery.created_at).total_seconds())
+            WebhookDelivery.query.filter(
+                WebhookDelivery.id.in_([delivery.id for delivery in deliveries])
+            ).delete(synchronize_session=False)
+            subscription.last_success_at = now
+            subscription.last_error = None
+            WEBHOOK_EVENTS.inc(len(deliveries), outcome='delivered')
+            return
+
+        logger.warning("Webhook delivery of %d event(s) to subscription %s failed: %s",
+                       len(deliveries), subscription.id, error)
+        subscription.last_error = error
+        for delivery in deliveries:
+            delivery.attempts += 1
+            delivery.last_error = error
+            if permanent or delivery.attempts >= self.max_attempts:
+                db.session.add(WebhookDeadLetter(
+                    subscription_id=delivery.subscription_id,
+                    event_id=delivery.event_id,
+                    event=delivery.event,
+                    payload=delivery.payload,
+                    attempts=delivery.attempts,
+                    created_at=delivery.created_at,
+                    failed_at=now,
+                    last_error=error
+                ))
+                db.session.delete(delivery)
+                WEBHOOK_EVENTS.inc(outcome='dead')
+            else:
+                delivery.status = 'pending'
+                delivery.claim_token = None
+                delivery.claimed_at = None
+                delivery.next_attempt_at = now + timedelta(seconds=self.backoff(delivery.attempts, retry_after))
+                WEBHOOK_EVENTS.inc(outcome='retried')
+
+    def drain_once(self):
+        """Deliver one batch. Returns False when nothing is due."""
+        claimed = self.claim_batch()
+        if claimed is None:
+            return False
+        self.deliver(*claimed)
+        return True
+
+    def _http(self):
+        # One keep-alive session per worker thread; requests.Session is not thread-safe
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=2))
+            session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=2))
+        return session
+
+    def _run(self, index):
+        try:
+            while not self._stop.is_set():
+                try:
+                    with self.app.app_context():
+                        if index == 0:
+                            self.requeue_stale()
+                        while not self._stop.is_set() and self.drain_once():
+                            pass
+                except Exception as e:
+                    logger.error("Webhook worker error: %s", e)
+                # Woken early when this process queues events; the timeout picks up retries and other processes' events
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        finally:
+            session = getattr(self._local, 'session', None)
+            if session is not None:
+                session.close()
+
+
+def queue_events(session, events):
+    """Queue deliveries of ``(event, data, user_id)`` tuples in ``session``'s transaction (see events.queue_events)"""
+    if not events:
+        return
+    connection = session.connection()
+    subscriptions = active_subscriptions(connection)
+    now = datetime.utcnow()
+    # One id per event, shared by every subscription that gets it
+    events = [(uuid.uuid4().hex, event_type, json.dumps(data, separators=(',', ':'))) for event_type, data, _user_id in events]
+    rows = [
+        {
+            'subscription_id': subscription_id,
+            'event_id': event_id,
+            'event': event_type,
+            'payload': payload,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now,
+        }
+        for event_id, event_type, payload in events
+        for subscription_id, wanted in subscriptions if event_type in wanted
+    ]
+    if rows:
+        connection.execute(insert(WebhookDelivery.__table__), rows)
+        session.info['webhooks_queued'] = True
+
+
+def _after_flush(session, flush_context):
+    queue_events(session, message_events(session))
+
+
+def _after_commit(session):
+    if not session.info.pop('webhooks_queued', False) or not has_app_context():
+        return
+    dispatcher = current_app.extensions.get('webhook_dispatcher')
+    if dispatcher is not None:
+        dispatcher.wake()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    session.info.pop('webhooks_queued', None)
+
+
+def install():
+    """Queue webhook deliveries for SMSLog inserts and status changes in the transaction that makes them"""
+    for name, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                           ('after_soft_rollback', _after_soft_rollback)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
@@ -0,0 +1,9 @@
+"""Production entry point: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+Background threads are not started here; gunicorn.conf.py starts them in
+each worker after the fork, so every worker owns its SSH session pool,
+outbox workers, inbound poller and DB connection pool.
+"""
+from app import create_app
+
+app = create_app({'BACKGROUND_WORKERS': False})
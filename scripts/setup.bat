@@ -14,8 +14,6 @@ pip install -r requirements.txt
 REM Initialize database (optional - requires PostgreSQL running)
 echo Setting up database migrations...
 set FLASK_APP=app.py
-flask db init 2>nul
-flask db migrate -m "Initial migration" 2>nul
 flask db upgrade 2>nul
 
 cd ..
@@ -19,8 +19,6 @@ pip install -r requirements.txt
 
 # Initialize database
 echo "Setting up database..."
-flask db init || true
-flask db migrate -m "Initial migration" || true
 flask db upgrade || true
 
 cd ..
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import jwt
+import pytest
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'backend')
+
+# The backend imports its modules top-level (``from services...``), as when run from backend/
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+API_KEY = 'test-api-key-0123456789abcdef0123'
+
+# Read when app.py is imported: no log file, no API log thread, no real gateway
+os.environ.update({
+    'LOG_FILE': '',
+    'LOG_LEVEL': 'WARNING',
+    'SMS_API_KEY': API_KEY,
+    'APILOG_ENABLED': 'false',
+    'UNIFI_HOST': '127.0.0.1',
+    'UNIFI_USERNAME': 'test',
+    'UNIFI_PASSWORD': 'test',
+})
+os.environ.pop('UNIFI_DEVICES_FILE', None)
+os.environ.pop('DATABASE_URL', None)
+
+
+@pytest.fixture
+def fake_device():
+    """A fake UniFi gateway on a free local port"""
+    from fake_unifi import FakeUniFiDevice
+
+    device = FakeUniFiDevice(seed=1)
+    device.start_in_thread()
+    yield device
+    device.stop()
+
+
+@pytest.fixture
+def app(monkeypatch, fake_device):
+    """App on an in-memory SQLite database, talking to ``fake_device``, without background threads"""
+    from app import create_app, stop_background_workers
+    from models import db
+
+    monkeypatch.setenv('UNIFI_SSH_PORT', str(fake_device.port))
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'BACKGROUND_WORKERS': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    stop_background_workers(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    token = jwt.encode({'user_id': 1}, API_KEY, algorithm='HS256')
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def api_key_headers():
+    return {'auth': API_KEY}
@@ -0,0 +1,10 @@
+def test_invalid_since_is_a_400(client, api_key_headers):
+    response = client.get('/api/admin/api-logs/percentiles?since=yesterday', headers=api_key_headers)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid since; expected ISO 8601'}
+
+
+def test_slowest_since_iso_date(client, api_key_headers):
+    response = client.get('/api/admin/api-logs/slowest?since=2026-01-01T00:00:00', headers=api_key_headers)
+    assert response.status_code == 200
+    assert response.get_json() == []
@@ -0,0 +1,110 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import SMSLog, db
+from services.archive import RetentionWorker
+
+
+@pytest.fixture
+def archive(app, tmp_path, monkeypatch):
+    archive = app.extensions['sms_archive']
+    monkeypatch.setattr(archive, 'directory', str(tmp_path / 'archive'))
+    return archive
+
+
+@pytest.fixture
+def worker(app, archive):
+    return RetentionWorker(archive, retention_days=30, batch_size=2, pause=0)
+
+
+def add_log(timestamp, status='sent', message='hello'):
+    sms_log = SMSLog(user_id=1, to_number='+15550001', message=message, direction='sent', status=status,
+                     timestamp=timestamp, device='default')
+    db.session.add(sms_log)
+    db.session.commit()
+    return sms_log
+
+
+def test_expired_rows_move_to_day_files(worker, archive):
+    now = datetime(2026, 6, 1, 12)
+    old = [add_log(datetime(2026, 3, 1, 9) + timedelta(hours=index), message=f'old {index}').id for index in range(3)]
+    add_log(datetime(2026, 2, 28, 23, 59))
+    recent = add_log(now - timedelta(days=1)).id
+
+    # Three batches of at most two rows
+    assert worker.run_once(now) == 4
+    assert [row.id for row in SMSLog.query] == [recent]
+    assert [day.isoformat() for day in archive.days()] == ['2026-02-28', '2026-03-01']
+    assert archive.path_for(datetime(2026, 2, 28).date()).endswith('2026/02/sms_logs-2026-02-28.ndjson.gz')
+
+    rows = archive.read_day(datetime(2026, 3, 1).date())
+    assert [row['message'] for row in rows] == ['old 0', 'old 1', 'old 2']
+    assert [row['id'] for row in rows] == old
+    assert rows[0]['timestamp'] == '2026-03-01T09:00:00'
+    assert rows[0]['user_id'] == 1
+    assert worker.run_once(now) == 0
+
+
+def test_open_outbox_rows_are_kept(worker):
+    now = datetime(2026, 6, 1)
+    for status in ('scheduled', 'pending', 'sending'):
+        add_log(datetime(2026, 1, 1), status=status)
+    assert worker.run_once(now) == 0
+    assert SMSLog.query.count() == 3
+
+
+def test_rows_archived_twice_read_back_once(archive):
+    # Written, then the delete failed and the next run wrote the batch again
+    archive.append([_row(1, '2026-03-01T09:00:00')])
+    archive.append([_row(1, '2026-03-01T09:00:00')])
+    assert [row['id'] for row in archive.read_day(datetime(2026, 3, 1).date())] == [1]
+
+
+def test_truncated_member_keeps_what_was_complete(archive):
+    archive.append([_row(1, '2026-03-01T09:00:00')])
+    path = archive.path_for(datetime(2026, 3, 1).date())
+    with open(path, 'ab') as f:
+        f.write(gzip.compress(b'{"id": 2}\n')[:12])
+    assert [row['id'] for row in archive.read_day(datetime(2026, 3, 1).date())] == [1]
+
+
+def test_iter_rows_filters_by_time(archive):
+    archive.append([_row(1, '2026-03-01T09:00:00'), _row(2, '2026-03-02T09:00:00'), _row(3, '2026-03-03T09:00:00')])
+    rows = archive.iter_rows(datetime(2026, 3, 1, 10), datetime(2026, 3, 3, 9))
+    assert [row['id'] for row in rows] == [2]
+    newest = archive.iter_rows(newest_first=True)
+    assert [row['id'] for row in newest] == [3, 2, 1]
+
+
+def test_history_continues_into_the_archive(client, auth_headers, worker):
+    now = datetime.utcnow()
+    archived = add_log(now - timedelta(days=60), message='archived').id
+    live = add_log(now - timedelta(days=1), message='live').id
+    assert worker.run_once(now) == 1
+
+    live_only = client.get('/api/sms/history', headers=auth_headers).get_json()
+    assert [item['id'] for item in live_only['items']] == [live]
+    both = client.get('/api/sms/history?archived=1', headers=auth_headers).get_json()
+    assert [item['id'] for item in both['items']] == [live, archived]
+    assert both['items'][1]['message'] == 'archived'
+
+
+
+def test_export_streams_archived_rows_first(client, api_key_headers, worker):
+    now = datetime.utcnow()
+    archived = add_log(now - timedelta(days=60), message='archived').id
+    live = add_log(now - timedelta(days=1), message='live').id
+    worker.run_once(now)
+
+    body = client.get('/api/sms/logs/export?archived=1', headers=api_key_headers).get_data(as_text=True)
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [(row['id'], row['message']) for row in rows] == [(archived, 'archived'), (live, 'live')]
+
+
+def _row(log_id, timestamp):
+    values = dict.fromkeys(column.name for column in SMSLog.__table__.columns)
+    values.update(id=log_id, timestamp=timestamp, message=f'message {log_id}', direction='sent', status='sent')
+    return list(values.values())
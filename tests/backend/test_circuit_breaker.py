@@ -0,0 +1,92 @@
+import time
+
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        assert breaker.before_call() is None
+        breaker.record_failure('connect timed out')
+
+
+def test_opens_after_threshold_failures():
+    breaker = CircuitBreaker('gw', threshold=2, backoff_base=60)
+    assert breaker.before_call() is None
+    breaker.record_failure('connect timed out')
+    assert breaker.state == CLOSED
+
+    assert breaker.before_call() is None
+    breaker.record_failure('connect timed out')
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    # Refused at once, with the seconds until the probe
+    assert breaker.before_call() >= 1
+    assert breaker.rejected == 1
+    assert not breaker.available()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker('gw', threshold=2)
+    breaker.before_call()
+    breaker.record_failure('connect timed out')
+    breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    breaker.record_failure('connect timed out')
+    assert breaker.state == CLOSED
+
+
+def test_probe_success_closes():
+    breaker = CircuitBreaker('gw', threshold=1, backoff_base=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.state == HALF_OPEN
+    assert breaker.before_call() is None
+    # Exactly one probe at a time
+    assert breaker.before_call() is not None
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.stats()['consecutive_failures'] == 0
+
+
+def test_probe_failure_reopens_for_longer():
+    breaker = CircuitBreaker('gw', threshold=1, backoff_base=0.01, backoff_max=60)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.before_call() is None
+    breaker.record_failure('still down')
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    assert breaker._opened == 2
+
+
+def test_failures_in_flight_when_opened_do_not_extend_the_backoff():
+    breaker = CircuitBreaker('gw', threshold=2, backoff_base=60)
+    # Five calls let through while still closed, all failing
+    for _ in range(5):
+        assert breaker.before_call() is None
+    breaker.record_failure('connect timed out')
+    breaker.record_failure('connect timed out')
+    retry_at = breaker._retry_at
+    for _ in range(3):
+        breaker.record_failure('connection reset')
+    assert breaker._opened == 1
+    assert breaker._retry_at == retry_at
+    assert breaker.trips == 1
+    assert breaker.last_error == 'connection reset'
+
+
+def test_release_hands_the_probe_to_the_next_call():
+    breaker = CircuitBreaker('gw', threshold=1, backoff_base=0.01)
+    open_breaker(breaker)
+    time.sleep(0.02)
+    assert breaker.before_call() is None
+    breaker.release()
+    assert breaker.available()
+    assert breaker.before_call() is None
+
+
+def test_backoff_doubles_up_to_the_cap():
+    breaker = CircuitBreaker('gw', backoff_base=5, backoff_max=30)
+    for opened, delay in ((1, 5), (2, 10), (3, 20), (4, 30), (10, 30)):
+        assert delay / 2 <= breaker.backoff(opened) <= delay
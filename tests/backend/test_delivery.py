@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+from models import SMSLog, db
+
+
+def sent_log(reference, timestamp, device='default'):
+    sms_log = SMSLog(user_id=1, to_number='+15550001', message='hi', direction='sent', status='sent',
+                     timestamp=timestamp, device=device, device_reference=reference)
+    db.session.add(sms_log)
+    db.session.commit()
+    return sms_log
+
+
+def report(reference, status, timestamp):
+    return {'reference': reference, 'status': status, 'timestamp': timestamp.strftime('%y/%m/%d,%H:%M:%S+00')}
+
+
+def test_report_settles_the_matching_message(app):
+    reconciler = app.extensions['sms_delivery']
+    now = datetime.utcnow().replace(microsecond=0)
+    delivered = sent_log('7', now - timedelta(minutes=1))
+    other_device = sent_log('7', now - timedelta(minutes=1), device='gw2')
+
+    assert reconciler.apply_reports('default', [report('7', 'DELIVERED', now)]) == {'delivered': 1}
+    db.session.refresh(delivered)
+    db.session.refresh(other_device)
+    assert (delivered.status, other_device.status) == ('delivered', 'sent')
+    # Replaying the report is a no-op
+    assert reconciler.apply_reports('default', [report('7', 'DELIVERED', now)]) == {}
+
+
+def test_wrapped_reference_matches_newest_first(app):
+    reconciler = app.extensions['sms_delivery']
+    now = datetime.utcnow().replace(microsecond=0)
+    older = sent_log('3', now - timedelta(hours=2))
+    newer = sent_log('3', now - timedelta(minutes=1))
+
+    reports = [report('3', 'DELIVERED', now - timedelta(hours=1)), report('3', 'FAILED', now)]
+    assert reconciler.apply_reports('default', reports) == {'failed': 1, 'delivered': 1}
+    db.session.refresh(older)
+    db.session.refresh(newer)
+    assert (older.status, newer.status) == ('delivered', 'failed')
+
+
+def test_report_before_the_send_does_not_match(app):
+    reconciler = app.extensions['sms_delivery']
+    now = datetime.utcnow().replace(microsecond=0)
+    sent_log('9', now)
+    assert reconciler.apply_reports('default', [report('9', 'DELIVERED', now - timedelta(hours=1))]) == {}
+
+
+def test_report_stamped_west_of_utc(app):
+    reconciler = app.extensions['sms_delivery']
+    now = datetime.utcnow().replace(microsecond=0)
+    sms_log = sent_log('5', now - timedelta(minutes=1))
+    # The modem's clock runs at UTC-5: -20 quarter hours
+    local = (now - timedelta(hours=5)).strftime('%y/%m/%d,%H:%M:%S-20')
+    assert reconciler.apply_reports('default', [{'reference': '5', 'status': 'DELIVERED', 'timestamp': local}]) == {'delivered': 1}
+    db.session.refresh(sms_log)
+    assert sms_log.status == 'delivered'
+
+
+def test_poll_reads_reports_from_the_modem(app, fake_device):
+    fake_device.modem.report_rate = 1.0
+    outbox = app.extensions['sms_outbox']
+    sms_log = outbox.enqueue('+15550001', 'hello', user_id=1)
+    assert outbox.drain_once()
+
+    assert app.extensions['sms_delivery'].poll_once() == {'delivered': 1}
+    db.session.refresh(sms_log)
+    assert sms_log.status == 'delivered'
+
+
+def test_inbound_poller_applies_reports_from_its_listing(app, fake_device):
+    fake_device.modem.report_rate = 1.0
+    outbox = app.extensions['sms_outbox']
+    sms_log = outbox.enqueue('+15550001', 'hello', user_id=1)
+    assert outbox.drain_once()
+
+    app.extensions['sms_inbound'].poll_once()
+    db.session.refresh(sms_log)
+    assert sms_log.status == 'delivered'
+
+
+def test_reconciler_leaves_listing_to_the_inbound_poller(app):
+    reconciler = app.extensions['sms_delivery']
+    reconciler.start()
+    assert reconciler._thread is None
+    app.extensions['sms_inbound'].interval = 0
+    reconciler.start()
+    try:
+        assert reconciler._thread is not None
+    finally:
+        reconciler.shutdown()
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from models import StreamTicket, db
+from services.events import EventBroker
+
+
+def open_stream(client, query):
+    response = client.get(f'/api/sms/events?{query}', buffered=False)
+    response.close()
+    return response.status_code
+
+
+def test_ticket_opens_one_stream(client, auth_headers):
+    response = client.post('/api/sms/events/ticket', headers=auth_headers)
+    assert response.status_code == 201
+    ticket = response.get_json()['ticket']
+
+    assert open_stream(client, f'ticket={ticket}') == 200
+    # Single use: a replay, e.g. from a logged URL, is refused
+    assert open_stream(client, f'ticket={ticket}') == 401
+
+
+def test_expired_ticket_is_refused(client, auth_headers):
+    ticket = client.post('/api/sms/events/ticket', headers=auth_headers).get_json()['ticket']
+    StreamTicket.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    assert open_stream(client, f'ticket={ticket}') == 401
+
+
+def test_jwt_in_query_string_is_refused(client, auth_headers):
+    token = auth_headers['Authorization'].split(' ')[1]
+    assert open_stream(client, f'access_token={token}') == 401
+
+
+def test_ticket_requires_jwt(client):
+    assert client.post('/api/sms/events/ticket').status_code == 401
+
+
+def test_stream_cap_defaults_to_half_the_request_threads(monkeypatch):
+    monkeypatch.delenv('SMS_EVENTS_MAX_STREAMS', raising=False)
+    monkeypatch.setenv('GUNICORN_THREADS', '8')
+    assert EventBroker().max_streams == 4
+    monkeypatch.setenv('GUNICORN_THREADS', '1')
+    assert EventBroker().max_streams == 1
+    monkeypatch.setenv('SMS_EVENTS_MAX_STREAMS', '2')
+    assert EventBroker().max_streams == 2
+
+
+def test_streams_beyond_the_cap_are_refused(app, client, auth_headers, monkeypatch):
+    broker = app.extensions['sms_events']
+    monkeypatch.setattr(broker, 'max_streams', 1)
+    held = broker.subscribe(user_id=1)
+    try:
+        ticket = client.post('/api/sms/events/ticket', headers=auth_headers).get_json()['ticket']
+        response = client.get(f'/api/sms/events?ticket={ticket}', buffered=False)
+        assert response.status_code == 503
+        assert response.headers['Retry-After']
+        response.close()
+    finally:
+        broker.unsubscribe(held)
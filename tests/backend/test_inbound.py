@@ -0,0 +1,59 @@
+import pytest
+
+from models import SMSLog
+from services.modem_parser import fingerprint_messages, scope_fingerprint
+
+
+def test_poll_ingests_each_message_once(app, fake_device):
+    fake_device.modem.receive('+15550001', 'first')
+    fake_device.modem.receive('+15550001', 'first')
+    poller = app.extensions['sms_inbound']
+    first = poller.poll_once()
+    # Identical messages in one listing are still two rows
+    assert len(first) == 2
+    assert poller.poll_once() == []
+    assert SMSLog.query.filter_by(direction='received').count() == len(first)
+
+
+def test_single_device_fingerprints_are_scoped(app, fake_device):
+    # Adding a second gateway must not change the fingerprints of the first
+    fake_device.modem.receive('+15550001', 'hello')
+    app.extensions['sms_inbound'].poll_once()
+    service = app.extensions['unifi_service']
+    stored = {row.fingerprint for row in SMSLog.query.filter_by(direction='received')}
+    listing = [record for record in service.list_messages() if 'text' in record]
+    expected = {scope_fingerprint('default', message['fingerprint']) for message in fingerprint_messages(listing)}
+    assert stored and stored <= expected
+
+
+def test_empty_mailbox_is_only_counted(app, fake_device):
+    poller = app.extensions['sms_inbound']
+    # Opens the pooled session first, which costs a channel of its own
+    poller.poll_once()
+    channels = fake_device.stats()['channels']
+    assert poller.poll_once() == []
+    assert fake_device.stats()['channels'] - channels == 1
+
+    fake_device.modem.receive('+15550001', 'hello')
+    channels = fake_device.stats()['channels']
+    assert len(poller.poll_once()) == 1
+    # The count, then listing in one batch
+    assert fake_device.stats()['channels'] - channels == 2
+
+
+def test_cleared_messages_survive_a_failed_commit(app, fake_device, monkeypatch):
+    poller = app.extensions['sms_inbound']
+    poller.clear_after_ingest = True
+    fake_device.modem.receive('+15550001', 'hello')
+    ingest = poller.ingest
+
+    def fail(messages, service):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(poller, 'ingest', fail)
+    with pytest.raises(RuntimeError):
+        poller.poll_once()
+    assert fake_device.modem.inbox == []
+
+    monkeypatch.setattr(poller, 'ingest', ingest)
+    assert [row.message for row in poller.poll_once()] == ['hello']
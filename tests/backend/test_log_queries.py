@@ -0,0 +1,97 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import SMSLog, db
+from services import log_queries
+from services.log_queries import EXPORT_COLUMNS, decode_cursor, encode_cursor, keyset_page
+
+
+@pytest.fixture
+def logs(app):
+    start = datetime(2026, 1, 1)
+    # Pairs share a timestamp, so the id breaks the ties
+    rows = [SMSLog(user_id=1, to_number='+15550001', message=f'message {index}', direction='sent',
+                   status='sent', timestamp=start + timedelta(minutes=index // 2))
+            for index in range(7)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def test_cursor_round_trip(logs):
+    assert decode_cursor(encode_cursor(logs[3])) == (logs[3].timestamp, logs[3].id)
+
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor('not-a-cursor')
+
+
+def test_pages_cover_every_row_once_newest_first(logs):
+    seen = []
+    args = {'limit': '3'}
+    while True:
+        page, cursor = keyset_page(SMSLog.query, args)
+        seen.extend(row.id for row in page)
+        if cursor is None:
+            break
+        args = {'limit': '3', 'cursor': cursor}
+    expected = sorted(logs, key=lambda row: (row.timestamp, row.id), reverse=True)
+    assert seen == [row.id for row in expected]
+
+
+def test_last_full_page_has_no_cursor(logs):
+    page, cursor = keyset_page(SMSLog.query, {'limit': '7'})
+    assert len(page) == 7
+    assert cursor is None
+
+
+def test_history_route_pages(client, auth_headers, logs):
+    first = client.get('/api/sms/history?limit=4', headers=auth_headers).get_json()
+    second = client.get(f"/api/sms/history?limit=4&cursor={first['next_cursor']}", headers=auth_headers).get_json()
+    assert len(first['items']) == 4
+    assert len(second['items']) == 3
+    assert second['next_cursor'] is None
+    assert client.get('/api/sms/history?cursor=bad', headers=auth_headers).status_code == 400
+
+
+def test_ndjson_export_streams_every_row_oldest_first(client, api_key_headers, logs):
+    response = client.get('/api/sms/logs/export', headers=api_key_headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['id'] for row in rows] == [row.id for row in logs]
+    assert list(rows[0]) == EXPORT_COLUMNS
+    assert rows[0]['timestamp'] == '2026-01-01T00:00:00'
+
+
+def test_csv_export_has_a_header_and_honours_filters(client, api_key_headers, logs):
+    logs[0].status = 'failed'
+    db.session.commit()
+    response = client.get('/api/sms/logs/export?format=csv&status=failed', headers=api_key_headers)
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == EXPORT_COLUMNS
+    assert [row[EXPORT_COLUMNS.index('message')] for row in rows[1:]] == ['message 0']
+
+
+def test_gzip_export_is_chunked(client, api_key_headers, logs, monkeypatch):
+    # A chunk per row or so, to exercise the flushes
+    monkeypatch.setattr(log_queries, 'EXPORT_FLUSH_BYTES', 64)
+    response = client.get('/api/sms/logs/export?gzip=1', headers=api_key_headers, buffered=False)
+    chunks = list(response.response)
+    response.close()
+    assert len(chunks) > 1
+    lines = gzip.decompress(b''.join(chunks)).decode('utf-8').splitlines()
+    assert len(lines) == len(logs)
+    assert response.headers['Content-Disposition'].endswith('sms_logs.ndjson.gz')
+
+
+def test_export_refuses_unknown_formats(client, api_key_headers):
+    assert client.get('/api/sms/logs/export?format=xml', headers=api_key_headers).status_code == 400
+    assert client.get('/api/sms/logs/export?start=yesterday', headers=api_key_headers).status_code == 400
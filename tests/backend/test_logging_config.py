@@ -0,0 +1,31 @@
+import logging
+
+import logging_config
+
+
+def test_listener_restarts_in_forked_child(monkeypatch):
+    inherited = logging_config.configure_logging()
+    # As seen from a child forked after configure_logging(): same globals, no listener thread
+    monkeypatch.setattr(logging_config, '_listener_pid', -1)
+
+    listener = logging_config.configure_logging()
+    assert listener is not inherited
+    assert listener.handlers == inherited.handlers
+    assert logging.getLogger().handlers[0].queue is listener.queue
+    # Called again in the same process it is a no-op
+    assert logging_config.configure_logging() is listener
+
+
+def test_forked_child_writes_its_own_file(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOG_FILE', str(tmp_path / 'backend.log'))
+    monkeypatch.setenv('LOG_FILE_PER_PROCESS', 'true')
+    monkeypatch.setattr(logging_config, '_listener', None)
+    monkeypatch.setattr(logging.getLogger(), 'handlers', logging.getLogger().handlers)
+    inherited = logging_config.configure_logging()
+    # Forked child, seen with another pid
+    monkeypatch.setattr(logging_config.os, 'getpid', lambda: 4242)
+
+    listener = logging_config.configure_logging()
+    files = [handler.baseFilename for handler in listener.handlers if isinstance(handler, logging.FileHandler)]
+    assert files == [str(tmp_path / 'backend.4242.log')]
+    assert inherited.handlers[1].baseFilename != files[0]
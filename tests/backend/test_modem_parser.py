@@ -0,0 +1,86 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from services import modem_parser
+from services.modem_parser import SMSListParser, parse_sms_list, parse_key_values, parse_temperatures, parse_timestamp
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(modem_parser.__file__)), 'benchmarks', 'fixtures', 'modem')
+
+# Fixture name prefix -> parser for that kind of cm output
+PARSERS = {
+    'sms_list': parse_sms_list,
+    'info_all': parse_key_values,
+    'sim_info': parse_key_values,
+    'temp_all': parse_temperatures,
+}
+
+
+def fixture_names():
+    return sorted(name[:-4] for name in os.listdir(FIXTURES) if name.endswith('.txt'))
+
+
+@pytest.mark.parametrize('name', fixture_names())
+def test_fixture(name):
+    parser = next(func for prefix, func in PARSERS.items() if name.startswith(prefix))
+    with open(os.path.join(FIXTURES, name + '.txt')) as f:
+        parsed = parser(f.read())
+    with open(os.path.join(FIXTURES, name + '.json')) as f:
+        assert parsed == json.load(f)
+
+
+def test_field_like_body_without_length():
+    output = (
+        "Sender: +15551230007\n"
+        "Timestamp: 24/03/18 10:00:00\n"
+        "Text: Maintenance window\n"
+        "Time: 22:00 UTC\n"
+        "Type: planned\n"
+    )
+    assert parse_sms_list(output) == [{
+        'sender': '+15551230007',
+        'timestamp': '24/03/18 10:00:00',
+        'text': 'Maintenance window\nTime: 22:00 UTC\nType: planned',
+    }]
+
+
+def test_id_line_ends_body_without_length():
+    output = "ID: 0\nSender: +1\nText: first\nFrom: still text\nID: 1\nSender: +2\nText: second\n"
+    assert [(record['slot'], record['text']) for record in parse_sms_list(output)] == [
+        ('0', 'first\nFrom: still text'), ('1', 'second')
+    ]
+
+
+def test_length_prefix_ends_body():
+    body = "Report\nStatus: all good"
+    output = f"ID: 0\nSender: +1\nText ({len(body)}): {body}\nTimestamp: 24/03/18 10:00:00\n"
+    assert parse_sms_list(output) == [
+        {'slot': '0', 'sender': '+1', 'text': body, 'timestamp': '24/03/18 10:00:00'}
+    ]
+
+
+def test_streaming_matches_full_text():
+    with open(os.path.join(FIXTURES, 'sms_list_field_like_body.txt')) as f:
+        output = f.read()
+    parser = SMSListParser()
+    records = [record for record in map(parser.feed_line, output.splitlines(keepends=True)) if record]
+    last = parser.close()
+    if last:
+        records.append(last)
+    assert records == parse_sms_list(output)
+
+
+@pytest.mark.parametrize('value, expected', [
+    # Quarter-hour offsets: +04 is UTC+1, -20 is UTC-5
+    ('24/03/18,09:15:02+04', datetime(2024, 3, 18, 8, 15, 2)),
+    ('24/03/18,09:15:02-20', datetime(2024, 3, 18, 14, 15, 2)),
+    ('24/03/18,23:30:00-32', datetime(2024, 3, 19, 7, 30, 0)),
+    ('24/03/18 10:00:00', datetime(2024, 3, 18, 10, 0, 0)),
+    ('2024-03-18T10:00:00', datetime(2024, 3, 18, 10, 0, 0)),
+    ('yesterday', None),
+    ('', None),
+])
+def test_parse_timestamp_to_utc(value, expected):
+    assert parse_timestamp(value) == expected
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+from models import ModemSendBucket
+from services.modem_scheduler import CommandScheduler, ModemBusyError, SharedTokenBucket
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'buckets.db'}")
+    ModemSendBucket.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_sends_wait_for_tokens():
+    scheduler = CommandScheduler('gw', concurrency=2, send_rate=60, send_burst=1, wait_timeout=0.01)
+    with scheduler.slot('interactive', sends=1):
+        pass
+    started = time.monotonic()
+    with scheduler.slot('interactive', sends=1):
+        pass
+    # One token a second at 60 per minute; the timeout alone would have refused it
+    assert time.monotonic() - started >= 0.5
+
+
+def test_lane_depth_refuses_with_retry_after():
+    scheduler = CommandScheduler('gw', concurrency=1, depths={'bulk': 0})
+    with pytest.raises(ModemBusyError) as busy:
+        with scheduler.slot('bulk', sends=1):
+            pass
+    assert busy.value.retry_after >= 1
+
+
+def test_deadline_includes_token_cost():
+    scheduler = CommandScheduler('gw', concurrency=1, send_rate=6, send_burst=5, wait_timeout=60)
+    now = time.monotonic()
+    # Five sends take 50s to earn at 6 per minute
+    assert scheduler._deadline(5) - now == pytest.approx(110, abs=1)
+    assert scheduler._deadline(0) - now == pytest.approx(60, abs=1)
+
+
+def test_concurrency_split_between_processes(monkeypatch):
+    monkeypatch.setenv('UNIFI_MODEM_CONCURRENCY', '4')
+    monkeypatch.setenv('SMS_WORKER_PROCESSES', '2')
+    assert CommandScheduler('gw').concurrency == 2
+    monkeypatch.setenv('SMS_WORKER_PROCESSES', '8')
+    assert CommandScheduler('gw').concurrency == 1
+
+
+def test_shared_bucket_spans_schedulers(engine):
+    first = CommandScheduler('gw', send_rate=1, send_burst=3)
+    second = CommandScheduler('gw', send_rate=1, send_burst=3)
+    first.share(engine)
+    second.share(engine)
+    assert isinstance(first.bucket, SharedTokenBucket)
+
+    now = time.monotonic()
+    # Sends spend only what their process reserved, never querying under the scheduler lock
+    assert not first.bucket.take(2, now)
+    assert first.bucket.refill(2)
+    assert first.bucket.take(2, now)
+    assert second.bucket.refill(1)
+    assert second.bucket.take(1, now)
+    # Both drew from the same three tokens
+    assert not first.bucket.refill(1)
+    assert not first.bucket.take(1, now)
+    assert first.bucket.wait_time(1, now) > 30
+    assert first.stats()['shared_bucket'] is True
+
+
+def test_shared_bucket_keeps_devices_apart(engine):
+    first = SharedTokenBucket(1 / 60, 1, 'gw1', engine)
+    second = SharedTokenBucket(1 / 60, 1, 'gw2', engine)
+    assert first.refill(1)
+    assert second.refill(1)
+
+
+def test_shared_slot_waits_for_tokens_from_the_row(engine):
+    scheduler = CommandScheduler('gw', concurrency=1, send_rate=60, send_burst=1, wait_timeout=0.01)
+    scheduler.share(engine)
+    with scheduler.slot('interactive', sends=1):
+        pass
+    started = time.monotonic()
+    with scheduler.slot('interactive', sends=1):
+        pass
+    assert time.monotonic() - started >= 0.5
+
+
+def test_shared_slot_async_refills_off_the_loop(engine):
+    scheduler = CommandScheduler('gw', concurrency=1, send_rate=60, send_burst=2)
+    scheduler.share(engine)
+
+    async def send():
+        async with scheduler.slot_async('interactive', sends=1):
+            pass
+
+    asyncio.run(send())
+    # Reserved just the one token it spent; the other stays in the row for any process
+    assert scheduler.bucket.tokens == 0
+    assert scheduler.bucket.available(time.monotonic()) == pytest.approx(1, abs=0.1)
+
+
+def test_database_failure_paces_locally(engine):
+    bucket = SharedTokenBucket(1 / 60, 1, 'gw', engine)
+    engine.dispose()
+    ModemSendBucket.__table__.drop(engine)
+    assert not bucket.refill(1)
+    assert bucket.failed
+    assert bucket.take(1, time.monotonic())
+    assert not bucket.take(1, time.monotonic())
+
+
+def test_stats_do_not_query(engine):
+    scheduler = CommandScheduler('gw', send_rate=6, send_burst=5)
+    scheduler.share(engine)
+    scheduler.bucket.engine = None
+    assert scheduler.stats()['send_tokens'] == 5
+
+
+def test_unlimited_rate_stays_local(engine):
+    scheduler = CommandScheduler('gw', send_rate=0)
+    scheduler.share(engine)
+    assert not isinstance(scheduler.bucket, SharedTokenBucket)
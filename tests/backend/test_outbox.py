@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+from models import SMSLog, db
+
+
+def test_drain_sends_and_records_device(app, fake_device):
+    outbox = app.extensions['sms_outbox']
+    sms_log = outbox.enqueue('+15550001', 'hello', user_id=1)
+
+    assert outbox.drain_once() is True
+    db.session.refresh(sms_log)
+    assert sms_log.status == 'sent'
+    assert sms_log.device == 'default'
+    assert fake_device.modem.sent == 1
+    assert outbox.drain_once() is False
+
+
+def test_claim_records_claimed_at(app):
+    outbox = app.extensions['sms_outbox']
+    outbox.enqueue('+15550001', 'hello')
+
+    claimed = outbox.claim_next()
+    assert claimed.status == 'sending'
+    assert claimed.claimed_at is not None
+    assert outbox.claim_next() is None
+
+
+def test_requeue_stale_returns_only_old_claims(app):
+    outbox = app.extensions['sms_outbox']
+    stale = outbox.enqueue('+15550001', 'stale')
+    fresh = outbox.enqueue('+15550002', 'fresh')
+    outbox.claim_next()
+    outbox.claim_next()
+    SMSLog.query.filter_by(id=stale.id).update(
+        {'claimed_at': datetime.utcnow() - timedelta(seconds=outbox.claim_timeout + 1)})
+    db.session.commit()
+
+    assert outbox.requeue_stale() == 1
+    db.session.refresh(stale)
+    db.session.refresh(fresh)
+    assert (stale.status, stale.claimed_at) == ('pending', None)
+    assert fresh.status == 'sending'
+    assert outbox.claim_next().id == stale.id
+
+
+def test_modem_send_failure_marks_the_row_failed(app, fake_device):
+    fake_device.modem.fail_rate = 1.0
+    outbox = app.extensions['sms_outbox']
+    sms_log = outbox.enqueue('+15550001', 'hello', user_id=1)
+
+    outbox.drain_once()
+    db.session.refresh(sms_log)
+    assert sms_log.status == 'failed'
+    assert 'Failed to send SMS' in sms_log.device_response
+    assert fake_device.modem.sent == 0
+
+
+def test_modem_hop_failure_requeues(app, fake_device):
+    fake_device.modem_down = True
+    outbox = app.extensions['sms_outbox']
+    sms_log = outbox.enqueue('+15550001', 'hello', user_id=1)
+
+    assert outbox.drain_once() is False
+    db.session.refresh(sms_log)
+    assert (sms_log.status, sms_log.claimed_at) == ('pending', None)
+    assert fake_device.modem.sent == 0
+
+
+def test_unreachable_device_requeues(app, fake_device):
+    fake_device.stop()
+    outbox = app.extensions['sms_outbox']
+    sms_log = outbox.enqueue('+15550001', 'hello', user_id=1)
+
+    assert outbox.drain_once() is False
+    db.session.refresh(sms_log)
+    assert sms_log.status == 'pending'
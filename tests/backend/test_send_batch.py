@@ -0,0 +1,16 @@
+def test_batch_sends_every_message(client, auth_headers, fake_device):
+    response = client.post('/api/sms/send/batch', headers=auth_headers,
+                           json={'to_numbers': ['+15550001', '+15550002'], 'message': 'hello'})
+    assert response.status_code == 200
+    assert response.get_json()['sent'] == 2
+    assert fake_device.modem.sent == 2
+
+
+def test_unreachable_devices_answer_503(client, auth_headers, fake_device):
+    # The gateway goes away after the up-front circuit check has passed
+    fake_device.stop()
+    response = client.post('/api/sms/send/batch', headers=auth_headers,
+                           json={'to_numbers': ['+15550001', '+15550002'], 'message': 'hello'})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['device'] == 'default'
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import SMSLog, WebhookDelivery, WebhookSubscription, db
+from services import webhooks
+
+
+def test_release_due_moves_only_due_rows(app):
+    scheduler = app.extensions['sms_scheduler']
+    now = datetime.utcnow()
+    later = scheduler.schedule('+15550002', 'later', now + timedelta(hours=2))
+    soon = scheduler.schedule('+15550001', 'soon', now + timedelta(hours=1))
+    assert scheduler._heap[0] == (soon.send_at, soon.id)
+
+    assert scheduler.release_due(now) == 0
+    assert scheduler.release_due(now + timedelta(hours=1)) == 1
+    db.session.refresh(soon)
+    db.session.refresh(later)
+    assert (soon.status, later.status) == ('pending', 'scheduled')
+    assert scheduler._heap == [(later.send_at, later.id)]
+
+
+def test_due_message_goes_straight_to_the_outbox(app):
+    sms_log = app.extensions['sms_scheduler'].schedule('+15550001', 'now', datetime.utcnow() - timedelta(seconds=1))
+    assert sms_log.status == 'pending'
+
+
+def test_stale_heap_entries_are_no_ops(app):
+    scheduler = app.extensions['sms_scheduler']
+    now = datetime.utcnow()
+    cancelled = scheduler.schedule('+15550001', 'cancelled', now + timedelta(hours=1))
+    moved = scheduler.schedule('+15550002', 'moved', now + timedelta(hours=1))
+    assert scheduler.cancel(cancelled)
+    assert scheduler.reschedule(moved, now + timedelta(hours=3))
+
+    # Both old entries come due; neither row is released
+    assert scheduler.release_due(now + timedelta(hours=2)) == 0
+    assert scheduler.release_due(now + timedelta(hours=3)) == 1
+    assert not scheduler.cancel(cancelled)
+
+
+def test_load_rebuilds_the_heap(app):
+    scheduler = app.extensions['sms_scheduler']
+    send_at = datetime.utcnow() + timedelta(hours=1)
+    sms_log = scheduler.schedule('+15550001', 'hello', send_at)
+    scheduler._heap = []
+
+    scheduler.load()
+    assert scheduler._heap == [(send_at, sms_log.id)]
+
+
+def test_sweep_releases_rows_outside_the_heap(app):
+    scheduler = app.extensions['sms_scheduler']
+    send_at = datetime.utcnow() + timedelta(hours=1)
+    db.session.add(SMSLog(to_number='+15550001', message='other worker', direction='sent',
+                          status='scheduled', send_at=send_at, timestamp=send_at))
+    db.session.commit()
+
+    assert scheduler.release_due(send_at) == 0
+    assert scheduler.sweep(send_at) == 1
+
+
+def test_schedule_too_far_ahead_is_refused(app):
+    scheduler = app.extensions['sms_scheduler']
+    with pytest.raises(ValueError):
+        scheduler.schedule('+15550001', 'hello', datetime.utcnow() + scheduler.max_ahead + timedelta(days=1))
+
+
+def test_release_announces_each_row(app):
+    scheduler = app.extensions['sms_scheduler']
+    db.session.add(WebhookSubscription(url='http://hooks.example/sms', events='sms'))
+    db.session.commit()
+    webhooks.invalidate_subscriptions()
+    stream = app.extensions['sms_events'].subscribe(user_id=1)
+    send_at = datetime.utcnow() + timedelta(hours=1)
+    sms_log = scheduler.schedule('+15550001', 'hello', send_at, user_id=1)
+    WebhookDelivery.query.delete()
+    db.session.commit()
+    while not stream.queue.empty():
+        stream.queue.get_nowait()
+
+    assert scheduler.release_due(send_at) == 1
+    item = stream.queue.get_nowait()
+    assert item['data']['id'] == sms_log.id
+    assert item['data']['status'] == 'pending'
+    assert [delivery.event for delivery in WebhookDelivery.query] == ['sms']
@@ -0,0 +1,66 @@
+import pytest
+
+from services.ssh_pool import PoolExhaustedError
+
+
+@pytest.fixture
+def service(app):
+    return app.extensions['unifi_service']
+
+
+def test_sessions_are_reused(service, fake_device):
+    service.execute('sms count')
+    service.execute('sms count')
+    stats = service.pool.stats()
+    assert (stats['created'], stats['reused'], stats['open'], stats['idle']) == (1, 1, 1, 1)
+    assert fake_device.stats()['connections'] == 1
+
+
+def test_full_pool_waits_then_gives_up(service, monkeypatch):
+    monkeypatch.setattr(service.pool, 'max_size', 1)
+    monkeypatch.setattr(service.pool, 'acquire_timeout', 0.05)
+    held = service.pool.acquire()
+    try:
+        with pytest.raises(PoolExhaustedError):
+            service.pool.acquire()
+    finally:
+        service.pool.release(held)
+    # The released session serves the next caller
+    assert service.pool.acquire() is held
+    service.pool.release(held)
+
+
+def test_dead_idle_session_is_replaced(service, fake_device):
+    service.execute('sms count')
+    client, _last_used = service.pool._idle[0]
+    client.close()
+
+    out, _err = service.execute('sms count')
+    assert out.strip().isdigit()
+    stats = service.pool.stats()
+    assert (stats['reconnects'], stats['created'], stats['open']) == (1, 2, 1)
+    assert fake_device.stats()['connections'] == 2
+
+
+def test_expired_idle_session_is_closed(service, monkeypatch):
+    service.execute('sms count')
+    first = service.pool._idle[0][0]
+    monkeypatch.setattr(service.pool, 'idle_timeout', 0)
+
+    service.execute('sms count')
+    assert service.pool.stats()['expired'] == 1
+    assert first.get_transport() is None
+
+
+def test_broken_session_is_discarded(service):
+    with pytest.raises(OSError):
+        with service.pool.connection():
+            raise OSError('connection reset')
+    stats = service.pool.stats()
+    assert (stats['discarded'], stats['open']) == (1, 0)
+
+
+def test_close_all_drops_idle_sessions(service):
+    service.execute('sms count')
+    service.pool.close_all()
+    assert service.pool.stats()['open'] == 0
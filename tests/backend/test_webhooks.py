@@ -0,0 +1,146 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from models import WebhookDeadLetter, WebhookDelivery, WebhookSubscription, db
+from services import webhooks
+
+
+@pytest.fixture
+def endpoint():
+    """A local HTTP endpoint answering with the queued statuses (then 200) and recording each POST"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            server.received.append((dict(self.headers), json.loads(body)))
+            status, headers = server.responses.pop(0) if server.responses else (200, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.received = []
+    server.responses = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/hook'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dispatcher(app):
+    dispatcher = app.extensions['webhook_dispatcher']
+    dispatcher.max_attempts = 3
+    dispatcher.backoff_base = 5
+    dispatcher.backoff_max = 3600
+    return dispatcher
+
+
+def subscribe(url, secret=None):
+    subscription = WebhookSubscription(url=url, secret=secret, events='inbound')
+    db.session.add(subscription)
+    db.session.commit()
+    webhooks.invalidate_subscriptions()
+    return subscription
+
+
+def queue_inbound(text='hello'):
+    webhooks.queue_events(db.session, [('inbound', {'message': text}, None)])
+    db.session.commit()
+
+
+def test_delivery_posts_signed_events_and_removes_the_row(dispatcher, endpoint):
+    subscribe(endpoint.url, secret='s3cret')
+    queue_inbound()
+
+    assert dispatcher.drain_once()
+    headers, body = endpoint.received[0]
+    assert [event['data'] for event in body['events']] == [{'message': 'hello'}]
+    assert headers['X-Webhook-Signature'].startswith('t=')
+    assert WebhookDelivery.query.count() == 0
+    assert not dispatcher.drain_once()
+
+
+def test_server_error_is_retried_with_backoff(dispatcher, endpoint):
+    subscription = subscribe(endpoint.url)
+    queue_inbound()
+    endpoint.responses.append((503, {}))
+
+    before = datetime.utcnow()
+    assert dispatcher.drain_once()
+    delivery = WebhookDelivery.query.one()
+    assert (delivery.status, delivery.attempts, delivery.last_error) == ('pending', 1, 'HTTP 503')
+    # First retry after a jittered 2.5-5s
+    assert before + timedelta(seconds=2) <= delivery.next_attempt_at <= datetime.utcnow() + timedelta(seconds=5)
+    assert db.session.get(WebhookSubscription, subscription.id).last_error == 'HTTP 503'
+    # Not due yet
+    assert not dispatcher.drain_once()
+
+    delivery.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    assert dispatcher.drain_once()
+    assert WebhookDelivery.query.count() == 0
+
+
+def test_retry_after_defers_the_next_attempt(dispatcher, endpoint):
+    subscribe(endpoint.url)
+    queue_inbound()
+    endpoint.responses.append((429, {'Retry-After': '120'}))
+
+    assert dispatcher.drain_once()
+    delivery = WebhookDelivery.query.one()
+    assert delivery.next_attempt_at >= datetime.utcnow() + timedelta(seconds=115)
+
+
+def test_backoff_doubles_up_to_the_cap(dispatcher):
+    dispatcher.backoff_max = 30
+    for attempts, delay in ((1, 5), (2, 10), (3, 20), (4, 30), (10, 30)):
+        assert delay / 2 <= dispatcher.backoff(attempts) <= delay
+
+
+def test_last_attempt_moves_to_the_dead_letters(dispatcher, endpoint):
+    subscribe(endpoint.url)
+    queue_inbound()
+    endpoint.responses.extend([(500, {})] * dispatcher.max_attempts)
+
+    for _ in range(dispatcher.max_attempts):
+        WebhookDelivery.query.update({'next_attempt_at': datetime.utcnow()})
+        db.session.commit()
+        assert dispatcher.drain_once()
+    assert WebhookDelivery.query.count() == 0
+    dead = WebhookDeadLetter.query.one()
+    assert (dead.event, dead.attempts, dead.last_error) == ('inbound', dispatcher.max_attempts, 'HTTP 500')
+    assert json.loads(dead.payload) == {'message': 'hello'}
+
+
+def test_client_error_is_dead_lettered_at_once(dispatcher, endpoint):
+    subscribe(endpoint.url)
+    queue_inbound()
+    endpoint.responses.append((410, {}))
+
+    assert dispatcher.drain_once()
+    assert WebhookDelivery.query.count() == 0
+    assert WebhookDeadLetter.query.one().attempts == 1
+
+
+def test_unreachable_endpoint_is_retried(dispatcher, endpoint):
+    url = endpoint.url
+    endpoint.shutdown()
+    endpoint.server_close()
+    subscribe(url)
+    queue_inbound()
+
+    assert dispatcher.drain_once()
+    delivery = WebhookDelivery.query.one()
+    assert (delivery.status, delivery.attempts) == ('pending', 1)
+    assert delivery.last_error